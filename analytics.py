@@ -0,0 +1,287 @@
+"""
+Module that contains the sales analytics rollup tables and the functions for maintaining and querying them.
+
+The rollups live in 'ecommerce_sales.db' next to the 'sales' table and are updated in the same transaction
+as every sale, so statistics are read from a few small pre-aggregated rows instead of scanning 'sales' and
+joining it with the inventory.
+"""
+
+import sqlite3
+
+from service_client import inventory_client
+
+TOP_DEFAULT_LIMIT = 10
+TOP_MAX_LIMIT = 100
+
+def connect_to_db():
+    """
+    Establishes a connection to the database 'ecommerce_sales.db', which holds the rollup tables.
+
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect('ecommerce_sales.db')
+    return conn
+
+def create_rollup_tables(conn):
+    """
+    Creates the rollup tables if they do not already exist.
+
+    - 'sales_daily_item': units sold and revenue per day and item.
+    - 'sales_daily_category': units sold and revenue per day and category.
+    - 'customer_lifetime_value': number of purchases, revenue and first/last purchase per customer.
+
+    :param conn: An open connection to the sales database.
+    :type conn: sqlite3.Connection
+    """
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS sales_daily_item (
+            day TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            units INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (day, item_id)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS sales_daily_category (
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            units INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (day, category)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS customer_lifetime_value (
+            customer_id INTEGER PRIMARY KEY,
+            purchases INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            first_sale TEXT NOT NULL,
+            last_sale TEXT NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_customer_lifetime_value_revenue ON customer_lifetime_value (revenue DESC);
+    ''')
+
+def record_sale(cur, customer_id, item_id, sale_date, price_per_item, category, units=1):
+    """
+    Adds a sale to the rollup tables.
+
+    This is meant to be called with the cursor that inserted the sale, before committing, so that the sale
+    and its contribution to the rollups are written atomically.
+
+    :param cur: A cursor on the sales database.
+    :type cur: sqlite3.Cursor
+
+    :param customer_id: The unique identifier for the customer making the sale.
+    :type customer_id: int
+
+    :param item_id: The unique identifier for the item being sold.
+    :type item_id: int
+
+    :param sale_date: The date and time of the sale, formatted as 'YYYY-MM-DD HH:MM:SS'.
+    :type sale_date: str
+
+    :param price_per_item: The price the item was sold at.
+    :type price_per_item: float
+
+    :param category: The category of the item.
+    :type category: str
+
+    :param units: The number of units sold.
+    :type units: int
+    """
+    day = sale_date[:10]
+    revenue = price_per_item * units
+    cur.execute('''
+        INSERT INTO sales_daily_item (day, item_id, units, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, item_id) DO UPDATE SET
+            units = units + excluded.units,
+            revenue = revenue + excluded.revenue
+    ''', (day, item_id, units, revenue))
+    cur.execute('''
+        INSERT INTO sales_daily_category (day, category, units, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, category) DO UPDATE SET
+            units = units + excluded.units,
+            revenue = revenue + excluded.revenue
+    ''', (day, category, units, revenue))
+    cur.execute('''
+        INSERT INTO customer_lifetime_value (customer_id, purchases, revenue, first_sale, last_sale)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (customer_id) DO UPDATE SET
+            purchases = purchases + excluded.purchases,
+            revenue = revenue + excluded.revenue,
+            first_sale = min(first_sale, excluded.first_sale),
+            last_sale = max(last_sale, excluded.last_sale)
+    ''', (customer_id, units, revenue, sale_date, sale_date))
+
+def rebuild_rollups():
+    """
+    Recomputes the rollup tables from the sales of every partition, archived months included.
+
+    This backfills the rollups for sales recorded before they existed. Sales do not store the price they were
+    made at, so rebuilt revenue uses each item's current price and category.
+
+    :return: A dictionary containing the number of sales aggregated or an error message.
+    :rtype: dict
+    """
+    result = {}
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        create_rollup_tables(conn)
+        # Imported here because database3 imports this module to record sales.
+        from database3 import get_sales_in_range
+        rows = [(sale['customer_id'], sale['item_id'], sale['sale_date']) for sale in get_sales_in_range()]
+        items = inventory_client().get_items_by_ids(row[1] for row in rows)
+
+        cur.execute("DELETE FROM sales_daily_item")
+        cur.execute("DELETE FROM sales_daily_category")
+        cur.execute("DELETE FROM customer_lifetime_value")
+        for customer_id, item_id, sale_date in rows:
+            item = items.get(item_id, {})
+            record_sale(cur, customer_id, item_id, sale_date,
+                        item.get('price_per_item', 0.0), item.get('category', 'unknown'))
+        conn.commit()
+        result = {"sales": len(rows)}
+    except Exception as e:
+        conn.rollback()
+        result = {"error": f"Error rebuilding rollups: {e}"}
+    finally:
+        conn.close()
+
+    return result
+
+def _day_range(date_from, date_to):
+    """
+    Builds the WHERE clause restricting a rollup to a range of days.
+
+    :param date_from: The first day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :return: The WHERE clause (possibly empty) and its parameters.
+    :rtype: tuple
+    """
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("day >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("day <= ?")
+        params.append(date_to)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+def _query(sql, params):
+    """
+    Runs a read-only query against the rollup tables.
+
+    :param sql: The SQL statement.
+    :type sql: str
+
+    :param params: The statement's parameters.
+    :type params: list
+
+    :return: A list of dictionaries, one per row, or a dictionary containing an error message.
+    :rtype: list or dict
+    """
+    rows = []
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+    except Exception as e:
+        rows = {"error": f"Error getting sales statistics: {e}"}
+    finally:
+        conn.close()
+
+    return rows
+
+def get_daily_revenue(date_from=None, date_to=None):
+    """
+    Retrieves the units sold and revenue of each day.
+
+    :param date_from: The first day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :return: A list of dictionaries with day, units and revenue, ordered by day.
+    :rtype: list
+    """
+    where, params = _day_range(date_from, date_to)
+    return _query(f'''
+        SELECT day, SUM(units) AS units, SUM(revenue) AS revenue
+        FROM sales_daily_category{where}
+        GROUP BY day
+        ORDER BY day
+    ''', params)
+
+def get_item_revenue(date_from=None, date_to=None, limit=TOP_DEFAULT_LIMIT):
+    """
+    Retrieves the best selling items by revenue.
+
+    :param date_from: The first day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :param limit: The maximum number of items to return, capped at TOP_MAX_LIMIT.
+    :type limit: int
+
+    :return: A list of dictionaries with item_id, units and revenue, ordered by revenue.
+    :rtype: list
+    """
+    where, params = _day_range(date_from, date_to)
+    params.append(max(1, min(int(limit), TOP_MAX_LIMIT)))
+    return _query(f'''
+        SELECT item_id, SUM(units) AS units, SUM(revenue) AS revenue
+        FROM sales_daily_item{where}
+        GROUP BY item_id
+        ORDER BY revenue DESC, item_id
+        LIMIT ?
+    ''', params)
+
+def get_category_revenue(date_from=None, date_to=None):
+    """
+    Retrieves the units sold and revenue of each category.
+
+    :param date_from: The first day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last day to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :return: A list of dictionaries with category, units and revenue, ordered by revenue.
+    :rtype: list
+    """
+    where, params = _day_range(date_from, date_to)
+    return _query(f'''
+        SELECT category, SUM(units) AS units, SUM(revenue) AS revenue
+        FROM sales_daily_category{where}
+        GROUP BY category
+        ORDER BY revenue DESC, category
+    ''', params)
+
+def get_top_customers(limit=TOP_DEFAULT_LIMIT):
+    """
+    Retrieves the customers with the highest lifetime revenue.
+
+    :param limit: The maximum number of customers to return, capped at TOP_MAX_LIMIT.
+    :type limit: int
+
+    :return: A list of dictionaries with customer_id, purchases, revenue, first_sale and last_sale,
+             ordered by revenue.
+    :rtype: list
+    """
+    return _query('''
+        SELECT customer_id, purchases, revenue, first_sale, last_sale
+        FROM customer_lifetime_value
+        ORDER BY revenue DESC
+        LIMIT ?
+    ''', [max(1, min(int(limit), TOP_MAX_LIMIT))])
@@ -0,0 +1,71 @@
+import pytest
+from analytics import *
+from database2 import create_inventory_table, add_item
+from database3 import create_sales_table, make_sale
+
+@pytest.fixture
+def sales_database(tmp_path, monkeypatch):
+    """
+    Fixture to set up fresh inventory and sales databases in a temporary directory,
+    with two items and three sales of them.
+
+    :return: The two items that were sold.
+    :rtype: list
+    """
+    monkeypatch.chdir(tmp_path)
+    create_inventory_table()
+    create_sales_table()
+    laptop = add_item({'name': 'Laptop', 'category': 'electronics', 'price_per_item': 800.0,
+                       'description': 'A laptop', 'count_in_stock': 5})
+    shirt = add_item({'name': 'Shirt', 'category': 'clothes', 'price_per_item': 20.0,
+                      'description': 'A shirt', 'count_in_stock': 5})
+    make_sale(1, laptop['item_id'])
+    make_sale(2, shirt['item_id'])
+    make_sale(2, shirt['item_id'])
+    return [laptop, shirt]
+
+def test_get_daily_revenue(sales_database):
+    """
+    Test if the daily rollup adds up every sale of the day.
+    :param sales_database: Fixture to set up the sales database.
+    """
+    days = get_daily_revenue()
+    assert len(days) == 1
+    assert days[0]['units'] == 3
+    assert days[0]['revenue'] == 840.0
+    assert get_daily_revenue(date_to='2000-01-01') == []
+
+def test_get_item_revenue(sales_database):
+    """
+    Test if the item rollup is ordered by revenue.
+    :param sales_database: Fixture to set up the sales database.
+    """
+    laptop, shirt = sales_database
+    items = get_item_revenue()
+    assert [(item['item_id'], item['units']) for item in items] == [(laptop['item_id'], 1), (shirt['item_id'], 2)]
+    assert len(get_item_revenue(limit=1)) == 1
+
+def test_get_category_revenue(sales_database):
+    """
+    Test if the category rollup groups sales by the item's category.
+    :param sales_database: Fixture to set up the sales database.
+    """
+    categories = {row['category']: row['revenue'] for row in get_category_revenue()}
+    assert categories == {'electronics': 800.0, 'clothes': 40.0}
+
+def test_get_top_customers(sales_database):
+    """
+    Test if the customer lifetime value rollup counts purchases and revenue per customer.
+    :param sales_database: Fixture to set up the sales database.
+    """
+    customers = get_top_customers()
+    assert [(row['customer_id'], row['purchases'], row['revenue']) for row in customers] == [(1, 1, 800.0), (2, 2, 40.0)]
+
+def test_rebuild_rollups(sales_database):
+    """
+    Test if rebuilding the rollups from the sales table gives the incrementally maintained values.
+    :param sales_database: Fixture to set up the sales database.
+    """
+    before = (get_daily_revenue(), get_item_revenue(), get_category_revenue(), get_top_customers())
+    assert rebuild_rollups() == {'sales': 3}
+    assert (get_daily_revenue(), get_item_revenue(), get_category_revenue(), get_top_customers()) == before
@@ -0,0 +1,277 @@
+"""
+Module that contains the signed access tokens used to authenticate requests to the three services.
+
+A token is issued when a customer logs in. It carries the customer's id and username, a unique token id and the
+time it was issued, signed with HMAC by ``itsdangerous``. Verifying it only checks the signature and age, so no
+database is read per request. Tokens are revoked (on logout) by recording their id in the 'revoked_tokens'
+table of 'ecommerce_customers.db'; every process keeps the set of revoked ids in memory and reloads it at most
+every REVOCATION_REFRESH_SECONDS, so a revocation takes effect everywhere within that delay.
+
+Authentication is enforced when the application's ``AUTH_REQUIRED`` setting is true, which the services read
+from the environment variable of the same name. The signing key is read from ``AUTH_SECRET_KEY`` and must be
+the same for every service. A service requiring authentication refuses to start without it; otherwise, as in the
+tests, a random key is drawn for the process, so its tokens are accepted by no other process.
+
+Services calling each other authenticate with tokens issued by issue_service_token, whose subject names the
+service instead of a customer.
+
+Operators are the customers whose usernames are listed, comma-separated, in ``AUTH_OPERATORS``; endpoints that act
+on other customers' accounts, such as batch wallet updates, are reserved to them.
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import current_app, g, request, jsonify
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+TOKEN_MAX_AGE = 3600
+REVOCATION_REFRESH_SECONDS = 30
+SECRET_KEY = os.environ.get('AUTH_SECRET_KEY')
+
+_serializer = URLSafeTimedSerializer(SECRET_KEY or secrets.token_hex(32), salt='access-token')
+
+class InvalidTokenError(Exception):
+    """
+    Raised when an access token is malformed, tampered with, expired or revoked.
+    """
+
+
+def connect_to_db():
+    """
+    Establishes a connection to the database 'ecommerce_customers.db', which holds the revoked tokens.
+
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect('ecommerce_customers.db')
+    return conn
+
+def create_revoked_tokens_table(conn):
+    """
+    Creates the 'revoked_tokens' table if it does not already exist.
+
+    The table contains columns for jti (the id of the revoked token) and expires_at (the time after which the
+    token would be rejected anyway, as a UNIX timestamp, so the row can be deleted).
+
+    :param conn: An open connection to the customers database.
+    :type conn: sqlite3.Connection
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        );
+    ''')
+
+
+class RevocationList:
+    """
+    The ids of the revoked tokens, cached in memory and reloaded periodically.
+    """
+
+    def __init__(self, connect, refresh_seconds=REVOCATION_REFRESH_SECONDS):
+        """
+        :param connect: The function opening a connection to the database holding the 'revoked_tokens' table.
+        :type connect: callable
+        :param refresh_seconds: The maximum age of the cached set.
+        :type refresh_seconds: float
+        """
+        self.connect = connect
+        self.refresh_seconds = refresh_seconds
+        self.revoked = frozenset()
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def __contains__(self, jti):
+        """
+        Checks whether a token id is revoked, reloading the set first if it is stale.
+
+        Only one thread reloads at a time; the others keep using the previous set meanwhile.
+
+        :param jti: The token id.
+        :type jti: str
+        :return: True if the token is revoked.
+        :rtype: bool
+        """
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.refresh_seconds:
+            if self.lock.acquire(blocking=self.loaded_at is None):
+                try:
+                    self.refresh()
+                finally:
+                    self.lock.release()
+        return jti in self.revoked
+
+    def refresh(self):
+        """
+        Reloads the ids of the revoked tokens that have not expired yet.
+        """
+        try:
+            conn = self.connect()
+            try:
+                create_revoked_tokens_table(conn)
+                rows = conn.execute("SELECT jti FROM revoked_tokens WHERE expires_at > ?", (time.time(),)).fetchall()
+                self.revoked = frozenset(row[0] for row in rows)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error loading revoked tokens: {e}")
+        self.loaded_at = time.monotonic()
+
+    def revoke(self, jti, expires_at):
+        """
+        Revokes a token, here immediately and in other processes at their next refresh.
+
+        Revoked tokens that have expired are deleted at the same time.
+
+        :param jti: The token id.
+        :type jti: str
+        :param expires_at: The time the token expires, as a UNIX timestamp.
+        :type expires_at: float
+        """
+        try:
+            conn = self.connect()
+            try:
+                create_revoked_tokens_table(conn)
+                conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (time.time(),))
+                conn.execute("INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)", (jti, expires_at))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error revoking token: {e}")
+        self.revoked = self.revoked | {jti}
+
+
+revocation_list = RevocationList(connect_to_db)
+
+def issue_token(customer):
+    """
+    Issues an access token for a customer.
+
+    :param customer: The customer, with at least 'customer_id' and 'username'.
+    :type customer: dict
+    :return: The signed token.
+    :rtype: str
+    """
+    return _serializer.dumps({
+        'sub': customer['customer_id'],
+        'username': customer['username'],
+        'jti': uuid.uuid4().hex,
+    })
+
+def issue_service_token(name):
+    """
+    Issues an access token for a service calling the other services on its own behalf.
+
+    :param name: The name of the service, such as 'sales'.
+    :type name: str
+    :return: The signed token, whose subject is 'service:<name>'.
+    :rtype: str
+    """
+    return _serializer.dumps({
+        'sub': f'service:{name}',
+        'service': name,
+        'jti': uuid.uuid4().hex,
+    })
+
+def verify_token(token, max_age=TOKEN_MAX_AGE):
+    """
+    Verifies an access token without reading the database.
+
+    :param token: The signed token.
+    :type token: str
+    :param max_age: The maximum age of the token in seconds.
+    :type max_age: int
+    :return: The token's claims, with the time it was issued under 'iat'.
+    :rtype: dict
+    :raises InvalidTokenError: If the token is malformed, tampered with, expired or revoked.
+    """
+    try:
+        claims, issued_at = _serializer.loads(token, max_age=max_age, return_timestamp=True)
+    except SignatureExpired:
+        raise InvalidTokenError("Token expired")
+    except BadSignature:
+        raise InvalidTokenError("Invalid token")
+    if claims['jti'] in revocation_list:
+        raise InvalidTokenError("Token revoked")
+    claims['iat'] = issued_at.timestamp()
+    return claims
+
+def revoke_token(claims):
+    """
+    Revokes a verified access token.
+
+    :param claims: The claims returned by verify_token.
+    :type claims: dict
+    """
+    revocation_list.revoke(claims['jti'], claims['iat'] + TOKEN_MAX_AGE)
+
+def bearer_token():
+    """
+    Reads the bearer token from the current request's ``Authorization`` header.
+
+    :return: The token, or None if the header is missing or of another scheme.
+    :rtype: str or None
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return token.strip()
+
+def is_operator(claims):
+    """
+    Checks whether a verified token was issued to an operator, one of the application's ``AUTH_OPERATORS``.
+
+    :param claims: The claims returned by verify_token, or None for an unauthenticated request.
+    :type claims: dict or None
+    :return: True if the token's customer is an operator.
+    :rtype: bool
+    """
+    return claims is not None and claims.get('username') in current_app.config['AUTH_OPERATORS']
+
+def init_auth(app, public_endpoints=()):
+    """
+    Makes an application authenticate its requests when its ``AUTH_REQUIRED`` setting is true.
+
+    Requests to other endpoints than public_endpoints must then carry a valid bearer token, and are answered
+    with status 401 otherwise. The claims of a valid token are available as ``flask.g.auth``, whether or not
+    authentication is required.
+
+    :param app: The application.
+    :type app: flask.Flask
+    :param public_endpoints: The names of the endpoints that can be called without a token.
+    :type public_endpoints: tuple
+    :raises RuntimeError: If authentication is required and ``AUTH_SECRET_KEY`` is not set.
+    """
+    app.config.setdefault('AUTH_REQUIRED', os.environ.get('AUTH_REQUIRED', '').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('AUTH_OPERATORS', tuple(username.strip() for username in
+                                                 os.environ.get('AUTH_OPERATORS', '').split(',')
+                                                 if username.strip()))
+    if app.config['AUTH_REQUIRED'] and not SECRET_KEY:
+        raise RuntimeError("AUTH_SECRET_KEY must be set when AUTH_REQUIRED is")
+    public_endpoints = set(public_endpoints)
+
+    @app.before_request
+    def authenticate_request():
+        g.auth = None
+        token = bearer_token()
+        required = app.config['AUTH_REQUIRED'] and request.method != 'OPTIONS' \
+            and request.endpoint not in public_endpoints
+        if token is None:
+            if required:
+                return jsonify({"error": "Authentication required"}), 401, {'WWW-Authenticate': 'Bearer'}
+            return None
+        try:
+            g.auth = verify_token(token)
+        except InvalidTokenError as e:
+            if required:
+                return jsonify({"error": str(e)}), 401, {'WWW-Authenticate': 'Bearer error="invalid_token"'}
+        return None
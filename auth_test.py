@@ -0,0 +1,93 @@
+import sqlite3
+import time
+import pytest
+import auth
+from flask import Flask
+from auth import *
+
+
+@pytest.fixture(autouse=True)
+def isolated_revocations(tmp_path, monkeypatch):
+    """
+    Fixture to run each test in an empty directory with a fresh revocation list.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(auth, 'revocation_list', RevocationList(connect_to_db))
+
+def test_issue_and_verify_token():
+    """
+    Test if a token carries the customer's identity and fails verification once tampered with.
+    """
+    token = issue_token({'customer_id': 7, 'username': 'jane'})
+    claims = verify_token(token)
+    assert claims['sub'] == 7 and claims['username'] == 'jane'
+    assert abs(claims['iat'] - time.time()) < 5
+    with pytest.raises(InvalidTokenError):
+        verify_token(token[:-2] + ('A' if token[-2] != 'A' else 'B') + token[-1])
+    with pytest.raises(InvalidTokenError):
+        verify_token('not-a-token')
+
+def test_verify_token_expired():
+    """
+    Test if a token older than max_age is rejected.
+    """
+    token = issue_token({'customer_id': 7, 'username': 'jane'})
+    with pytest.raises(InvalidTokenError, match='expired'):
+        verify_token(token, max_age=-1)
+
+def test_revoke_token():
+    """
+    Test if a revoked token is rejected here at once and by other processes after their next refresh.
+    """
+    token = issue_token({'customer_id': 7, 'username': 'jane'})
+    other_process = RevocationList(connect_to_db, refresh_seconds=3600)
+    claims = verify_token(token)
+    assert claims['jti'] not in other_process
+    revoke_token(claims)
+    with pytest.raises(InvalidTokenError, match='revoked'):
+        verify_token(token)
+    assert claims['jti'] not in other_process
+    other_process.refresh()
+    assert claims['jti'] in other_process
+
+def test_revocation_list_is_cached():
+    """
+    Test if checking a token does not read the database until the cached set is stale.
+    """
+    connections = []
+
+    def connect():
+        connections.append(1)
+        return connect_to_db()
+
+    revocations = RevocationList(connect, refresh_seconds=3600)
+    for _ in range(100):
+        assert 'unknown' not in revocations
+    assert len(connections) == 1
+
+def test_revocation_list_survives_failed_connection(capsys):
+    """
+    Test if a database that cannot be opened is reported, not raised, and revoked tokens stay revoked here.
+    """
+    def connect():
+        raise sqlite3.OperationalError("unable to open database file")
+
+    revocations = RevocationList(connect)
+    assert 'unknown' not in revocations
+    revocations.revoke('revoked', time.time() + 60)
+    assert 'revoked' in revocations
+    output = capsys.readouterr().out
+    assert "Error loading revoked tokens: unable to open" in output
+    assert "Error revoking token: unable to open" in output
+
+def test_init_auth_requires_secret_key(monkeypatch):
+    """
+    Test if a service requiring authentication refuses to start without a signing key.
+    """
+    app = Flask(__name__)
+    app.config['AUTH_REQUIRED'] = True
+    monkeypatch.setattr(auth, 'SECRET_KEY', None)
+    with pytest.raises(RuntimeError):
+        init_auth(app)
+    monkeypatch.setattr(auth, 'SECRET_KEY', 'a-shared-key')
+    init_auth(app)
@@ -0,0 +1,144 @@
+"""
+Benchmark of the JSON serialisation of whole-table responses.
+
+Fetching and encoding are timed separately. Encoding compares, on the same rows:
+
+- Flask's default provider encoding a list of dictionaries built from sqlite3.Row objects, as the services used to;
+- FastJSONProvider encoding a RowSet, with orjson when installed and with the standard library;
+- row tuples written between column names encoded once per query, each value encoded on its own, which is the
+  alternative to building a dictionary per row.
+
+Usage::
+
+    python benchmark_json.py [--rows N] [--repeat N]
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+import json_provider
+from json_provider import FastJSONProvider, RowSet
+
+def make_inventory(rows):
+    """
+    Creates an in-memory inventory table.
+
+    :param rows: The number of items.
+    :type rows: int
+    :return: The connection to the database.
+    :rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE inventory (
+            item_id INTEGER PRIMARY KEY, name TEXT, category TEXT, price_per_item REAL,
+            description TEXT, count_in_stock INTEGER, version INTEGER
+        )
+    ''')
+    conn.executemany("INSERT INTO inventory VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     ((i, f"Item {i}", 'food', i * 0.25, f"Description of item {i}", i % 50, 1) for i in range(rows)))
+    return conn
+
+def best_time(function, repeat):
+    """
+    Measures the best time of a function.
+
+    :param function: The function.
+    :type function: callable
+    :param repeat: The number of measurements.
+    :type repeat: int
+    :return: The best time in seconds and the function's last result.
+    :rtype: tuple
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def time_response(provider_class, value, repeat):
+    """
+    Measures the best time to serialise a value to a response.
+
+    :param provider_class: The JSON provider of the application.
+    :type provider_class: type
+    :param value: The value to serialise.
+    :param repeat: The number of measurements.
+    :type repeat: int
+    :return: The best time in seconds and the size of the body in bytes.
+    :rtype: tuple
+    """
+    app = Flask(__name__)
+    app.json = provider_class(app)
+    with app.app_context():
+        elapsed, body = best_time(lambda: jsonify(value).get_data(), repeat)
+    return elapsed, len(body)
+
+def encode_with_keys(row_set, encode_value):
+    """
+    Encodes a RowSet without dictionaries: the column names are encoded once, and each row's values are written
+    between them.
+
+    :param row_set: The rows.
+    :type row_set: RowSet
+    :param encode_value: The function encoding a single value to bytes.
+    :type encode_value: callable
+    :return: The JSON document.
+    :rtype: bytes
+    """
+    template = b'{' + b','.join(json.dumps(column).encode().replace(b'%', b'%%') + b':%b'
+                                for column in row_set.columns) + b'}'
+    values = zip(*(map(encode_value, column) for column in zip(*row_set.rows)))
+    return b'[' + b','.join(map(template.__mod__, values)) + b']'
+
+def main():
+    """
+    Runs the benchmark from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the JSON serialisation of whole-table responses.")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    conn = make_inventory(args.rows)
+
+    def fetch_dicts():
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        return [dict(row) for row in cur.execute("SELECT * FROM inventory")]
+
+    def fetch_row_set():
+        return RowSet.from_cursor(conn.execute("SELECT * FROM inventory"))
+
+    elapsed, dicts = best_time(fetch_dicts, args.repeat)
+    print(f"{'Fetch, dict per sqlite3.Row':<40} {elapsed * 1000:8.1f} ms")
+    elapsed, row_set = best_time(fetch_row_set, args.repeat)
+    print(f"{'Fetch, RowSet of tuples':<40} {elapsed * 1000:8.1f} ms")
+
+    baseline, size = time_response(DefaultJSONProvider, dicts, args.repeat)
+    print(f"Encode {args.rows} rows, {size / 1e6:.1f} MB")
+    print(f"{'Flask default, dict per row':<40} {baseline * 1000:8.1f} ms")
+
+    encoders = [('json', lambda value: json.dumps(value, ensure_ascii=False).encode())]
+    if json_provider.orjson is not None:
+        encoders.insert(0, ('orjson', json_provider.orjson.dumps))
+    for name, encode_value in encoders:
+        orjson = json_provider.orjson
+        if name == 'json':
+            json_provider.orjson = None
+        try:
+            elapsed, _ = time_response(FastJSONProvider, row_set, args.repeat)
+        finally:
+            json_provider.orjson = orjson
+        print(f"{'FastJSONProvider + RowSet, ' + name:<40} {elapsed * 1000:8.1f} ms  {baseline / elapsed:4.1f}x")
+        elapsed, _ = best_time(lambda: encode_with_keys(row_set, encode_value), args.repeat)
+        print(f"{'Keys encoded once, row tuples, ' + name:<40} {elapsed * 1000:8.1f} ms  {baseline / elapsed:4.1f}x")
+
+if __name__ == "__main__":
+    main()
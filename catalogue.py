@@ -0,0 +1,233 @@
+"""
+Module that maintains the pre-serialised snapshot of the full catalogue served by ``/api/inventory/all``.
+
+The snapshot keeps every item already encoded as JSON, together with the position of the inventory's change log
+it reflects. Before answering, the service checks the position of the log, a single-row lookup, and applies only
+the changes made since: the change log records the whole row after every write, so changed items are re-encoded
+from it without querying the inventory, and the body is reassembled from the encoded items. When nothing changed,
+the same bytes object is sent again, without reading the table or serialising anything.
+
+With a snapshot directory, the body is also written to a file named after its position, which every worker
+process of the service shares: a worker finding the file of the current position serves it without building the
+body itself, and the file is sent by the WSGI server's file wrapper, which can hand it to the kernel with
+sendfile instead of copying it through Python. Workers delete all but the SNAPSHOT_KEEP most recent files, so a
+file is opened when the response is prepared and sent from the open file, which stays readable if it is deleted
+meanwhile.
+"""
+
+import glob
+import os
+import threading
+
+from cdc import get_changes, last_change_seq, CHANGES_MAX_LIMIT
+from json_provider import encode
+
+SNAPSHOT_PREFIX = 'inventory-'
+SNAPSHOT_SUFFIX = '.json'
+SNAPSHOT_KEEP = 2
+INCREMENTAL_MAX_CHANGES = 10000
+
+class Snapshot:
+    """
+    A version of the catalogue.
+    """
+
+    __slots__ = ('seq', 'body', 'path')
+
+    def __init__(self, seq, body, path=None):
+        """
+        :param seq: The position of the change log the catalogue reflects.
+        :type seq: int
+        :param body: The catalogue, as a JSON array of items.
+        :type body: bytes
+        :param path: The file holding the body, when a snapshot directory is used.
+        :type path: str or None
+        """
+        self.seq = seq
+        self.body = body
+        self.path = path
+
+
+class CatalogueSnapshot:
+    """
+    Keeps the catalogue of an inventory database serialised and up to date.
+    """
+
+    def __init__(self, connect, columns, directory=None):
+        """
+        :param connect: The function opening a connection to the inventory database.
+        :type connect: callable
+        :param columns: The columns of the 'inventory' table, in the order items are serialised; the first one
+                        is the primary key. The change log must record all of them.
+        :type columns: tuple
+        :param directory: The directory to share snapshot files in, or None to keep the snapshot in memory only.
+        :type directory: str or None
+        """
+        self.connect = connect
+        self.columns = tuple(columns)
+        self.directory = directory
+        self.items = None
+        self.seq = None
+        self.snapshot = None
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def current(self):
+        """
+        Returns the snapshot of the current catalogue, bringing it up to date first.
+
+        :return: The snapshot.
+        :rtype: Snapshot
+        """
+        seq = last_change_seq(self.connect)
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.seq == seq:
+            return snapshot
+        with self.lock:
+            if self.snapshot is None or self.snapshot.seq != seq:
+                self.snapshot = self._shared_snapshot(seq) or self._build()
+            return self.snapshot
+
+    def current_body(self):
+        """
+        Returns the current catalogue, as bytes or as an open snapshot file written by another worker.
+
+        When that file has been deleted since it was found, this worker builds the snapshot itself.
+
+        :return: The snapshot, and its body or its open file, which the caller must close.
+        :rtype: tuple
+        """
+        while True:
+            snapshot = self.current()
+            if snapshot.body is not None:
+                return snapshot, snapshot.body
+            try:
+                return snapshot, open(snapshot.path, 'rb')
+            except FileNotFoundError:
+                with self.lock:
+                    if self.snapshot is snapshot:
+                        self.snapshot = self._build()
+
+    def _shared_snapshot(self, seq):
+        """
+        Looks for a snapshot file of a position written by another worker.
+
+        :param seq: The position of the change log.
+        :type seq: int
+        :return: The snapshot, or None if there is no snapshot directory or no file for the position.
+        :rtype: Snapshot or None
+        """
+        if not self.directory:
+            return None
+        path = self._path(seq)
+        if not os.path.exists(path):
+            return None
+        # This worker's encoded items stay at their own position; _build catches them up when a file is missing.
+        return Snapshot(seq, None, path)
+
+    def _build(self):
+        """
+        Brings the encoded items up to date, incrementally when possible, and assembles the body.
+
+        :return: The new snapshot.
+        :rtype: Snapshot
+        """
+        if self.items is None or not self._apply_changes():
+            self._load()
+        body = b'[' + b','.join(self.items.values()) + b']'
+        path = self._write(body) if self.directory else None
+        return Snapshot(self.seq, body, path)
+
+    def _load(self):
+        """
+        Encodes every item of the inventory, reading the table and the position of the change log in one
+        transaction so that they agree.
+        """
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN")
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+            rows = conn.execute(
+                f"SELECT {', '.join(self.columns)} FROM inventory ORDER BY {self.columns[0]}"
+            ).fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self.seq = row[0] if row else 0
+        self.items = {values[0]: encode(dict(zip(self.columns, values))) for values in rows}
+
+    def _apply_changes(self):
+        """
+        Applies the changes recorded since the items were encoded.
+
+        :return: False if the changes cannot be applied incrementally, because the change log was pruned past
+                 the snapshot's position or too many changes were made, in which case the items must be loaded
+                 again.
+        :rtype: bool
+        """
+        changes = []
+        while len(changes) <= INCREMENTAL_MAX_CHANGES:
+            batch = get_changes(self.connect, changes[-1]['seq'] if changes else self.seq, CHANGES_MAX_LIMIT)
+            if not batch:
+                break
+            changes.extend(batch)
+        else:
+            return False
+        if changes and changes[0]['seq'] != self.seq + 1:
+            return False
+
+        resort = False
+        for change in changes:
+            if change['table'] != 'inventory':
+                continue
+            if change['operation'] == 'DELETE':
+                self.items.pop(change['key'], None)
+                continue
+            if change['key'] not in self.items and self.items and change['key'] < next(reversed(self.items)):
+                resort = True
+            self.items[change['key']] = encode({column: change['data'][column] for column in self.columns})
+        if resort:
+            self.items = dict(sorted(self.items.items()))
+        if changes:
+            self.seq = changes[-1]['seq']
+        return True
+
+    def _path(self, seq):
+        """
+        Builds the path of the snapshot file of a position.
+
+        :param seq: The position of the change log.
+        :type seq: int
+        :return: The path.
+        :rtype: str
+        """
+        return os.path.join(self.directory, f"{SNAPSHOT_PREFIX}{seq}{SNAPSHOT_SUFFIX}")
+
+    def _write(self, body):
+        """
+        Writes the body to the snapshot file of the current position and deletes all but the most recent files.
+
+        The file is written under a temporary name and renamed, so other workers never see a partial file.
+
+        :param body: The catalogue.
+        :type body: bytes
+        :return: The path of the file.
+        :rtype: str
+        """
+        path = self._path(self.seq)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(body)
+        os.replace(temporary_path, path)
+
+        def position(name):
+            return int(os.path.basename(name)[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)])
+
+        paths = sorted(glob.glob(os.path.join(self.directory, f"{SNAPSHOT_PREFIX}*{SNAPSHOT_SUFFIX}")), key=position)
+        for old_path in paths[:-SNAPSHOT_KEEP]:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+        return path
@@ -0,0 +1,109 @@
+import json
+import os
+import pytest
+from catalogue import *
+from cdc import prune_changes
+from database2 import create_inventory_table, add_item, update_item, get_all_items, connect_to_db, CHANGE_CAPTURE_COLUMNS
+
+
+@pytest.fixture
+def inventory_database(tmp_path, monkeypatch):
+    """
+    Fixture to set up a fresh inventory database with two items in a temporary directory.
+
+    :return: The items.
+    :rtype: list
+    """
+    monkeypatch.chdir(tmp_path)
+    create_inventory_table()
+    return [add_item({'name': f'Item {i}', 'category': 'food', 'price_per_item': 1.5 + i,
+                      'description': 'Tasty', 'count_in_stock': 10}) for i in range(2)]
+
+def count_loads(catalogue, monkeypatch):
+    """
+    Counts the full loads of the inventory a catalogue makes.
+
+    :return: A list growing by one element per load.
+    :rtype: list
+    """
+    loads = []
+    load = catalogue._load
+    monkeypatch.setattr(catalogue, '_load', lambda: loads.append(1) or load())
+    return loads
+
+def test_snapshot_matches_inventory(inventory_database):
+    """
+    Test if the snapshot holds every item and is reused while nothing changes.
+    """
+    catalogue = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS)
+    snapshot = catalogue.current()
+    assert json.loads(snapshot.body) == get_all_items()
+    assert catalogue.current() is snapshot
+
+def test_snapshot_applies_changes_incrementally(inventory_database, monkeypatch):
+    """
+    Test if writes are applied to the snapshot from the change log without reloading the inventory.
+    """
+    first, second = inventory_database
+    catalogue = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS)
+    catalogue.current()
+    loads = count_loads(catalogue, monkeypatch)
+    update_item(first['item_id'], {'count_in_stock': 3})
+    conn = connect_to_db()
+    conn.execute("DELETE FROM inventory WHERE item_id = ?", (second['item_id'],))
+    conn.commit()
+    conn.close()
+    add_item({'name': 'Item 2', 'category': 'clothes', 'price_per_item': 4.0, 'description': None, 'count_in_stock': 1})
+    snapshot = catalogue.current()
+    assert json.loads(snapshot.body) == get_all_items()
+    assert snapshot.seq == catalogue.seq
+    assert loads == []
+
+def test_snapshot_reloads_after_pruning(inventory_database, monkeypatch):
+    """
+    Test if the inventory is loaded again when the changes since the snapshot were pruned.
+    """
+    first, _ = inventory_database
+    catalogue = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS)
+    catalogue.current()
+    loads = count_loads(catalogue, monkeypatch)
+    update_item(first['item_id'], {'count_in_stock': 3})
+    update_item(first['item_id'], {'count_in_stock': 2})
+    prune_changes(connect_to_db, keep=1)
+    assert json.loads(catalogue.current().body) == get_all_items()
+    assert loads == [1]
+
+def test_snapshot_files_shared_between_workers(inventory_database, tmp_path, monkeypatch):
+    """
+    Test if a worker serves the snapshot file another worker wrote for the current position.
+    """
+    first, _ = inventory_database
+    directory = str(tmp_path / 'snapshots')
+    writer = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS, directory)
+    reader = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS, directory)
+    written = writer.current()
+    loads = count_loads(reader, monkeypatch)
+    shared = reader.current()
+    assert shared.path == written.path and shared.body is None and loads == []
+    with open(shared.path, 'rb') as snapshot_file:
+        assert json.loads(snapshot_file.read()) == get_all_items()
+    for stock in range(3):
+        update_item(first['item_id'], {'count_in_stock': stock})
+        writer.current()
+    assert len(os.listdir(directory)) == SNAPSHOT_KEEP
+
+def test_snapshot_file_deleted_after_lookup(inventory_database, tmp_path):
+    """
+    Test if a snapshot file is served from its open file once deleted, and rebuilt when deleted before opening.
+    """
+    directory = str(tmp_path / 'snapshots')
+    writer = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS, directory)
+    reader = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS, directory)
+    written = writer.current()
+    snapshot, snapshot_file = reader.current_body()
+    with snapshot_file:
+        os.remove(snapshot.path)
+        assert snapshot_file.read() == written.body
+
+    snapshot, body = reader.current_body()
+    assert snapshot.seq == written.seq and body == written.body
@@ -0,0 +1,286 @@
+"""
+Module that contains the change-data-capture (CDC) subsystem shared by the three databases.
+
+Triggers record every captured write in a 'changes' table in the same database and transaction as the write, so
+the change log has exactly the committed changes, in commit order. Consumers read the log incrementally from the
+last sequence number they have seen, either by polling, by long-polling or as a Server-Sent Events stream, instead
+of pulling whole tables.
+"""
+
+import json
+import time
+
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 5000
+WAIT_MAX_SECONDS = 30
+POLL_INTERVAL_SECONDS = 0.2
+
+def create_changes_table(conn):
+    """
+    Creates the 'changes' table if it does not already exist.
+
+    The table contains columns for seq (the position in the change log), table_name, operation (INSERT,
+    UPDATE or DELETE), row_key (the primary key of the changed row), data (the row after the change, as JSON,
+    or NULL for deletions) and changed_at.
+
+    :param conn: An open connection to the database whose writes are captured.
+    :type conn: sqlite3.Connection
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            row_key INTEGER NOT NULL,
+            data TEXT,
+            changed_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+    ''')
+
+def install_change_capture(conn, table, key_column, columns, operations=('INSERT', 'UPDATE', 'DELETE')):
+    """
+    Creates the 'changes' table and the triggers capturing writes to a table.
+
+    The triggers are dropped and created again every time, so that changes to the captured columns take effect.
+
+    :param conn: An open connection to the database containing the table.
+    :type conn: sqlite3.Connection
+
+    :param table: The name of the table to capture.
+    :type table: str
+
+    :param key_column: The table's integer primary key column.
+    :type key_column: str
+
+    :param columns: The columns included in the data of INSERT and UPDATE events. Sensitive columns should be
+                    left out.
+    :type columns: list
+
+    :param operations: The operations to capture.
+    :type operations: tuple
+    """
+    create_changes_table(conn)
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        trigger = f"{table}_cdc_{operation.lower()}"
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        if operation not in operations:
+            continue
+        row = 'old' if operation == 'DELETE' else 'new'
+        if operation == 'DELETE':
+            data = 'NULL'
+        else:
+            data = 'json_object(' + ', '.join(f"'{column}', new.{column}" for column in columns) + ')'
+        conn.execute(f'''
+            CREATE TRIGGER {trigger} AFTER {operation} ON {table} BEGIN
+                INSERT INTO changes (table_name, operation, row_key, data)
+                VALUES ('{table}', '{operation}', {row}.{key_column}, {data});
+            END;
+        ''')
+
+def get_changes(connect, since=0, limit=CHANGES_DEFAULT_LIMIT):
+    """
+    Retrieves the changes recorded after a sequence number.
+
+    :param connect: The function opening a connection to the captured database.
+    :type connect: callable
+
+    :param since: The sequence number of the last change already seen.
+    :type since: int
+
+    :param limit: The maximum number of changes to return, capped at CHANGES_MAX_LIMIT.
+    :type limit: int
+
+    :return: A list of dictionaries with seq, table, operation, key, data and changed_at, in sequence order.
+    :rtype: list
+    """
+    limit = max(1, min(int(limit), CHANGES_MAX_LIMIT))
+    changes = []
+    try:
+        conn = connect()
+        rows = conn.execute('''
+            SELECT seq, table_name, operation, row_key, data, changed_at FROM changes
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?
+        ''', (since, limit)).fetchall()
+        for seq, table_name, operation, row_key, data, changed_at in rows:
+            changes.append({
+                'seq': seq,
+                'table': table_name,
+                'operation': operation,
+                'key': row_key,
+                'data': json.loads(data) if data is not None else None,
+                'changed_at': changed_at,
+            })
+    except Exception as e:
+        print(f"Error getting changes: {e}")
+    finally:
+        conn.close()
+
+    return changes
+
+def wait_for_changes(connect, since=0, timeout=WAIT_MAX_SECONDS, limit=CHANGES_DEFAULT_LIMIT):
+    """
+    Retrieves the changes recorded after a sequence number, waiting up to timeout seconds for one to happen.
+
+    While waiting, a single connection checks ``PRAGMA data_version``, which only changes when another
+    connection commits, so an idle wait does not read the 'changes' table.
+
+    :param connect: The function opening a connection to the captured database.
+    :type connect: callable
+
+    :param since: The sequence number of the last change already seen.
+    :type since: int
+
+    :param timeout: The maximum number of seconds to wait.
+    :type timeout: float
+
+    :param limit: The maximum number of changes to return.
+    :type limit: int
+
+    :return: The changes, or an empty list if none happened before the timeout.
+    :rtype: list
+    """
+    if timeout <= 0:
+        return get_changes(connect, since, limit)
+
+    deadline = time.monotonic() + timeout
+    conn = connect()
+    try:
+        # Read the data version before the log, so a commit in between is seen as a change of version.
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        changes = get_changes(connect, since, limit)
+        while not changes and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL_SECONDS)
+            current_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if current_version != data_version:
+                data_version = current_version
+                changes = get_changes(connect, since, limit)
+    finally:
+        conn.close()
+
+    return changes
+
+def last_change_seq(connect):
+    """
+    Retrieves the sequence number of the last change recorded, which identifies the state of every captured table.
+
+    It is read from SQLite's record of the table's AUTOINCREMENT counter, so it is a single-row lookup and keeps
+    increasing when the change log is pruned.
+
+    :param connect: The function opening a connection to the captured database.
+    :type connect: callable
+
+    :return: The sequence number, or 0 if no change was recorded.
+    :rtype: int
+    """
+    seq = 0
+    try:
+        conn = connect()
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        seq = row[0] if row else 0
+    except Exception as e:
+        print(f"Error getting the last change: {e}")
+    finally:
+        conn.close()
+
+    return seq
+
+def prune_changes(connect, keep=100000):
+    """
+    Deletes all but the most recent changes from the change log.
+
+    :param connect: The function opening a connection to the captured database.
+    :type connect: callable
+
+    :param keep: The number of most recent changes to keep.
+    :type keep: int
+
+    :return: The number of changes deleted.
+    :rtype: int
+    """
+    deleted = 0
+    try:
+        conn = connect()
+        cur = conn.execute(
+            "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (keep,)
+        )
+        deleted = cur.rowcount
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error pruning changes: {e}")
+    finally:
+        conn.close()
+
+    return deleted
+
+def format_event(change):
+    """
+    Formats a change as a Server-Sent Event.
+
+    :param change: The change.
+    :type change: dict
+
+    :return: The event, terminated by a blank line.
+    :rtype: str
+    """
+    return f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+
+def changes_blueprint(connect, name='changes', path='/api/changes'):
+    """
+    Creates the blueprint serving the change log of a database, at ``/api/changes`` by default.
+
+    The endpoint accepts ``since`` (the last sequence number seen), ``limit`` and ``wait`` (seconds to wait for a
+    change when there is none yet, for long-polling). It answers with ``{"changes": [...], "next": <seq>}``, or
+    with an endless Server-Sent Events stream when the request accepts ``text/event-stream``; the stream resumes
+    from the ``Last-Event-ID`` header when reconnecting.
+
+    :param connect: The function opening a connection to the captured database.
+    :type connect: callable
+
+    :param name: The name of the blueprint, which must be unique within the application.
+    :type name: str
+
+    :param path: The path the change log is served at.
+    :type path: str
+
+    :return: The blueprint, to be registered on the service's application.
+    :rtype: flask.Blueprint
+    """
+    blueprint = Blueprint(name, __name__)
+
+    @blueprint.route(path, methods=['GET'])
+    def api_get_changes():
+        """
+        Retrieve the changes recorded after the sequence number given in ``since``.
+
+        :return: A JSON response containing the changes, a Server-Sent Events stream, or an error message.
+        :rtype: flask.Response
+        """
+        try:
+            since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+            limit = int(request.args.get('limit', CHANGES_DEFAULT_LIMIT))
+            wait = min(float(request.args.get('wait', 0)), WAIT_MAX_SECONDS)
+        except ValueError:
+            return jsonify({"error": "since, limit and wait must be numbers"})
+
+        if request.accept_mimetypes.best == 'text/event-stream':
+            def generate(seq):
+                while True:
+                    changes = wait_for_changes(connect, seq, WAIT_MAX_SECONDS, limit)
+                    if not changes:
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield ''.join(format_event(change) for change in changes)
+                    seq = changes[-1]['seq']
+
+            return Response(stream_with_context(generate(since)), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache'})
+
+        changes = wait_for_changes(connect, since, wait, limit)
+        return jsonify({"changes": changes, "next": changes[-1]['seq'] if changes else since})
+
+    return blueprint
@@ -0,0 +1,107 @@
+import threading
+import pytest
+from flask import Flask
+from cdc import *
+from database2 import create_inventory_table, add_item, update_item, connect_to_db
+
+@pytest.fixture
+def inventory_database(tmp_path, monkeypatch):
+    """
+    Fixture to set up a fresh inventory database in a temporary directory with one item that was then updated.
+
+    :return: The item.
+    :rtype: dict
+    """
+    monkeypatch.chdir(tmp_path)
+    create_inventory_table()
+    item = add_item({'name': 'Mug', 'category': 'accessories', 'price_per_item': 8.0,
+                     'description': 'A mug', 'count_in_stock': 4})
+    update_item(item['item_id'], {'count_in_stock': 3})
+    return item
+
+@pytest.fixture
+def client(inventory_database):
+    """
+    Fixture providing a test client of an application serving the inventory's change log.
+
+    :return: Flask test client
+    :rtype: FlaskClient
+    """
+    app = Flask(__name__)
+    app.register_blueprint(changes_blueprint(connect_to_db))
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def test_get_changes(inventory_database):
+    """
+    Test if writes are recorded in order with the row after the change.
+    :param inventory_database: Fixture to set up the inventory database.
+    """
+    changes = get_changes(connect_to_db)
+    assert [(change['operation'], change['key']) for change in changes] == \
+        [('INSERT', inventory_database['item_id']), ('UPDATE', inventory_database['item_id'])]
+    assert changes[1]['data']['count_in_stock'] == 3
+    assert get_changes(connect_to_db, since=changes[0]['seq']) == changes[1:]
+    assert len(get_changes(connect_to_db, limit=1)) == 1
+
+def test_wait_for_changes(inventory_database):
+    """
+    Test if waiting returns a change committed while waiting, and nothing once the timeout expires.
+    :param inventory_database: Fixture to set up the inventory database.
+    """
+    last_seq = get_changes(connect_to_db)[-1]['seq']
+    assert wait_for_changes(connect_to_db, last_seq, timeout=0.3) == []
+    writer = threading.Timer(0.3, update_item, (inventory_database['item_id'], {'count_in_stock': 2}))
+    writer.start()
+    changes = wait_for_changes(connect_to_db, last_seq, timeout=5)
+    writer.join()
+    assert [change['data']['count_in_stock'] for change in changes] == [2]
+
+def test_prune_changes(inventory_database):
+    """
+    Test if pruning keeps only the most recent changes.
+    :param inventory_database: Fixture to set up the inventory database.
+    """
+    assert prune_changes(connect_to_db, keep=1) == 1
+    assert [change['operation'] for change in get_changes(connect_to_db)] == ['UPDATE']
+
+def test_api_get_changes(client):
+    """
+    Test retrieving the change log through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    response = client.get('/api/changes?since=0&limit=1')
+    assert response.status_code == 200
+    assert len(response.json['changes']) == 1
+    response = client.get(f"/api/changes?since={response.json['next']}")
+    assert [change['operation'] for change in response.json['changes']] == ['UPDATE']
+    assert client.get(f"/api/changes?since={response.json['next']}").json['changes'] == []
+
+def test_api_get_changes_event_stream(client):
+    """
+    Test streaming the change log as Server-Sent Events, resuming from Last-Event-ID.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    response = client.get('/api/changes', headers={'Accept': 'text/event-stream', 'Last-Event-ID': '1'},
+                          buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    first_chunk = next(response.response).decode()
+    response.close()
+    assert first_chunk.startswith('id: 2\nevent: change\n')
+
+def test_last_change_seq(inventory_database):
+    """
+    Test if the position of the change log follows writes and is kept when the log is pruned.
+    :param inventory_database: Fixture to set up the inventory database.
+    """
+    seq = last_change_seq(connect_to_db)
+    assert seq == get_changes(connect_to_db)[-1]['seq']
+    update_item(inventory_database['item_id'], {'count_in_stock': 2})
+    assert last_change_seq(connect_to_db) == seq + 1
+    prune_changes(connect_to_db, keep=0)
+    assert last_change_seq(connect_to_db) == seq + 1
@@ -0,0 +1,215 @@
+"""
+Module that compresses the responses of the three services.
+
+Responses whose type is textual (JSON, Server-Sent Events, text) are compressed with the best encoding the
+client accepts among brotli (when the optional ``brotli`` package is installed), gzip and deflate. Bodies smaller
+than COMPRESS_MIN_SIZE are sent as they are, since compressing them saves little and costs a round of CPU work.
+Streamed responses are compressed chunk by chunk and flushed after every chunk, so events are not held back.
+Files are sent as they are, so that the server can pass them to the kernel without reading them.
+
+A GET response carrying an ``ETag`` is the same for every request to its URL until the tag changes, so its
+compressed body is kept in a bounded cache keyed by the URL, the tag and the encoding; large cacheable responses
+such as the full catalogue are then compressed once per change rather than once per request.
+
+The compressed and uncompressed bodies of a response are different representations, so a compressed response's
+strong ``ETag`` gets the encoding as a suffix, e.g. ``"item-1-3-gzip"``; decoded_etag strips it again when a
+request's ``If-None-Match`` or ``If-Match`` is compared with the current tag (see the http_cache module).
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/event-stream', 'text/plain', 'text/html', 'text/csv')
+ZLIB_WBITS = {'gzip': 31, 'deflate': 15}
+
+def supported_encodings():
+    """
+    Lists the encodings responses can be compressed with, preferred first.
+
+    :return: The encodings.
+    :rtype: list
+    """
+    if brotli is not None:
+        return ['br', 'gzip', 'deflate']
+    return ['gzip', 'deflate']
+
+def encoded_etag(etag, encoding):
+    """
+    Builds the entity tag of a response compressed with an encoding.
+
+    :param etag: The unquoted entity tag of the uncompressed response.
+    :type etag: str
+    :param encoding: 'br', 'gzip' or 'deflate'.
+    :type encoding: str
+    :return: The unquoted entity tag.
+    :rtype: str
+    """
+    return f"{etag}-{encoding}"
+
+def decoded_etag(etag):
+    """
+    Finds the entity tag of the uncompressed response from that of a compressed one.
+
+    :param etag: An unquoted entity tag, as sent by a client.
+    :type etag: str
+    :return: The tag without its encoding suffix, or the tag itself if it has none.
+    :rtype: str
+    """
+    for encoding in ('br', 'gzip', 'deflate'):
+        if etag.endswith('-' + encoding):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+def compress(data, encoding):
+    """
+    Compresses a whole body.
+
+    :param data: The body.
+    :type data: bytes
+    :param encoding: 'br', 'gzip' or 'deflate'.
+    :type encoding: str
+    :return: The compressed body.
+    :rtype: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, ZLIB_WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(chunks, encoding):
+    """
+    Compresses a streamed body, flushing after every chunk so the client receives each chunk without delay.
+
+    :param chunks: The chunks of the body.
+    :type chunks: iterable
+    :param encoding: 'br', 'gzip' or 'deflate'.
+    :type encoding: str
+    :return: A generator of the compressed chunks.
+    :rtype: generator
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk.encode() if isinstance(chunk, str) else chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, ZLIB_WBITS[encoding])
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+class CompressionCache:
+    """
+    The compressed bodies of responses with an entity tag, least recently used evicted first.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        """
+        :param max_bytes: The maximum total size of the cached bodies.
+        :type max_bytes: int
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.bodies = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Looks up a compressed body.
+
+        :param key: The URL, entity tag and encoding of the response.
+        :type key: tuple
+        :return: The compressed body, or None if it is not cached.
+        :rtype: bytes or None
+        """
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is not None:
+                self.bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        """
+        Caches a compressed body, evicting the least recently used ones to stay within max_bytes.
+
+        :param key: The URL, entity tag and encoding of the response.
+        :type key: tuple
+        :param body: The compressed body.
+        :type body: bytes
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.bodies.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.bodies[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.bodies.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def init_compression(app, min_size=COMPRESS_MIN_SIZE, cache=None):
+    """
+    Makes an application compress its responses.
+
+    :param app: The application.
+    :type app: flask.Flask
+    :param min_size: The size under which bodies are not compressed.
+    :type min_size: int
+    :param cache: The cache of compressed bodies, by default a new CompressionCache.
+    :type cache: CompressionCache or None
+    :return: The cache of compressed bodies.
+    :rtype: CompressionCache
+    """
+    cache = cache if cache is not None else CompressionCache()
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304) \
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES \
+                or response.direct_passthrough or 'Content-Encoding' in response.headers \
+                or 'no-transform' in response.headers.get('Cache-Control', ''):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(supported_encodings())
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        etag, weak = response.get_etag()
+        key = (request.full_path, etag, encoding) if etag and request.method == 'GET' else None
+        body = cache.get(key) if key else None
+        if body is None:
+            body = compress(data, encoding)
+            if key:
+                cache.put(key, body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            response.set_etag(encoded_etag(etag, encoding))
+        return response
+
+    return cache
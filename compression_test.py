@@ -0,0 +1,107 @@
+import gzip
+import zlib
+import pytest
+from flask import Flask, Response, jsonify
+from compression import *
+
+
+@pytest.fixture
+def app():
+    """
+    Fixture providing an application with compressed responses.
+
+    :return: The application.
+    :rtype: flask.Flask
+    """
+    app = Flask(__name__)
+    app.calls = 0
+
+    @app.route('/large')
+    def large():
+        app.calls += 1
+        return jsonify([{'item_id': i, 'name': f'Item {i}'} for i in range(200)])
+
+    @app.route('/small')
+    def small():
+        return jsonify({'status': 'ok'})
+
+    @app.route('/tagged')
+    def tagged():
+        response = jsonify([{'item_id': i, 'name': f'Item {i}'} for i in range(200)])
+        response.set_etag('catalogue-1')
+        return response
+
+    @app.route('/stream')
+    def stream():
+        return Response((f'data: {i}\n\n' for i in range(3)), mimetype='text/event-stream')
+
+    app.compression_cache = init_compression(app)
+    return app
+
+def test_compress_large_responses(app):
+    """
+    Test if large responses are compressed with the accepted encoding, and others are not.
+    """
+    client = app.test_client()
+    plain = client.get('/large')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+    gzipped = client.get('/large', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.get_data()) == plain.get_data()
+    assert int(gzipped.headers['Content-Length']) < len(plain.get_data())
+    deflated = client.get('/large', headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+    assert deflated.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(deflated.get_data()) == plain.get_data()
+    assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+
+def test_compressed_body_cached_by_etag(app, monkeypatch):
+    """
+    Test if a response with an ETag is compressed once and served from the cache afterwards.
+    """
+    client = app.test_client()
+    compressions = []
+    monkeypatch.setattr('compression.compress', lambda data, encoding: compressions.append(1) or gzip.compress(data))
+    first = client.get('/tagged', headers={'Accept-Encoding': 'gzip'})
+    second = client.get('/tagged', headers={'Accept-Encoding': 'gzip'})
+    assert first.get_data() == second.get_data()
+    assert len(compressions) == 1
+    client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    assert len(compressions) == 3
+
+def test_compressed_etag_names_encoding(app):
+    """
+    Test if each encoding of a response has its own strong ETag, which decoded_etag maps back to the original.
+    """
+    client = app.test_client()
+    assert client.get('/tagged').get_etag() == ('catalogue-1', False)
+    gzipped = client.get('/tagged', headers={'Accept-Encoding': 'gzip'}).get_etag()
+    deflated = client.get('/tagged', headers={'Accept-Encoding': 'deflate'}).get_etag()
+    assert gzipped == ('catalogue-1-gzip', False) and deflated == ('catalogue-1-deflate', False)
+    assert decoded_etag(gzipped[0]) == decoded_etag(deflated[0]) == 'catalogue-1'
+    assert decoded_etag('catalogue-1') == 'catalogue-1'
+
+def test_compress_stream(app):
+    """
+    Test if a streamed response is compressed chunk by chunk and each chunk can be decompressed on arrival.
+    """
+    response = app.test_client().get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(next(response.response)) == b'data: 0\n\n'
+    assert decompressor.decompress(b''.join(response.response)) == b'data: 1\n\ndata: 2\n\n'
+    response.close()
+
+def test_compression_cache_eviction():
+    """
+    Test if the cache evicts the least recently used bodies to stay within its size.
+    """
+    cache = CompressionCache(max_bytes=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    cache.get('a')
+    cache.put('c', b'12345')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'12345' and cache.get('c') == b'12345'
+    assert cache.size == 10
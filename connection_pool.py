@@ -0,0 +1,217 @@
+"""
+Module that keeps the SQLite connections of a process open between uses.
+
+The database functions open a connection, run a few statements and close it. Opening a connection reads the
+schema again and starts with an empty statement cache, so every statement was parsed and prepared anew on every
+call. Connections opened by ``connect`` are instead returned to a pool of idle connections of their database when
+they are closed, and the next ``connect`` reuses one, together with the statements it has prepared. Each
+connection's statement cache holds CACHED_STATEMENTS statements, enough for every statement of the query
+catalogue (see the queries module) that a service runs regularly.
+
+A connection is reset when it is returned: its open transaction is rolled back, its cursors are closed so that no
+unfinished query keeps the database locked, and its row factory is restored. Connections are not shared between
+processes, and a connection is discarded when its database file has been replaced. Read-only connections, such
+as those to the replicas of the replicas module, have pools of their own.
+"""
+
+import os
+import sqlite3
+import threading
+import urllib.parse
+import weakref
+
+CACHED_STATEMENTS = 256
+POOL_SIZE = 8
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A connection that returns to its pool when it is closed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.inode = None
+        self.in_use = False
+        self.cursors = weakref.WeakSet()
+        # Set by the replicas module on connections to a replica.
+        self.snapshot_time = None
+
+    def cursor(self, factory=sqlite3.Cursor):
+        cursor = super().cursor(factory)
+        self.cursors.add(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def close(self):
+        """
+        Resets the connection and returns it to its pool, or closes it if the pool is full or the reset fails.
+        """
+        if self.pool is None:
+            super().close()
+            return
+        if not self.in_use:
+            # Closed twice: the connection is already back in its pool.
+            return
+        try:
+            for cursor in list(self.cursors):
+                cursor.close()
+            if self.in_transaction:
+                self.rollback()
+            self.row_factory = None
+        except sqlite3.Error:
+            self.discard()
+            return
+        self.pool.release(self)
+
+    def discard(self):
+        """
+        Closes the connection without returning it to its pool.
+        """
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """
+    The idle connections to a database file.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, cached_statements=CACHED_STATEMENTS, read_only=False):
+        """
+        :param path: The path of the database file.
+        :type path: str
+        :param size: The maximum number of idle connections kept open.
+        :type size: int
+        :param cached_statements: The size of each connection's statement cache.
+        :type cached_statements: int
+        :param read_only: Whether the connections are opened read-only.
+        :type read_only: bool
+        """
+        self.path = path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.read_only = read_only
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _inode(self):
+        """
+        Identifies the database file, so connections to a file that was replaced are not reused.
+
+        :return: The inode of the file, or None if it does not exist yet.
+        :rtype: int or None
+        """
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def acquire(self):
+        """
+        Takes an idle connection, or opens a new one if there is none.
+
+        :return: The connection.
+        :rtype: PooledConnection
+        """
+        inode = self._inode()
+        while True:
+            with self.lock:
+                conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                break
+            if conn.inode == inode:
+                conn.in_use = True
+                return conn
+            conn.discard()
+
+        if self.read_only:
+            database, uri = f"file:{urllib.parse.quote(self.path)}?mode=ro", True
+        else:
+            database, uri = self.path, False
+        conn = sqlite3.connect(database, factory=PooledConnection, cached_statements=self.cached_statements,
+                               check_same_thread=False, uri=uri)
+        conn.inode = self._inode()
+        conn.pool = self
+        conn.in_use = True
+        return conn
+
+    def release(self, conn):
+        """
+        Takes back a connection that was reset, closing it if enough connections are idle.
+
+        :param conn: The connection.
+        :type conn: PooledConnection
+        """
+        conn.in_use = False
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.discard()
+
+    def clear(self):
+        """
+        Closes every idle connection.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.discard()
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+def get_pool(path, read_only=False):
+    """
+    Returns the pool of a database file in this process, creating it on first use.
+
+    :param path: The path of the database file, relative to the current directory or absolute.
+    :type path: str
+    :param read_only: Whether the pool's connections are opened read-only.
+    :type read_only: bool
+    :return: The pool.
+    :rtype: ConnectionPool
+    """
+    global _pools_pid
+    path = os.path.abspath(path)
+    pid = os.getpid()
+    pool = _pools.get((path, read_only)) if _pools_pid == pid else None
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        if _pools_pid != pid:
+            # The connections inherited from the parent process must not be used by a child.
+            _pools.clear()
+            _pools_pid = pid
+        return _pools.setdefault((path, read_only), ConnectionPool(path, read_only=read_only))
+
+def connect(path, read_only=False):
+    """
+    Opens a connection to a database file, reusing an idle one when possible. Closing the connection returns it
+    to the pool.
+
+    :param path: The path of the database file, relative to the current directory or absolute.
+    :type path: str
+    :param read_only: Whether to open the database read-only.
+    :type read_only: bool
+    :return: The connection.
+    :rtype: PooledConnection
+    """
+    return get_pool(path, read_only).acquire()
+
+def close_pools():
+    """
+    Closes the idle connections of every pool of this process.
+    """
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    for pool in pools:
+        pool.clear()
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import pytest
+from connection_pool import *
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """
+    Fixture providing a pool of connections to a database with one table.
+
+    :return: The pool.
+    :rtype: ConnectionPool
+    """
+    pool = ConnectionPool(str(tmp_path / 'test.db'), size=2)
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10)])
+    conn.commit()
+    conn.close()
+    yield pool
+    pool.clear()
+
+def test_connections_are_reused(pool):
+    """
+    Test if a closed connection is handed out again, reset, instead of a new one being opened.
+    """
+    conn = pool.acquire()
+    conn.row_factory = sqlite3.Row
+    conn.close()
+    conn.close()
+    again = pool.acquire()
+    assert again is conn
+    assert again.row_factory is None
+    assert pool.acquire() is not conn
+    again.close()
+
+def test_pool_size_is_bounded(pool):
+    """
+    Test if connections returned to a full pool are closed.
+    """
+    connections = [pool.acquire() for _ in range(3)]
+    for conn in connections:
+        conn.close()
+    assert len(pool.idle) == 2
+    with pytest.raises(sqlite3.ProgrammingError):
+        connections[2].execute("SELECT 1")
+
+def test_returned_connection_releases_locks(pool):
+    """
+    Test if returning a connection rolls back its transaction and finishes its queries, so it does not block
+    writers while idle.
+    """
+    conn = pool.acquire()
+    conn.execute("SELECT x FROM t").fetchone()
+    conn.execute("INSERT INTO t VALUES (10)")
+    conn.close()
+    writer = sqlite3.connect(pool.path, timeout=0.1)
+    writer.execute("INSERT INTO t VALUES (11)")
+    writer.commit()
+    writer.close()
+    conn = pool.acquire()
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 11
+    conn.close()
+
+def test_replaced_database_is_not_reused(pool):
+    """
+    Test if idle connections to a database file that was replaced are discarded.
+    """
+    conn = pool.acquire()
+    conn.close()
+    os.remove(pool.path)
+    sqlite3.connect(pool.path).close()
+    fresh = pool.acquire()
+    assert fresh is not conn
+    assert fresh.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+    fresh.close()
+
+def test_connect_uses_one_pool_per_file(tmp_path, monkeypatch):
+    """
+    Test if connect pools connections by database file, whatever the path it is given.
+    """
+    monkeypatch.chdir(tmp_path)
+    assert get_pool('shared.db') is get_pool(str(tmp_path / 'shared.db'))
+    conn = connect('shared.db')
+    conn.close()
+    assert connect(str(tmp_path / 'shared.db')) is conn
+    conn.close()
+    close_pools()
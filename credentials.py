@@ -0,0 +1,174 @@
+"""
+Module that contains the password hashing and verification used for customer credentials.
+
+Passwords are hashed with scrypt (or PBKDF2-SHA256 where OpenSSL lacks scrypt) into self-describing strings that
+record the algorithm, its cost parameters and the salt. Key derivation is CPU-bound and would hold the GIL on a
+request thread, so it runs in a bounded pool of worker processes; request threads only wait for the result.
+Hashes made with older cost parameters, and passwords stored in plain text before hashing was introduced, are
+flagged for rehashing so they can be upgraded the next time the customer logs in.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+POOL_WORKERS = os.cpu_count() or 1
+POOL_MAX_PENDING = 4 * POOL_WORKERS
+POOL_WAIT_SECONDS = 30
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_PENDING)
+
+def current_parameters():
+    """
+    Returns the algorithm and cost parameters new hashes are made with.
+
+    :return: The algorithm name followed by its cost parameters.
+    :rtype: tuple
+    """
+    if hasattr(hashlib, 'scrypt'):
+        return ('scrypt', SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return ('pbkdf2_sha256', PBKDF2_ITERATIONS)
+
+def derive_key(password, salt, parameters):
+    """
+    Derives the key of a password. This is the CPU-bound part, run in the worker processes.
+
+    :param password: The password.
+    :type password: str
+    :param salt: The salt.
+    :type salt: bytes
+    :param parameters: The algorithm name followed by its cost parameters.
+    :type parameters: tuple
+    :return: The derived key.
+    :rtype: bytes
+    """
+    algorithm = parameters[0]
+    if algorithm == 'scrypt':
+        n, r, p = parameters[1:]
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n + 2 ** 20,
+                              dklen=KEY_BYTES)
+    if algorithm == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, parameters[1], dklen=KEY_BYTES)
+    raise ValueError(f"Unknown password hashing algorithm: {algorithm}")
+
+def _get_pool():
+    """
+    Returns the worker process pool, creating it on first use.
+
+    :return: The pool.
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        return _pool
+
+def _run_in_pool(password, salt, parameters):
+    """
+    Derives a key in the worker process pool.
+
+    At most POOL_MAX_PENDING derivations are queued at once; further callers wait for a slot, so a burst of
+    registrations or logins cannot queue unbounded work.
+
+    :param password: The password.
+    :type password: str
+    :param salt: The salt.
+    :type salt: bytes
+    :param parameters: The algorithm name followed by its cost parameters.
+    :type parameters: tuple
+    :return: The derived key.
+    :rtype: bytes
+    :raises RuntimeError: If no slot frees up within POOL_WAIT_SECONDS.
+    """
+    if not _pool_slots.acquire(timeout=POOL_WAIT_SECONDS):
+        raise RuntimeError("Password hashing is overloaded, try again later.")
+    try:
+        return _get_pool().submit(derive_key, password, salt, parameters).result(timeout=POOL_WAIT_SECONDS)
+    finally:
+        _pool_slots.release()
+
+def _encode(parameters, salt, key):
+    """
+    Encodes a hash as 'algorithm$parameters...$salt$key', with the salt and key in base64.
+
+    :param parameters: The algorithm name followed by its cost parameters.
+    :type parameters: tuple
+    :param salt: The salt.
+    :type salt: bytes
+    :param key: The derived key.
+    :type key: bytes
+    :return: The encoded hash.
+    :rtype: str
+    """
+    fields = [str(field) for field in parameters]
+    fields.append(base64.b64encode(salt).decode())
+    fields.append(base64.b64encode(key).decode())
+    return '$'.join(fields)
+
+def _decode(encoded):
+    """
+    Decodes a hash produced by _encode.
+
+    :param encoded: The stored value.
+    :type encoded: str
+    :return: The parameters, salt and key, or None if the string is not a hash (a legacy plain text password).
+    :rtype: tuple or None
+    """
+    fields = encoded.split('$')
+    try:
+        if fields[0] == 'scrypt' and len(fields) == 6:
+            parameters = ('scrypt', int(fields[1]), int(fields[2]), int(fields[3]))
+        elif fields[0] == 'pbkdf2_sha256' and len(fields) == 4:
+            parameters = ('pbkdf2_sha256', int(fields[1]))
+        else:
+            return None
+        return parameters, base64.b64decode(fields[-2]), base64.b64decode(fields[-1])
+    except ValueError:
+        return None
+
+def hash_password(password, parameters=None):
+    """
+    Hashes a password with a new random salt.
+
+    :param password: The password.
+    :type password: str
+    :param parameters: The algorithm and cost parameters to use, by default current_parameters().
+    :type parameters: tuple or None
+    :return: The encoded hash, to be stored instead of the password.
+    :rtype: str
+    """
+    parameters = parameters or current_parameters()
+    salt = os.urandom(SALT_BYTES)
+    return _encode(parameters, salt, _run_in_pool(password, salt, parameters))
+
+def verify_password(password, encoded):
+    """
+    Checks a password against a stored hash.
+
+    :param password: The password to check.
+    :type password: str
+    :param encoded: The stored hash, or a legacy plain text password.
+    :type encoded: str
+    :return: Whether the password matches, and whether the stored value should be replaced by a new hash.
+    :rtype: tuple
+    """
+    decoded = _decode(encoded or '')
+    if decoded is None:
+        matches = hmac.compare_digest(password.encode(), (encoded or '').encode())
+        return matches, matches
+    parameters, salt, key = decoded
+    matches = hmac.compare_digest(_run_in_pool(password, salt, parameters), key)
+    return matches, matches and parameters != current_parameters()
@@ -0,0 +1,35 @@
+import pytest
+from credentials import *
+
+def test_hash_password():
+    """
+    Test if hashing records the algorithm and uses a new salt every time.
+    """
+    first = hash_password('secret')
+    second = hash_password('secret')
+    assert first.startswith(current_parameters()[0] + '$')
+    assert 'secret' not in first
+    assert first != second
+
+def test_verify_password():
+    """
+    Test if a hash verifies its own password only, without asking for a rehash.
+    """
+    encoded = hash_password('secret')
+    assert verify_password('secret', encoded) == (True, False)
+    assert verify_password('Secret', encoded) == (False, False)
+
+def test_verify_password_outdated_parameters():
+    """
+    Test if a hash made with other cost parameters still verifies but asks for a rehash.
+    """
+    encoded = hash_password('secret', ('pbkdf2_sha256', 1000))
+    assert verify_password('secret', encoded) == (True, True)
+    assert verify_password('wrong', encoded) == (False, False)
+
+def test_verify_password_plain_text():
+    """
+    Test if a password stored in plain text before hashing was introduced verifies and asks for a rehash.
+    """
+    assert verify_password('secret', 'secret') == (True, True)
+    assert verify_password('wrong', 'secret') == (False, False)
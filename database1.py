@@ -1,49 +1,186 @@
 """
 Module that contains functions for connecting to and managing an SQLite3 database for customers service.
+
+The customers can be spread over several database files, the shards of the sharding module: each function opens
+the shard of the customer it reads or writes, found from the customer's ID or, for a username, from the
+directory.
 """
 
+import functools
+import heapq
+import json
+import math
+import operator
 import sqlite3
+import time
+from cdc import install_change_capture
+from connection_pool import connect
+from credentials import hash_password, verify_password
+from json_provider import RowSet, encode
+from models import Customer
+from queries import (CUSTOMER_UPDATABLE_COLUMNS, INSERT_CUSTOMER, SELECT_ALL_CUSTOMERS, SELECT_CUSTOMER_BY_ID,
+                     SELECT_CUSTOMER_BY_USERNAME, SELECT_CUSTOMER_CREDENTIALS, SELECT_CUSTOMER_USERNAME,
+                     SELECT_CUSTOMER_VERSION, SELECT_CUSTOMER_VERSION_BY_USERNAME, DELETE_CUSTOMER, CHARGE_WALLET, DEDUCT_WALLET,
+                     REHASH_PASSWORD, UPDATE_CUSTOMER, INSERT_CUSTOMER_WITH_ID, ATTACH_DIRECTORY,
+                     ALLOCATE_CUSTOMER_ID, SELECT_DIRECTORY_ID, INSERT_DIRECTORY_ENTRY, RENAME_DIRECTORY_ENTRY,
+                     DELETE_DIRECTORY_ENTRY, select_customers_in, select_wallets_in, select_directory_ids_in)
+from replicas import open_replica_routers
+from sharding import create_directory, open_shard_layout
+from shm_cache import open_shared_cache
+
+BATCH_CHUNK_SIZE = 500
+WALLET_BATCH_MAX_OPERATIONS = 100000
+CHANGE_CAPTURE_COLUMNS = ('customer_id', 'full_name', 'username', 'age', 'address', 'gender', 'marital_status', 'wallet_balance', 'version')
+UPDATABLE_COLUMNS = CUSTOMER_UPDATABLE_COLUMNS
+
+customer_cache = open_shared_cache('customers')
+customer_shards = open_shard_layout()
+customer_replicas = open_replica_routers(customer_shards.paths, 'CUSTOMERS_REPLICA_DB')
+
+class VersionConflictError(Exception):
+    """
+    Raised when a version-checked update finds that the row was modified since the expected version.
+    """
+
+    def __init__(self, key, expected_version, current_version):
+        super().__init__(f"Expected version {expected_version} of {key}, found version {current_version}")
+        self.key = key
+        self.expected_version = expected_version
+        self.current_version = current_version
 
 def connect_to_db():
     """
-    Establishes a connection to database 'ecommerce_customers.db'.
+    Establishes a connection to database 'ecommerce_customers.db', shard 0 of the customers, taken from the
+    process's pool of idle connections when one is available. Closing it returns it to the pool.
+
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    return connect_to_shard(0)
+
+def connect_to_shard(shard):
+    """
+    Establishes a pooled connection to a shard of the customers.
+
+    :param shard: The index of the shard.
+    :type shard: int
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    return connect(customer_shards.paths[shard])
+
+def shard_connectors():
+    """
+    Lists the functions opening a connection to each shard, for the helpers of the cdc module, which take the
+    function connecting to the database they read.
+
+    :return: One function per shard, in the order of the shards.
+    :rtype: list
+    """
+    return [functools.partial(connect_to_shard, shard) for shard in range(customer_shards.count)]
+
+def connect_to_directory():
+    """
+    Establishes a pooled connection to the directory of the shards, which only exists with several shards.
+
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    return connect(customer_shards.directory_path)
+
+def _connect_with_directory(shard):
+    """
+    Establishes a connection to a shard with the directory attached as 'directory', for the writes that change
+    both in one transaction. The connection is not pooled, so that the directory does not stay attached: a
+    transaction of a connection locks every database attached to it.
 
+    :param shard: The index of the shard.
+    :type shard: int
     :return: The established connection object.
     :rtype: sqlite3.Connection
     """
-    conn = sqlite3.connect('ecommerce_customers.db')
+    conn = sqlite3.connect(customer_shards.paths[shard])
+    conn.execute(ATTACH_DIRECTORY, (customer_shards.directory_path,))
     return conn
 
-def create_customers_table():
+def connect_for_read(shard=0, primary=False):
+    """
+    Establishes a connection for reading the customers of a shard: to the shard's replica when one is configured
+    and within its staleness bound, and to the shard itself otherwise.
+
+    :param shard: The index of the shard.
+    :type shard: int
+    :param primary: Whether the read must see every committed write, such as a read following a write.
+    :type primary: bool
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    if primary or customer_replicas is None:
+        return connect_to_shard(shard)
+    return customer_replicas[shard].connect_for_read()
+
+def create_customers_table(layout=None):
     """
-    Creates a table named 'customers' in the database if it does not already exist.
+    Creates a table named 'customers' in every shard if it does not already exist, and the directory when there
+    are several shards.
+
+    The table contains columns for the customer's id, full name, username, password, age, address, gender, marital status, wallet balance, and version.
+    The version is incremented by every write to the customer and is used to build HTTP ETags.
+    Every write is also recorded in the 'changes' table of the shard, without the password.
 
-    The table contains columns for the customer's id, full name, username, password, age, address, gender, marital status, and wallet balance.
+    :param layout: The shards to create the table in, those of the service by default.
+    :type layout: sharding.ShardLayout or None
     """
+    layout = layout or customer_shards
     try:
-        conn = connect_to_db()
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS customers (
-                customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                full_name TEXT NOT NULL,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                age INTEGER,
-                address TEXT,
-                gender TEXT,
-                marital_status TEXT,
-                wallet_balance REAL DEFAULT 0); 
-                ''')
-        conn.commit()
+        for path in layout.paths:
+            conn = connect(path)
+            try:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS customers (
+                        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        full_name TEXT NOT NULL,
+                        username TEXT UNIQUE NOT NULL,
+                        password TEXT NOT NULL,
+                        age INTEGER,
+                        address TEXT,
+                        gender TEXT,
+                        marital_status TEXT,
+                        wallet_balance REAL DEFAULT 0,
+                        version INTEGER NOT NULL DEFAULT 1); 
+                        ''')
+                add_version_column(conn)
+                install_change_capture(conn, 'customers', 'customer_id', CHANGE_CAPTURE_COLUMNS)
+                conn.commit()
+            finally:
+                conn.close()
+        if layout.sharded:
+            conn = connect(layout.directory_path)
+            try:
+                create_directory(conn)
+            finally:
+                conn.close()
         print("Customers table created successfully")
     except Exception as e:
         print(f"Error creating customers table: {e}")
-    finally:
-        conn.close()
+
+def add_version_column(conn):
+    """
+    Adds the 'version' column to a 'customers' table created before customers were versioned.
+
+    :param conn: An open connection to the customers database.
+    :type conn: sqlite3.Connection
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(customers)")]
+    if 'version' not in columns:
+        conn.execute("ALTER TABLE customers ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
 
 def insert_customer(customer):
     """
-    Inserts a new customer record into the 'customers' table.
+    Inserts a new customer record into the 'customers' table. The password is stored hashed.
+
+    With several shards, the customer's ID is handed out by the directory first, and the customer is inserted in
+    its shard and in the directory in one transaction.
 
     :param customer: A dictionary containing the customer's details.
                      Required keys: 'full_name', 'username', 'password', 'age', 'address', 'gender', 'marital_status'
@@ -52,136 +189,309 @@ def insert_customer(customer):
     :rtype: dict
     """
     inserted_customer = {}
+    conn = None
     try:
-        conn = connect_to_db()
-        cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO customers (full_name, username, password, age, address, gender, marital_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)''', 
-            (customer['full_name'],
+        values = (customer['full_name'],
             customer['username'],
-            customer['password'],
+            hash_password(customer['password']),
             customer['age'],
             customer['address'],
             customer['gender'],
-            customer['marital_status']
-        ))
+            customer['marital_status'])
+        if customer_shards.sharded:
+            customer_id = _allocate_customer_id()
+            conn = _connect_with_directory(customer_shards.shard_of(customer_id))
+            conn.execute(INSERT_DIRECTORY_ENTRY, (customer_id, customer['username']))
+            conn.execute(INSERT_CUSTOMER_WITH_ID, (customer_id,) + values)
+        else:
+            conn = connect_to_db()
+            conn.execute(INSERT_CUSTOMER, values)
         conn.commit()
-        inserted_customer = get_customer_by_username(customer['username'])
+        inserted_customer = get_customer_by_username(customer['username'], primary=True)
         inserted_customer['customer_id'] = inserted_customer.get('customer_id')
         if 'customer_id' not in inserted_customer or inserted_customer['customer_id'] is None:
             raise ValueError("Failed to retrieve valid customer_id after insertion.")
          
 
     except sqlite3.IntegrityError as e:
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         raise e
     except Exception as e:
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         inserted_customer = {"error": f"Error inserting customer: {e}"}
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
     return inserted_customer
 
+def _allocate_customer_id():
+    """
+    Hands out the ID of a new customer from the directory. An ID whose insertion fails is not reused.
+
+    :return: The ID.
+    :rtype: int
+    """
+    conn = connect_to_directory()
+    try:
+        customer_id = conn.execute(ALLOCATE_CUSTOMER_ID).fetchall()[0][0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return customer_id
+
+def _shard_of_username(username):
+    """
+    Finds the shard of the customer with a username, in the directory when there are several shards.
+
+    :param username: The username of the customer.
+    :type username: str
+    :return: The index of the shard, or None if no customer has the username.
+    :rtype: int or None
+    """
+    if not customer_shards.sharded:
+        return 0
+    conn = connect_to_directory()
+    try:
+        row = conn.execute(SELECT_DIRECTORY_ID, (username,)).fetchone()
+    finally:
+        conn.close()
+    return customer_shards.shard_of(row[0]) if row else None
+
+def iter_customer_rows():
+    """
+    Yields every customer record, as tuples in the column order of the Customer model, by ascending customer ID.
+
+    Each shard returns its customers sorted by ID, and heapq merges the shards' cursors as their rows are fetched,
+    so the rows are streamed rather than collected from every shard first.
+
+    :return: A generator of the customers' rows.
+    :rtype: generator
+    """
+    conns = []
+    try:
+        for shard in range(customer_shards.count):
+            conns.append(connect_for_read(shard))
+        cursors = [conn.execute(SELECT_ALL_CUSTOMERS) for conn in conns]
+        if len(cursors) == 1:
+            yield from cursors[0]
+        else:
+            yield from heapq.merge(*cursors, key=operator.itemgetter(0))
+    finally:
+        for conn in conns:
+            conn.close()
+
+def get_all_customer_rows():
+    """
+    Retrieves all customer records from the 'customers' table as a RowSet, which holds the row tuples without
+    building a dictionary or model per customer until the response is encoded.
+
+    :return: The customers' rows, empty if an error occurs.
+    :rtype: RowSet
+    """
+    customers = RowSet((), [])
+    try:
+        customers = RowSet(Customer.__slots__, list(iter_customer_rows()))
+
+    except Exception as e:
+        print(f"Error getting all customers: {e}")
+
+    return customers
+
 def get_all_customers():
     """
     Retrieves all customer records from the 'customers' table.
 
-    :return: A list of dictionaries containing the details of all customers.
+    :return: A list of Customer models, which can be used as dictionaries, containing the details of all customers.
     :rtype: list
     """
     customers = []
     try:
-        conn = connect_to_db()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM customers")
-        rows = cur.fetchall()
-
-        for row in rows:
-            customer = dict(row)
-            customers.append(customer)
+        customers = [Customer(*row) for row in iter_customer_rows()]
 
     except Exception as e:
         print(f"Error getting all customers: {e}")
-    finally:
-        conn.close()
 
     return customers
 
-def get_customer_by_username(username):
+def get_customer_by_username(username, primary=False):
     """
     Retrieves a customer record from the 'customers' table based on the provided username.
 
     :param username: The username of the customer to retrieve.
     :type username: str
+    :param primary: Whether to read from the primary database rather than a replica.
+    :type primary: bool
     :return: A dictionary containing the details of the customer with the provided username, or an empty dictionary if not found.
     :rtype: dict
     """
+    if customer_cache is not None:
+        cached = customer_cache.get(_customer_cache_key(username))
+        if cached is not None:
+            return json.loads(cached)
+    read_at = time.time()
+
     customer = {}
+    conn = None
     try:
-        conn = connect_to_db()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM customers WHERE username = ?", (username,))
-        row = cur.fetchone()
-
-        if row:
-            customer = dict(row)
+        shard = _shard_of_username(username)
+        if shard is not None:
+            conn = connect_for_read(shard, primary)
+            if conn.snapshot_time is not None:
+                read_at = conn.snapshot_time
+            conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            cur.execute(SELECT_CUSTOMER_BY_USERNAME, (username,))
+            row = cur.fetchone()
+
+            if row:
+                customer = dict(row)
 
     except Exception as e:
         print(f"Error getting customer by username: {e}")
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
+    if customer and customer_cache is not None:
+        customer_cache.put(_customer_cache_key(username), encode(customer), read_at)
     return customer
 
-def update_customer(customer_id, updates):
+def _customer_cache_key(username):
+    """
+    Builds the key of a customer in the shared cache.
+
+    :param username: The username of the customer.
+    :type username: str
+    :return: The key.
+    :rtype: bytes
+    """
+    return f"customer:{username}".encode()
+
+def _cached_username(cur, customer_id):
+    """
+    Looks up the username a customer is cached under, before a write that may change or delete it.
+
+    :param cur: A cursor on the customers database.
+    :type cur: sqlite3.Cursor
+    :param customer_id: The ID of the customer.
+    :type customer_id: int
+    :return: The username, or None if the shared cache is disabled or the customer does not exist.
+    :rtype: str or None
+    """
+    if customer_cache is None:
+        return None
+    row = cur.execute(SELECT_CUSTOMER_USERNAME, (customer_id,)).fetchone()
+    return row[0] if row else None
+
+def _uncache_customer(username):
+    """
+    Removes a customer from the shared cache after a write to it was committed.
+
+    :param username: The username the customer was cached under, or None.
+    :type username: str or None
+    """
+    if customer_cache is not None and username is not None:
+        customer_cache.delete(_customer_cache_key(username))
+
+def get_customer_version(username):
+    """
+    Retrieves the ID and current version of a customer without reading the rest of the row.
+
+    :param username: The username of the customer.
+    :type username: str
+    :return: A tuple of the customer's ID and version, or None if the customer does not exist.
+    :rtype: tuple or None
+    """
+    version = None
+    conn = None
+    try:
+        shard = _shard_of_username(username)
+        if shard is not None:
+            conn = connect_for_read(shard)
+            row = conn.execute(SELECT_CUSTOMER_VERSION_BY_USERNAME, (username,)).fetchone()
+            if row:
+                version = (row[0], row[1])
+
+    except Exception as e:
+        print(f"Error getting customer version: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return version
+
+def update_customer(customer_id, updates, expected_version=None):
     """
     Updates a customer record in the 'customers' table with the provided changes.
 
+    Only the columns in UPDATABLE_COLUMNS can be updated, and a new password is stored hashed. When
+    expected_version is given the update is only applied if the customer has not been modified since that
+    version was read.
+
     :param customer_id: The ID of the customer to update.
     :type customer_id: int
     :param updates: A dictionary containing the fields to update and their new values.
     :type updates: dict
+    :param expected_version: The version of the customer the updates are based on, or None to update unconditionally.
+    :type expected_version: int or None
     :return: A dictionary containing the updated customer's details or an error message.
     :rtype: dict
+    :raises VersionConflictError: If the customer's version is not expected_version.
     """
     updated_customer = {}
+    conn = None
     try:
         if customer_id is None:
             raise ValueError("customer_id cannot be None.")
-        conn = connect_to_db()
-        cur = conn.cursor()
-        update_query = "UPDATE customers SET "
-        update_values = []
-
         if not updates:
             raise ValueError("No updates provided.")
+        invalid = set(updates) - set(UPDATABLE_COLUMNS)
+        if invalid:
+            raise ValueError(f"Cannot update column(s): {', '.join(sorted(invalid))}")
+
+        # A new username is also written to the directory, in the same transaction.
+        renames = customer_shards.sharded and 'username' in updates
+        shard = customer_shards.shard_of(customer_id)
+        conn = _connect_with_directory(shard) if renames else connect_to_shard(shard)
+        cur = conn.cursor()
 
-        for key, value in updates.items():
-            update_query += f"{key} = ?, "
-            update_values.append(value)
-
-        update_query = update_query.rstrip(', ')
-        update_query += " WHERE customer_id = ?;"
+        if 'password' in updates:
+            updates = dict(updates, password=hash_password(updates['password']))
+        columns = tuple(column for column in UPDATABLE_COLUMNS if column in updates)
+        update_values = [updates[column] for column in columns]
         update_values.append(customer_id)
-
-        print("Executing query:", update_query)
-        print("Values:", update_values)
-
-
-        cur.execute(update_query, tuple(update_values))
+        if expected_version is not None:
+            update_values.append(expected_version)
+
+        username = _cached_username(cur, customer_id)
+        cur.execute(UPDATE_CUSTOMER[columns, expected_version is not None], update_values)
+        if cur.rowcount == 0:
+            row = cur.execute(SELECT_CUSTOMER_VERSION, (customer_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Customer {customer_id} does not exist.")
+            raise VersionConflictError(customer_id, expected_version, row[0])
+        if renames:
+            cur.execute(RENAME_DIRECTORY_ENTRY, (updates['username'], customer_id))
         conn.commit()
-        updated_customer = get_customer_by_id(customer_id)
-        print("Updated customer:", updated_customer)
+        _uncache_customer(username)
+        updated_customer = get_customer_by_id(customer_id, primary=True)
 
-    except Exception as e:
+    except VersionConflictError:
         conn.rollback()
+        raise
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
         updated_customer = {"error": f"Error updating customer: {e}"}
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
     return updated_customer
 
@@ -195,16 +505,24 @@ def delete_customer(customer_id):
     :rtype: dict
     """
     message = {}
+    conn = None
     try:
-        conn = connect_to_db()
-        conn.execute("DELETE FROM customers WHERE customer_id = ?", (customer_id,))
+        shard = customer_shards.shard_of(customer_id)
+        conn = _connect_with_directory(shard) if customer_shards.sharded else connect_to_shard(shard)
+        username = _cached_username(conn.cursor(), customer_id)
+        conn.execute(DELETE_CUSTOMER, (customer_id,))
+        if customer_shards.sharded:
+            conn.execute(DELETE_DIRECTORY_ENTRY, (customer_id,))
         conn.commit()
+        _uncache_customer(username)
         message["status"] = "Customer deleted successfully"
     except Exception as e:
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         message["status"] = f"Cannot delete customer: {e}"
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
     return message
 
@@ -220,17 +538,22 @@ def charge_customer_wallet(customer_id, amount):
     :rtype: dict
     """
     updated_customer = {}
+    conn = None
     try:
-        conn = connect_to_db()
+        conn = connect_to_shard(customer_shards.shard_of(customer_id))
         cur = conn.cursor()
-        cur.execute("UPDATE customers SET wallet_balance = wallet_balance + ? WHERE customer_id = ?", (amount, customer_id))
+        username = _cached_username(cur, customer_id)
+        cur.execute(CHARGE_WALLET, (amount, customer_id))
         conn.commit()
-        updated_customer = get_customer_by_id(customer_id)
+        _uncache_customer(username)
+        updated_customer = get_customer_by_id(customer_id, primary=True)
     except Exception as e:
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         updated_customer = {"error": f"Error charging customer wallet: {e}"}
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
     return updated_customer
 
@@ -246,35 +569,146 @@ def deduce_money_from_wallet(customer_id, amount):
     :rtype: dict
     """
     updated_customer = {}
+    conn = None
     try:
-        conn = connect_to_db()
+        conn = connect_to_shard(customer_shards.shard_of(customer_id))
         cur = conn.cursor()
-        cur.execute("UPDATE customers SET wallet_balance = wallet_balance - ? WHERE customer_id = ?", (amount, customer_id))
+        username = _cached_username(cur, customer_id)
+        cur.execute(DEDUCT_WALLET, (amount, customer_id))
         conn.commit()
-        updated_customer = get_customer_by_id(customer_id)
+        _uncache_customer(username)
+        updated_customer = get_customer_by_id(customer_id, primary=True)
     except Exception as e:
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         updated_customer = {"error": f"Error deducing money from customer wallet: {e}"}
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
     return updated_customer
 
-def get_customer_by_id(customer_id):
+def apply_wallet_deltas(operations, atomic=True):
+    """
+    Adds amounts to the wallet balances of many customers in a single transaction.
+
+    Each operation is a dictionary with a 'customer_id' and a 'delta', positive to credit the wallet and negative
+    to debit it; the deltas of several operations on the same customer are added up. An operation fails if it is
+    malformed, if its customer does not exist, or if it would leave the balance negative. When atomic is True a
+    single failed operation cancels the whole batch, otherwise the other operations are applied.
+
+    The balances are checked under the database's write lock and the wallets are updated with one executemany,
+    so a batch costs one transaction however many customers it credits. With several shards, the batch holds the
+    write lock of every shard it touches until it is applied, and commits the shards one after the other. Since a
+    commit can fail after the shards before it committed, a batch is only atomic within one shard: an atomic batch
+    touching several shards is refused, with the indexes of its operations grouped by shard so it can be split,
+    and a best-effort batch that fails while committing may leave the wallets of the shards committed before
+    updated.
+
+    :param operations: The operations, at most WALLET_BATCH_MAX_OPERATIONS.
+    :type operations: list
+    :param atomic: Whether the batch is applied all or nothing.
+    :type atomic: bool
+    :return: A dictionary with 'balances', mapping the ID of each updated customer to its new balance, and
+             'failed', listing the index in operations and the error of each failed operation. When the batch is
+             rejected or cannot be applied, the dictionary contains an error message instead of the balances, and
+             'shards', the indexes of the operations of each shard in the order of the shards, when an atomic
+             batch spans several shards.
+    :rtype: dict
+    """
+    failed = []
+    deltas = {}
+    positions = {}
+    for index, operation in enumerate(operations):
+        try:
+            customer_id = operation['customer_id']
+            if isinstance(customer_id, bool) or (isinstance(customer_id, float) and not customer_id.is_integer()):
+                raise ValueError(customer_id)
+            customer_id = int(customer_id)
+            delta = operation['delta']
+            if isinstance(delta, bool) or not isinstance(delta, (int, float)) or not math.isfinite(delta):
+                raise ValueError(delta)
+        except (KeyError, TypeError, ValueError):
+            failed.append({"index": index, "error": "customer_id must be an integer and delta a finite number"})
+            continue
+        deltas[customer_id] = deltas.get(customer_id, 0) + delta
+        positions.setdefault(customer_id, []).append(index)
+    if failed and atomic:
+        return {"error": "Batch rejected, no wallet was changed", "failed": failed}
+    groups = customer_shards.group(deltas)
+    if atomic and len(groups) > 1:
+        return {"error": "An all_or_nothing batch must stay within one shard; split it by shard or use best_effort",
+                "shards": [sorted(index for customer_id in groups[shard] for index in positions[customer_id])
+                           for shard in sorted(groups)]}
+
+    result = {}
+    conns = {}
+    try:
+        # The shards are locked in the order of their index, so that concurrent batches cannot deadlock.
+        for shard in sorted(groups):
+            conns[shard] = connect_to_shard(shard)
+            conns[shard].execute("BEGIN IMMEDIATE")
+        wallets = {}
+        for shard, customer_ids in groups.items():
+            for start in range(0, len(customer_ids), BATCH_CHUNK_SIZE):
+                chunk = customer_ids[start:start + BATCH_CHUNK_SIZE]
+                for customer_id, username, balance in conns[shard].execute(select_wallets_in(len(chunk)), chunk):
+                    wallets[customer_id] = (username, balance)
+
+        updates = {}
+        balances = {}
+        for customer_id, delta in deltas.items():
+            if customer_id not in wallets:
+                error = f"Customer {customer_id} does not exist"
+            elif wallets[customer_id][1] + delta < 0:
+                error = f"Insufficient wallet balance for customer {customer_id}"
+            else:
+                updates.setdefault(customer_shards.shard_of(customer_id), []).append((delta, customer_id))
+                balances[customer_id] = wallets[customer_id][1] + delta
+                continue
+            failed.extend({"index": index, "error": error} for index in positions[customer_id])
+        failed.sort(key=lambda failure: failure['index'])
+
+        if failed and atomic:
+            for conn in conns.values():
+                conn.rollback()
+            result = {"error": "Batch rejected, no wallet was changed", "failed": failed}
+        else:
+            for shard, shard_updates in updates.items():
+                conns[shard].executemany(CHARGE_WALLET, shard_updates)
+            for conn in conns.values():
+                conn.commit()
+            for customer_id in balances:
+                _uncache_customer(wallets[customer_id][0])
+            result = {"balances": balances, "failed": failed}
+    except Exception as e:
+        for conn in conns.values():
+            conn.rollback()
+        result = {"error": f"Error applying wallet operations: {e}"}
+    finally:
+        for conn in conns.values():
+            conn.close()
+
+    return result
+
+def get_customer_by_id(customer_id, primary=False):
     """
     Retrieves a customer record from the 'customers' table based on the provided customer ID.
 
     :param customer_id: The ID of the customer to retrieve.
     :type customer_id: int
+    :param primary: Whether to read from the primary database rather than a replica.
+    :type primary: bool
     :return: A dictionary containing the details of the customer with the provided ID, or an empty dictionary if not found.
     :rtype: dict
     """
     customer = {}
+    conn = None
     try:
-        conn = connect_to_db()
+        conn = connect_for_read(customer_shards.shard_of(customer_id), primary)
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("SELECT * FROM customers WHERE customer_id = ?", (customer_id,))
+        cur.execute(SELECT_CUSTOMER_BY_ID, (customer_id,))
         row = cur.fetchone()
 
         if row:
@@ -282,7 +716,146 @@ def get_customer_by_id(customer_id):
 
     except Exception as e:
         print(f"Error getting customer by ID: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return customer
+
+def _get_customers_by(column, values):
+    """
+    Retrieves the customers whose value in the given column is one of the given values.
+
+    :param column: The column to match, either 'customer_id' or 'username'.
+    :type column: str
+    :param values: The values to look up.
+    :type values: list
+    :return: A dictionary mapping each found value to a dictionary of the customer's details.
+    :rtype: dict
+    """
+    customers = {}
+    conn = None
+    try:
+        for shard, shard_values in _group_by_shard(column, values).items():
+            conn = connect_for_read(shard)
+            conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            for start in range(0, len(shard_values), BATCH_CHUNK_SIZE):
+                chunk = shard_values[start:start + BATCH_CHUNK_SIZE]
+                cur.execute(select_customers_in(column, len(chunk)), chunk)
+                for row in cur.fetchall():
+                    customers[row[column]] = dict(row)
+            conn.close()
+            conn = None
+
+    except Exception as e:
+        print(f"Error getting customers by {column}: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return customers
+
+def _group_by_shard(column, values):
+    """
+    Groups the customer IDs or usernames to look up by the shard of their customers.
+
+    :param column: The column the values are from, either 'customer_id' or 'username'.
+    :type column: str
+    :param values: The values.
+    :type values: list
+    :return: A dictionary mapping the index of each shard to the values of its customers. Usernames missing
+             from the directory are left out.
+    :rtype: dict
+    """
+    if not customer_shards.sharded:
+        return {0: values}
+    if column == 'customer_id':
+        return customer_shards.group(values)
+    groups = {}
+    conn = connect_to_directory()
+    try:
+        for start in range(0, len(values), BATCH_CHUNK_SIZE):
+            chunk = values[start:start + BATCH_CHUNK_SIZE]
+            for username, customer_id in conn.execute(select_directory_ids_in(len(chunk)), chunk):
+                groups.setdefault(customer_shards.shard_of(customer_id), []).append(username)
     finally:
         conn.close()
+    return groups
+
+def get_customers_by_ids(customer_ids):
+    """
+    Retrieves several customer records from the 'customers' table in a single round trip.
+
+    :param customer_ids: The IDs of the customers to retrieve.
+    :type customer_ids: iterable of int
+    :return: A dictionary mapping each found customer ID to a dictionary of the customer's details.
+             IDs that do not exist are left out.
+    :rtype: dict
+    """
+    return _get_customers_by('customer_id', list(dict.fromkeys(int(customer_id) for customer_id in customer_ids)))
+
+def get_customers_by_usernames(usernames):
+    """
+    Retrieves several customer records from the 'customers' table in a single round trip.
 
+    :param usernames: The usernames of the customers to retrieve.
+    :type usernames: iterable of str
+    :return: A dictionary mapping each found username to a dictionary of the customer's details.
+             Usernames that do not exist are left out.
+    :rtype: dict
+    """
+    return _get_customers_by('username', list(dict.fromkeys(usernames)))
+
+def authenticate_customer(username, password):
+    """
+    Checks a customer's username and password.
+
+    When the stored password was hashed with outdated cost parameters, or predates password hashing, it is
+    replaced by a new hash of the password that was just verified. The hash is computed before the shard's
+    connection is taken, so the pool's connection is not held while hashing.
+
+    :param username: The username of the customer.
+    :type username: str
+    :param password: The password to check.
+    :type password: str
+    :return: A dictionary containing the customer's details, without the password, or None if the username or
+             password is wrong.
+    :rtype: dict or None
+    """
+    row = None
+    conn = None
+    try:
+        shard = _shard_of_username(username)
+        if shard is not None:
+            conn = connect_for_read(shard, primary=True)
+            row = conn.execute(SELECT_CUSTOMER_CREDENTIALS, (username,)).fetchone()
+    except Exception as e:
+        print(f"Error getting customer credentials: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+    if row is None:
+        return None
+
+    stored_password, customer = row[0], dict(zip(Customer.__slots__, row[1:]))
+    matches, needs_rehash = verify_password(password, stored_password)
+    if not matches:
+        return None
+    if needs_rehash:
+        new_password = hash_password(password)
+        conn = None
+        try:
+            conn = connect_to_shard(shard)
+            conn.execute(REHASH_PASSWORD, (new_password, customer['customer_id'], stored_password))
+            conn.commit()
+            _uncache_customer(username)
+            customer = get_customer_by_id(customer['customer_id'], primary=True)
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            print(f"Error rehashing customer password: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
     return customer
@@ -187,3 +187,132 @@ def test_get_customer_by_id(setup_test_database, sample_customer4):
     inserted_customer = insert_customer(sample_customer4)
     retrieved_customer = get_customer_by_id(inserted_customer['customer_id'])
     assert retrieved_customer['username'] == inserted_customer['username']
+
+
+def test_get_customers_by_ids(setup_test_database, sample_customer3, sample_customer4):
+    """
+    Test if getting several customers by ID returns them keyed by ID and leaves out unknown IDs.
+    :param setup_test_database: Fixture to set up the test database.
+    :param sample_customer3: Fixture for a sample customer data dictionary.
+    :param sample_customer4: Fixture for a sample customer data dictionary.
+    """
+    customer3 = get_customer_by_username(sample_customer3['username'])
+    customer4 = get_customer_by_username(sample_customer4['username'])
+    customers = get_customers_by_ids([customer3['customer_id'], customer4['customer_id'], 999999])
+    assert set(customers) == {customer3['customer_id'], customer4['customer_id']}
+    assert customers[customer4['customer_id']]['username'] == sample_customer4['username']
+
+
+def test_get_customers_by_usernames(setup_test_database, sample_customer1, sample_customer3):
+    """
+    Test if getting several customers by username returns them keyed by username.
+    :param setup_test_database: Fixture to set up the test database.
+    :param sample_customer1: Fixture for a sample customer data dictionary.
+    :param sample_customer3: Fixture for a sample customer data dictionary.
+    """
+    customers = get_customers_by_usernames([sample_customer1['username'], sample_customer3['username'], 'nobody'])
+    assert set(customers) == {sample_customer1['username'], sample_customer3['username']}
+
+
+def test_customer_version_increments_on_write(setup_test_database, sample_customer4):
+    """
+    Test if updating a customer or changing their wallet increments their version.
+    :param setup_test_database: Fixture to set up the test database.
+    :param sample_customer4: Fixture for a sample customer data dictionary.
+    """
+    customer = get_customer_by_username(sample_customer4['username'])
+    version = customer['version']
+    update_customer(customer['customer_id'], {'age': 21})
+    charge_customer_wallet(customer['customer_id'], 10.0)
+    deduce_money_from_wallet(customer['customer_id'], 5.0)
+    assert get_customer_version(sample_customer4['username']) == (customer['customer_id'], version + 3)
+    assert get_customer_version('nobody') is None
+
+
+def test_update_customer_with_expected_version(setup_test_database, sample_customer3):
+    """
+    Test if a version-checked update applies at the current version and raises on a stale one.
+    :param setup_test_database: Fixture to set up the test database.
+    :param sample_customer3: Fixture for a sample customer data dictionary.
+    """
+    customer = get_customer_by_username(sample_customer3['username'])
+    updated_customer = update_customer(customer['customer_id'], {'address': 'New Street'}, customer['version'])
+    assert updated_customer['address'] == 'New Street'
+    with pytest.raises(VersionConflictError):
+        update_customer(customer['customer_id'], {'address': 'Other Street'}, customer['version'])
+    assert 'error' in update_customer(customer['customer_id'], {'version': 1})
+
+
+def _stored_password(username):
+    conn = connect_to_db()
+    try:
+        return conn.execute("SELECT password FROM customers WHERE username = ?", (username,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_password_is_hashed(setup_test_database, sample_customer1):
+    """
+    Test if the password is stored hashed and checked by authenticate_customer.
+    :param setup_test_database: Fixture to set up the test database.
+    :param sample_customer1: Fixture for a sample customer data dictionary.
+    """
+    customer = get_customer_by_username(sample_customer1['username'])
+    assert 'password' not in customer
+    assert _stored_password(sample_customer1['username']) != sample_customer1['password']
+    assert authenticate_customer(sample_customer1['username'], sample_customer1['password'])['customer_id'] == customer['customer_id']
+    assert authenticate_customer(sample_customer1['username'], 'wrong') is None
+    assert authenticate_customer('nobody', sample_customer1['password']) is None
+
+
+def test_authenticate_customer_rehashes_plain_text_password(setup_test_database, sample_customer3):
+    """
+    Test if a password stored in plain text is replaced by a hash on login.
+    :param setup_test_database: Fixture to set up the test database.
+    :param sample_customer3: Fixture for a sample customer data dictionary.
+    """
+    conn = connect_to_db()
+    conn.execute("UPDATE customers SET password = ? WHERE username = ?", (sample_customer3['password'], sample_customer3['username']))
+    conn.commit()
+    conn.close()
+    customer = authenticate_customer(sample_customer3['username'], sample_customer3['password'])
+    assert 'password' not in customer
+    assert _stored_password(sample_customer3['username']) != sample_customer3['password']
+    assert authenticate_customer(sample_customer3['username'], sample_customer3['password']) is not None
+
+
+def test_apply_wallet_deltas(setup_test_database, sample_customer1, sample_customer4):
+    """
+    Test if a batch of wallet operations is applied in one go, all or nothing unless told otherwise.
+    :param setup_test_database: Fixture to set up the test database.
+    :param sample_customer1: Fixture for a sample customer data dictionary.
+    :param sample_customer4: Fixture for a sample customer data dictionary.
+    """
+    customer1 = get_customer_by_username(sample_customer1['username'])
+    customer4 = get_customer_by_username(sample_customer4['username'])
+    balance1, balance4 = customer1['wallet_balance'], customer4['wallet_balance']
+    operations = [{'customer_id': customer1['customer_id'], 'delta': 10},
+                  {'customer_id': customer4['customer_id'], 'delta': 2.5},
+                  {'customer_id': customer1['customer_id'], 'delta': 5}]
+    result = apply_wallet_deltas(operations)
+    assert result == {'balances': {customer1['customer_id']: balance1 + 15, customer4['customer_id']: balance4 + 2.5},
+                      'failed': []}
+    assert get_customer_by_id(customer1['customer_id'])['wallet_balance'] == balance1 + 15
+    assert get_customer_by_id(customer1['customer_id'])['version'] == customer1['version'] + 1
+
+    overdraft = [{'customer_id': customer1['customer_id'], 'delta': 1},
+                 {'customer_id': customer4['customer_id'], 'delta': -(balance4 + 100)},
+                 {'customer_id': -1, 'delta': 1},
+                 {'customer_id': customer1['customer_id'], 'delta': 'ten'}]
+    result = apply_wallet_deltas(overdraft)
+    assert 'error' in result and [failure['index'] for failure in result['failed']] == [3]
+    result = apply_wallet_deltas(overdraft[:3])
+    assert 'error' in result and [failure['index'] for failure in result['failed']] == [1, 2]
+    assert get_customer_by_id(customer1['customer_id'])['wallet_balance'] == balance1 + 15
+    result = apply_wallet_deltas(overdraft, atomic=False)
+    assert result['balances'] == {customer1['customer_id']: balance1 + 16}
+    assert [failure['index'] for failure in result['failed']] == [1, 2, 3]
+    malformed = [{'customer_id': customer1['customer_id'] + 0.7, 'delta': 1}, {'customer_id': True, 'delta': 1},
+                 {'customer_id': str(customer1['customer_id']), 'delta': 1}]
+    result = apply_wallet_deltas(malformed, atomic=False)
+    assert [failure['index'] for failure in result['failed']] == [0, 1]
+    assert result['balances'] == {customer1['customer_id']: balance1 + 17}
@@ -2,27 +2,83 @@
 Module that contains functions for connecting to and managing an SQLite3 database for an ecommerce inventory.
 """
 
+import base64
+import json
+import re
 import sqlite3
+import time
+from cdc import install_change_capture
+from connection_pool import connect
+from json_provider import RowSet, encode
+from models import Item
+from queries import (ITEM_UPDATABLE_COLUMNS, INSERT_ITEM, SELECT_ALL_ITEMS, SELECT_ITEM_BY_ID, SELECT_ITEM_BY_NAME,
+                     SELECT_ITEM_VERSION, DEDUCT_STOCK, SEARCH_ITEMS, SEARCH_ITEMS_IN_CATEGORY, UPDATE_ITEM,
+                     select_items_in, list_items)
+from replicas import open_replica_router
+from shm_cache import open_shared_cache
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 500
+BATCH_CHUNK_SIZE = 500
+CHANGE_CAPTURE_COLUMNS = ('item_id', 'name', 'category', 'price_per_item', 'description', 'count_in_stock', 'version')
+UPDATABLE_COLUMNS = ITEM_UPDATABLE_COLUMNS
+
+item_cache = open_shared_cache('inventory')
+item_replicas = open_replica_router('ecommerce_inventory.db', 'INVENTORY_REPLICA_DB')
+
+class VersionConflictError(Exception):
+    """
+    Raised when a version-checked update finds that the row was modified since the expected version.
+    """
+
+    def __init__(self, key, expected_version, current_version):
+        super().__init__(f"Expected version {expected_version} of {key}, found version {current_version}")
+        self.key = key
+        self.expected_version = expected_version
+        self.current_version = current_version
+SORT_COLUMNS = {
+    'id': 'item_id',
+    'price': 'price_per_item',
+    'name': 'name',
+    'stock': 'count_in_stock',
+}
 
 def connect_to_db():
     """
-    Establishes a connection to the database 'ecommerce_inventory.db'.
-    
+    Establishes a connection to the database 'ecommerce_inventory.db', taken from the process's pool of idle
+    connections when one is available. Closing it returns it to the pool.
+
     :return: The established connection object.
     :rtype: sqlite3.Connection
     """
-    conn = sqlite3.connect('ecommerce_inventory.db')
-    return conn
+    return connect('ecommerce_inventory.db')
 
 def connect_to_dbi():
-    conn = sqlite3.connect('ecommerce_inventory.db')
-    return conn
+    return connect('ecommerce_inventory.db')
+
+def connect_for_read(primary=False):
+    """
+    Establishes a connection for reading items: to the replica of 'ecommerce_inventory.db' when one is configured
+    and within its staleness bound, and to the database itself otherwise.
+
+    :param primary: Whether the read must see every committed write, such as a read following a write.
+    :type primary: bool
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    if primary or item_replicas is None:
+        return connect_to_db()
+    return item_replicas.connect_for_read()
 
 def create_inventory_table():
     """
     Creates a table named 'inventory' in the database if it does not already exist.
 
-    The table contains columns for item_id, name, category, price_per_item, description, and count_in_stock.
+    The table contains columns for item_id, name, category, price_per_item, description, count_in_stock, and
+    version. The version is incremented by every write to the item and is used to build HTTP ETags.
+    Every write is also recorded in the 'changes' table.
     """
     try:
         conn = connect_to_db()
@@ -33,9 +89,21 @@ def create_inventory_table():
                 category TEXT CHECK(category IN ('food', 'clothes', 'accessories', 'electronics')) NOT NULL,
                 price_per_item REAL NOT NULL,
                 description TEXT,
-                count_in_stock INTEGER NOT NULL
+                count_in_stock INTEGER NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1
             );
         ''')
+        add_version_column(conn)
+        conn.executescript('''
+            CREATE INDEX IF NOT EXISTS idx_inventory_category_price ON inventory (category, price_per_item);
+            CREATE INDEX IF NOT EXISTS idx_inventory_category_name ON inventory (category, name);
+            CREATE INDEX IF NOT EXISTS idx_inventory_category_stock ON inventory (category, count_in_stock);
+            CREATE INDEX IF NOT EXISTS idx_inventory_price ON inventory (price_per_item);
+            CREATE INDEX IF NOT EXISTS idx_inventory_name ON inventory (name);
+            CREATE INDEX IF NOT EXISTS idx_inventory_stock ON inventory (count_in_stock);
+        ''')
+        create_inventory_search_index(conn)
+        install_change_capture(conn, 'inventory', 'item_id', CHANGE_CAPTURE_COLUMNS)
         conn.commit()
         print("Inventory table created successfully")
     except Exception as e:
@@ -43,6 +111,60 @@ def create_inventory_table():
     finally:
         conn.close()
 
+def add_version_column(conn):
+    """
+    Adds the 'version' column to an 'inventory' table created before items were versioned.
+
+    :param conn: An open connection to the inventory database.
+    :type conn: sqlite3.Connection
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(inventory)")]
+    if 'version' not in columns:
+        conn.execute("ALTER TABLE inventory ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+def create_inventory_search_index(conn):
+    """
+    Creates the FTS5 full-text index over the 'inventory' table if it does not already exist.
+
+    The index is an external-content FTS5 table on the item's name and description, kept in sync
+    with 'inventory' by triggers. When the index is created on an already populated table it is
+    rebuilt from the existing rows.
+
+    :param conn: An open connection to the inventory database.
+    :type conn: sqlite3.Connection
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'inventory_fts'"
+    ).fetchone()
+    conn.executescript('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5(
+            name,
+            description,
+            content='inventory',
+            content_rowid='item_id',
+            prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON inventory BEGIN
+            INSERT INTO inventory_fts (rowid, name, description)
+            VALUES (new.item_id, new.name, new.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON inventory BEGIN
+            INSERT INTO inventory_fts (inventory_fts, rowid, name, description)
+            VALUES ('delete', old.item_id, old.name, old.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_update AFTER UPDATE OF name, description ON inventory BEGIN
+            INSERT INTO inventory_fts (inventory_fts, rowid, name, description)
+            VALUES ('delete', old.item_id, old.name, old.description);
+            INSERT INTO inventory_fts (rowid, name, description)
+            VALUES (new.item_id, new.name, new.description);
+        END;
+    ''')
+    if not exists:
+        conn.execute("INSERT INTO inventory_fts (inventory_fts) VALUES ('rebuild')")
+
 def add_item(item):
     """
     Inserts a new item record into the 'inventory' table.
@@ -60,10 +182,7 @@ def add_item(item):
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO inventory (name, category, price_per_item, description, count_in_stock)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+        cur.execute(INSERT_ITEM, (
             item['name'],
             item['category'],
             item['price_per_item'],
@@ -71,7 +190,7 @@ def add_item(item):
             item['count_in_stock']
         ))
         conn.commit()
-        added_item = get_item_by_id(cur.lastrowid)
+        added_item = get_item_by_id(cur.lastrowid, primary=True)
     except Exception as e:
         conn.rollback()
         added_item = {"error": f"Error adding item: {e}"}
@@ -79,26 +198,44 @@ def add_item(item):
         conn.close()
     return added_item
 
+def get_all_item_rows():
+    """
+    Retrieves all items from the 'inventory' table as a RowSet, which holds the row tuples without building a
+    dictionary or model per item until the response is encoded.
+
+    :return: The items' rows, empty if an error occurs.
+    :rtype: RowSet
+    """
+    items = RowSet((), [])
+    try:
+        conn = connect_for_read()
+        cur = conn.cursor()
+        cur.execute(SELECT_ALL_ITEMS)
+        items = RowSet.from_cursor(cur)
+
+    except Exception as e:
+        print(f"Error getting all items: {e}")
+    finally:
+        conn.close()
+
+    return items
+
 def get_all_items():
     """
     Retrieves all items from the 'inventory' table.
 
-    :return: A list of dictionaries, where each dictionary represents an item.
+    :return: A list of Item models, which can be used as dictionaries, one per item.
     :rtype: list
 
     :raises: Exception if an error occurs during the database operation.
     """
     items = []
     try:
-        conn = connect_to_db()
-        conn.row_factory = sqlite3.Row
+        conn = connect_for_read()
+        conn.row_factory = Item.row_factory
         cur = conn.cursor()
-        cur.execute("SELECT * FROM inventory")
-        rows = cur.fetchall()
-
-        for row in rows:
-            item = dict(row)
-            items.append(item)
+        cur.execute(SELECT_ALL_ITEMS)
+        items = cur.fetchall()
 
     except Exception as e:
         print(f"Error getting all items: {e}")
@@ -107,24 +244,139 @@ def get_all_items():
 
     return items
 
-def get_item_by_id(item_id):
+def encode_items_cursor(item, sort='id'):
+    """
+    Builds the opaque pagination cursor that continues a listing after the given item.
+
+    :param item: The last item of the current page.
+    :type item: dict
+
+    :param sort: The sort key the listing is ordered by.
+    :type sort: str
+
+    :return: The cursor to pass to get_items to fetch the next page.
+    :rtype: str
+    """
+    position = [item[SORT_COLUMNS[sort]], item['item_id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_items_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_items_cursor.
+
+    :param cursor: The opaque cursor.
+    :type cursor: str
+
+    :return: The sort value and item_id of the last item of the previous page.
+    :rtype: tuple
+
+    :raises ValueError: If the cursor is malformed.
+    """
+    try:
+        value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(item_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def get_items(category=None, min_price=None, max_price=None, in_stock=False, sort='id', cursor=None,
+              limit=LIST_DEFAULT_LIMIT):
+    """
+    Retrieves a filtered and sorted page of items from the 'inventory' table.
+
+    Filters are applied in SQL and pagination uses the (sort value, item_id) of the last item seen,
+    so every page is an index range scan regardless of how deep into the listing it is.
+
+    :param category: Only return items of this category when given.
+    :type category: str or None
+
+    :param min_price: Only return items priced at least this much when given.
+    :type min_price: float or None
+
+    :param max_price: Only return items priced at most this much when given.
+    :type max_price: float or None
+
+    :param in_stock: Only return items with a positive count_in_stock when True.
+    :type in_stock: bool
+
+    :param sort: The key to sort by, one of 'id', 'price', 'name' or 'stock'.
+    :type sort: str
+
+    :param cursor: The cursor returned for the previous page, or None for the first page.
+    :type cursor: str or None
+
+    :param limit: The maximum number of items to return, capped at LIST_MAX_LIMIT.
+    :type limit: int
+
+    :return: A list of dictionaries, where each dictionary represents an item, or a dictionary
+             containing an error message.
+    :rtype: list or dict
+    """
+    if sort not in SORT_COLUMNS:
+        return {"error": f"Invalid sort key: {sort}"}
+    sort_column = SORT_COLUMNS[sort]
+
+    params = []
+    if category:
+        params.append(category)
+    if min_price is not None:
+        params.append(min_price)
+    if max_price is not None:
+        params.append(max_price)
+    if cursor:
+        try:
+            value, item_id = decode_items_cursor(cursor)
+        except ValueError as e:
+            return {"error": str(e)}
+        if sort_column != 'item_id':
+            params.append(value)
+        params.append(item_id)
+    sql = list_items(sort_column, bool(category), min_price is not None, max_price is not None, bool(in_stock),
+                     bool(cursor))
+    params.append(max(1, min(int(limit), LIST_MAX_LIMIT)))
+
+    items = []
+    try:
+        conn = connect_for_read()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        items = [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        items = {"error": f"Error getting items: {e}"}
+    finally:
+        conn.close()
+
+    return items
+
+def get_item_by_id(item_id, primary=False):
     """
     Retrieves an item from the 'inventory' table by its item_id.
 
     :param item_id: The unique identifier for the item.
     :type item_id: int
 
+    :param primary: Whether to read from the primary database rather than a replica.
+    :type primary: bool
+
     :return: A dictionary containing the item's details.
     :rtype: dict
 
     :raises: Exception if an error occurs during the database operation.
     """
+    if item_cache is not None and _item_cache_key(item_id) is not None:
+        cached = item_cache.get(_item_cache_key(item_id))
+        if cached is not None:
+            return json.loads(cached)
+    read_at = time.time()
+
     item = {}
     try:
-        conn = connect_to_db()
+        conn = connect_for_read(primary)
+        if conn.snapshot_time is not None:
+            read_at = conn.snapshot_time
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("SELECT * FROM inventory WHERE item_id = ?", (item_id,))
+        cur.execute(SELECT_ITEM_BY_ID, (item_id,))
         row = cur.fetchone()
 
         if row:
@@ -135,8 +387,94 @@ def get_item_by_id(item_id):
     finally:
         conn.close()
 
+    if item and item_cache is not None:
+        item_cache.put(_item_cache_key(item['item_id']), encode(item), read_at)
     return item
 
+def _item_cache_key(item_id):
+    """
+    Builds the key of an item in the shared cache. The ID is normalised to an integer, so that 7 and '7', which
+    name the same row, share one entry and a write through either invalidates it.
+
+    :param item_id: The unique identifier for the item.
+    :type item_id: int or str
+    :return: The key, or None if the ID is not an integer, in which case no item has it.
+    :rtype: bytes or None
+    """
+    if isinstance(item_id, float) and not item_id.is_integer():
+        return None
+    try:
+        return f"item:{int(item_id)}".encode()
+    except (TypeError, ValueError):
+        return None
+
+def _uncache_item(item_id):
+    """
+    Removes an item from the shared cache after a write to it was committed.
+
+    :param item_id: The unique identifier for the item.
+    :type item_id: int or str
+    """
+    if item_cache is not None and _item_cache_key(item_id) is not None:
+        item_cache.delete(_item_cache_key(item_id))
+
+def get_items_by_ids(item_ids):
+    """
+    Retrieves several items from the 'inventory' table in a single round trip.
+
+    The ids are looked up with one IN query per BATCH_CHUNK_SIZE ids, which keeps the number of bound
+    parameters below SQLite's limit.
+
+    :param item_ids: The unique identifiers of the items.
+    :type item_ids: iterable of int
+
+    :return: A dictionary mapping each found item_id to a dictionary of the item's details. Ids that
+             do not exist are left out.
+    :rtype: dict
+    """
+    items = {}
+    item_ids = list(dict.fromkeys(int(item_id) for item_id in item_ids))
+    try:
+        conn = connect_for_read()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        for start in range(0, len(item_ids), BATCH_CHUNK_SIZE):
+            chunk = item_ids[start:start + BATCH_CHUNK_SIZE]
+            cur.execute(select_items_in(len(chunk)), chunk)
+            for row in cur.fetchall():
+                items[row['item_id']] = dict(row)
+
+    except Exception as e:
+        print(f"Error getting items by IDs: {e}")
+    finally:
+        conn.close()
+
+    return items
+
+def get_item_version(item_id):
+    """
+    Retrieves the current version of an item without reading the rest of the row.
+
+    :param item_id: The unique identifier for the item.
+    :type item_id: int
+
+    :return: The item's version, or None if the item does not exist.
+    :rtype: int or None
+    """
+    version = None
+    try:
+        conn = connect_for_read()
+        row = conn.execute(SELECT_ITEM_VERSION, (item_id,)).fetchone()
+        if row:
+            version = row[0]
+
+    except Exception as e:
+        print(f"Error getting item version: {e}")
+    finally:
+        conn.close()
+
+    return version
+
 def get_item_by_name(item_name):
     """
     Retrieves an item from the 'inventory' table by its name.
@@ -150,9 +488,9 @@ def get_item_by_name(item_name):
     :raises: Exception if an error occurs during the database operation.
     """
     try:
-        conn = connect_to_db()
+        conn = connect_for_read()
         cur = conn.cursor()
-        cur.execute('SELECT * FROM inventory WHERE name = ?', (item_name,))
+        cur.execute(SELECT_ITEM_BY_NAME, (item_name,))
         row = cur.fetchone()
 
         if row:
@@ -166,39 +504,57 @@ def get_item_by_name(item_name):
     finally:
         conn.close()
 
-def update_item(item_id, updates):
+def update_item(item_id, updates, expected_version=None):
     """
     Updates an item in the 'inventory' table.
 
+    Only the columns in UPDATABLE_COLUMNS can be updated. When expected_version is given the update is
+    only applied if the item has not been modified since that version was read.
+
     :param item_id: The unique identifier for the item to be updated.
     :type item_id: int
 
     :param updates: A dictionary containing the fields to be updated and their new values.
     :type updates: dict
 
+    :param expected_version: The version of the item the updates are based on, or None to update
+                             unconditionally.
+    :type expected_version: int or None
+
     :return: A dictionary containing the updated item's details or an error message.
     :rtype: dict
 
-    :raises: Exception if an error occurs during the database operation.
+    :raises VersionConflictError: If the item's version is not expected_version.
     """
     updated_item = {}
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        update_query = "UPDATE inventory SET "
-        update_values = []
-
-        for key, value in updates.items():
-            update_query += f"{key} = ?, "
-            update_values.append(value)
-
-        update_query = update_query.rstrip(', ')
-        update_query += f" WHERE item_id = {item_id}"
-
-        cur.execute(update_query, tuple(update_values))
+        if not updates:
+            raise ValueError("No updates provided.")
+        invalid = set(updates) - set(UPDATABLE_COLUMNS)
+        if invalid:
+            raise ValueError(f"Cannot update column(s): {', '.join(sorted(invalid))}")
+
+        columns = tuple(column for column in UPDATABLE_COLUMNS if column in updates)
+        update_values = [updates[column] for column in columns]
+        update_values.append(item_id)
+        if expected_version is not None:
+            update_values.append(expected_version)
+
+        cur.execute(UPDATE_ITEM[columns, expected_version is not None], update_values)
+        if cur.rowcount == 0:
+            row = cur.execute(SELECT_ITEM_VERSION, (item_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Item {item_id} does not exist.")
+            raise VersionConflictError(item_id, expected_version, row[0])
         conn.commit()
-        updated_item = get_item_by_id(item_id)
+        _uncache_item(item_id)
+        updated_item = get_item_by_id(item_id, primary=True)
 
+    except VersionConflictError:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         updated_item = {"error": f"Error updating item: {e}"}
@@ -226,9 +582,10 @@ def deduce_item_from_stock(item_id, quantity):
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        cur.execute("UPDATE inventory SET count_in_stock = count_in_stock - ? WHERE item_id = ?", (quantity, item_id))
+        cur.execute(DEDUCT_STOCK, (quantity, item_id))
         conn.commit()
-        updated_item = get_item_by_id(item_id)
+        _uncache_item(item_id)
+        updated_item = get_item_by_id(item_id, primary=True)
     except Exception as e:
         conn.rollback()
         updated_item = {"error": f"Error deducing item from stock: {e}"}
@@ -236,3 +593,66 @@ def deduce_item_from_stock(item_id, quantity):
         conn.close()
 
     return updated_item
+
+def build_search_query(text):
+    """
+    Converts free text typed by a user into an FTS5 MATCH expression.
+
+    Every word of the input becomes a quoted prefix term, so that FTS5 operators in the input are
+    treated as plain words and partially typed words still match.
+
+    :param text: The search text.
+    :type text: str
+
+    :return: The MATCH expression, or an empty string if the text contains no searchable words.
+    :rtype: str
+    """
+    terms = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_items(query, category=None, limit=SEARCH_DEFAULT_LIMIT, offset=0):
+    """
+    Searches the items' names and descriptions using the full-text index.
+
+    Results are ranked by BM25, with matches in the name weighted above matches in the description.
+
+    :param query: The search text. Each word is matched as a prefix.
+    :type query: str
+
+    :param category: Restricts the results to a single category when given.
+    :type category: str or None
+
+    :param limit: The maximum number of items to return, capped at SEARCH_MAX_LIMIT.
+    :type limit: int
+
+    :param offset: The number of ranked items to skip, used for pagination.
+    :type offset: int
+
+    :return: A list of dictionaries, where each dictionary represents a matching item, or a dictionary
+             containing an error message.
+    :rtype: list or dict
+    """
+    match = build_search_query(query)
+    if not match:
+        return {"error": "Search query must contain at least one word"}
+
+    limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+    offset = max(0, int(offset))
+    if category:
+        sql, params = SEARCH_ITEMS_IN_CATEGORY, (match, category, limit, offset)
+    else:
+        sql, params = SEARCH_ITEMS, (match, limit, offset)
+
+    items = []
+    try:
+        conn = connect_for_read()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        items = [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        items = {"error": f"Error searching items: {e}"}
+    finally:
+        conn.close()
+
+    return items
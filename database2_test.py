@@ -1,3 +1,4 @@
+import base64
 import pytest
 from database2 import *
 
@@ -151,3 +152,124 @@ def test_deduce_item_from_stock(setup_test_inventory, sample_item4):
     added_item = add_item(sample_item4)
     updated_item = deduce_item_from_stock(added_item['item_id'], 5)
     assert updated_item['count_in_stock'] == 10
+
+def test_search_items(setup_test_inventory, sample_item3):
+    """
+    Test if searching items matches word prefixes in the name and description.
+    Already added items 1 to 4 in previous tests.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    :param sample_item3: Fixture for a sample item data dictionary (item_id: 3).
+    """
+    results = search_items('yet anoth')
+    assert [item['name'] for item in results] == [sample_item3['name']]
+    assert len(search_items('item')) == len(get_all_items())
+
+def test_search_items_by_category(setup_test_inventory, sample_item1):
+    """
+    Test if searching items can be restricted to a category.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    :param sample_item1: Fixture for a sample item data dictionary.
+    """
+    results = search_items('item', category='electronics')
+    assert [item['name'] for item in results] == [sample_item1['name']]
+
+def test_search_items_ranking_and_pagination(setup_test_inventory):
+    """
+    Test if name matches rank above description matches and if limit and offset page through the results.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    """
+    in_description = add_item({'name': 'Cable', 'category': 'electronics', 'price_per_item': 3.0,
+                               'description': 'Works with any zephyr speaker', 'count_in_stock': 5})
+    in_name = add_item({'name': 'Zephyr speaker', 'category': 'electronics', 'price_per_item': 40.0,
+                        'description': 'Portable speaker', 'count_in_stock': 5})
+    first_page = search_items('zeph', limit=1)
+    second_page = search_items('zeph', limit=1, offset=1)
+    assert [item['item_id'] for item in first_page + second_page] == [in_name['item_id'], in_description['item_id']]
+
+def test_search_items_invalid_query(setup_test_inventory):
+    """
+    Test if searching without any word returns an error.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    """
+    assert 'error' in search_items('"*')
+
+def test_get_items_filters(setup_test_inventory):
+    """
+    Test if listing items applies the category, price and stock filters.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    """
+    items = get_items(category='electronics', min_price=10.0, max_price=45.0, in_stock=True)
+    assert items and all(item['category'] == 'electronics' and 10.0 <= item['price_per_item'] <= 45.0
+                         and item['count_in_stock'] > 0 for item in items)
+
+def test_get_items_sorted_pages(setup_test_inventory):
+    """
+    Test if paging through a sorted listing with cursors returns every item once, in order.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    """
+    expected = sorted(get_all_items(), key=lambda item: (item['price_per_item'], item['item_id']))
+    seen = []
+    cursor = None
+    while True:
+        page = get_items(sort='price', cursor=cursor, limit=2)
+        seen.extend(page)
+        if len(page) < 2:
+            break
+        cursor = encode_items_cursor(page[-1], 'price')
+    assert [item['item_id'] for item in seen] == [item['item_id'] for item in expected]
+
+def test_get_items_invalid_arguments(setup_test_inventory):
+    """
+    Test if listing items with an unknown sort key or a malformed cursor returns an error.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    """
+    assert 'error' in get_items(sort='colour')
+    assert 'error' in get_items(cursor='not-a-cursor')
+    assert 'error' in get_items(cursor=base64.urlsafe_b64encode(b'[1, null]').decode())
+
+def test_get_items_by_ids(setup_test_inventory):
+    """
+    Test if getting several items by ID returns them keyed by ID and leaves out unknown IDs.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    """
+    all_items = get_all_items()
+    wanted = [item['item_id'] for item in all_items[:3]]
+    items = get_items_by_ids(wanted + [999999])
+    assert sorted(items) == sorted(wanted)
+    assert items[wanted[0]] == all_items[0]
+
+def test_item_version_increments_on_write(setup_test_inventory, sample_item4):
+    """
+    Test if updating an item or deducting it from stock increments its version.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    :param sample_item4: Fixture for a sample item data dictionary.
+    """
+    added_item = add_item(sample_item4)
+    assert added_item['version'] == 1
+    assert update_item(added_item['item_id'], {'price_per_item': 16.0})['version'] == 2
+    assert deduce_item_from_stock(added_item['item_id'], 1)['version'] == 3
+    assert get_item_version(added_item['item_id']) == 3
+    assert get_item_version(999999) is None
+
+def test_update_item_with_expected_version(setup_test_inventory, sample_item1):
+    """
+    Test if a version-checked update applies at the current version and raises on a stale one.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    :param sample_item1: Fixture for a sample item data dictionary.
+    """
+    added_item = add_item(sample_item1)
+    updated_item = update_item(added_item['item_id'], {'count_in_stock': 9}, expected_version=added_item['version'])
+    assert updated_item['count_in_stock'] == 9
+    with pytest.raises(VersionConflictError) as conflict:
+        update_item(added_item['item_id'], {'count_in_stock': 8}, expected_version=added_item['version'])
+    assert conflict.value.current_version == updated_item['version']
+    assert get_item_by_id(added_item['item_id'])['count_in_stock'] == 9
+
+def test_update_item_invalid_columns(setup_test_inventory):
+    """
+    Test if updating columns outside the whitelist, or a missing item, returns an error.
+    :param setup_test_inventory: Fixture to set up the test inventory database.
+    """
+    assert 'error' in update_item(1, {'version': 100})
+    assert 'error' in update_item(1, {'price_per_item = 0, name': 'x'})
+    assert 'error' in update_item(999999, {'name': 'Missing'})
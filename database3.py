@@ -2,37 +2,86 @@
 Module that contains functions for connecting to and managing an SQLite3 database for recording sales in an ecommerce platform.
 """
 
+import base64
+import json
+import os
 import sqlite3
-from database2 import connect_to_dbi
+from datetime import date, datetime, timezone
+from analytics import create_rollup_tables, record_sale
+from cdc import install_change_capture
+from connection_pool import connect
+from models import Sale
+from queries import (INSERT_SALE, SELECT_PARTITIONS, SELECT_PARTITION_PATHS_AFTER, SELECT_PARTITION, SELECT_SALES_AFTER,
+                     SELECT_SALES_BATCH_AFTER, SELECT_SALES_IN_RANGE, SELECT_CUSTOMER_SALES, SELECT_OPEN_MONTHS_BEFORE,
+                     ATTACH_ARCHIVE, DETACH_ARCHIVE, COPY_SALES_TO_ARCHIVE, SELECT_ARCHIVE_BOUNDS, DELETE_SALES_BETWEEN,
+                     INSERT_PARTITION, customer_sales_page)
+from service_client import inventory_client, ServiceUnavailableError, ServiceRequestError
+
+SALES_ARCHIVE_DIR = 'sales_archive'
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 500
 
 def connect_to_db():
     """
-    Establishes a connection to the database 'ecommerce_sales.db'.
-    
+    Establishes a connection to the database 'ecommerce_sales.db', taken from the process's pool of idle
+    connections when one is available. Closing it returns it to the pool.
+
     :return: The established connection object.
     :rtype: sqlite3.Connection
     """
-    conn = sqlite3.connect('ecommerce_sales.db')
-    return conn
+    return connect('ecommerce_sales.db')
+
+def create_sales_schema(conn, schema='main'):
+    """
+    Creates the 'sales' table in the given schema of a connection if it does not already exist.
+
+    The same table definition, including the (customer_id, sale_date) index that serves customer order
+    histories, is used for the hot 'sales' table and for every archived month.
+
+    :param conn: An open connection to a sales database.
+    :type conn: sqlite3.Connection
+
+    :param schema: The name of the (possibly attached) database to create the table in.
+    :type schema: str
+    """
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.sales (
+            sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER,
+            item_id INTEGER,
+            sale_date TEXT,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
+            FOREIGN KEY (item_id) REFERENCES inventory(item_id)
+        );
+    ''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_sales_customer_date ON sales (customer_id, sale_date)")
 
 def create_sales_table():
     """
     Creates a table named 'sales' in the database if it does not already exist.
 
     The table contains columns for sale_id, customer_id, item_id, sale_date, with foreign key constraints.
+    It only holds the sales of months that have not been archived yet; the 'sales_partitions' table
+    catalogues the read-only files that closed months were archived to.
+    The analytics rollup tables are created alongside it, and new sales are recorded in the 'changes' table
+    (only insertions are captured, so archiving a month does not appear as deletions).
     """
     try:
         conn = connect_to_db()
+        create_sales_schema(conn)
         conn.execute('''
-            CREATE TABLE IF NOT EXISTS sales (
-                sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER,
-                item_id INTEGER,
-                sale_date TEXT,
-                FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
-                FOREIGN KEY (item_id) REFERENCES inventory(item_id)
+            CREATE TABLE IF NOT EXISTS sales_partitions (
+                month TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                sales INTEGER NOT NULL,
+                first_sale_id INTEGER,
+                last_sale_id INTEGER,
+                archived_at TEXT NOT NULL
             );
         ''')
+        create_rollup_tables(conn)
+        install_change_capture(conn, 'sales', 'sale_id', ['sale_id', 'customer_id', 'item_id', 'sale_date'],
+                               operations=('INSERT',))
         conn.commit()
         print("Sales table created successfully")
     except Exception as e:
@@ -40,9 +89,9 @@ def create_sales_table():
     finally:
         conn.close()
 
-def make_sale(customer_id, item_id):
+def make_sale(customer_id, item_id, price_per_item=None, category=None):
     """
-    Records a sale in the 'sales' table.
+    Records a sale in the 'sales' table and adds it to the analytics rollups in the same transaction.
 
     :param customer_id: The unique identifier for the customer making the sale.
     :type customer_id: int
@@ -50,71 +99,435 @@ def make_sale(customer_id, item_id):
     :param item_id: The unique identifier for the item being sold.
     :type item_id: int
 
+    :param price_per_item: The price the item is sold at. Looked up in the inventory when not given.
+    :type price_per_item: float or None
+
+    :param category: The category of the item. Looked up in the inventory when not given.
+    :type category: str or None
+
+    :return: The sale_id of the recorded sale, or None if the sale could not be recorded.
+    :rtype: int or None
+
     :raises: Exception if an error occurs during the database operation.
     """
+    sale_id = None
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO sales (customer_id, item_id, sale_date)
-            VALUES (?, ?, datetime('now'))
-        ''', (customer_id, item_id))
+        if price_per_item is None or category is None:
+            item = inventory_client().get_items_by_ids([item_id]).get(int(item_id), {})
+            price_per_item = item.get('price_per_item', 0.0) if price_per_item is None else price_per_item
+            category = item.get('category', 'unknown') if category is None else category
+        sale_date = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        cur.execute(INSERT_SALE, (customer_id, item_id, sale_date))
+        sale_id = cur.lastrowid
+        record_sale(cur, customer_id, item_id, sale_date, price_per_item, category)
         conn.commit()
     except Exception as e:
         conn.rollback()
+        sale_id = None
         print(f"Error making sale: {e}")
     finally:
         conn.close()
 
+    return sale_id
+
+def _month_bounds(month):
+    """
+    Computes the first day of a month and of the month after it.
+
+    :param month: The month, formatted as 'YYYY-MM'.
+    :type month: str
+
+    :return: The two days, formatted as 'YYYY-MM-DD'.
+    :rtype: tuple
+
+    :raises ValueError: If the month is not formatted as 'YYYY-MM'.
+    """
+    start = datetime.strptime(month, '%Y-%m').date()
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+def _connect_to_archive(path):
+    """
+    Opens an archived month read-only.
+
+    Archives are never written after they are created, so they are opened as immutable, which skips
+    all file locking.
+
+    :param path: The path of the archive file.
+    :type path: str
+
+    :return: The established connection object.
+    :rtype: sqlite3.Connection
+    """
+    return sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+
+def _sales_partitions(conn, date_from=None, date_to=None):
+    """
+    Lists the partitions holding sales between two dates, the hot 'sales' table first and then the
+    archived months from newest to oldest.
+
+    :param conn: An open connection to the sales database.
+    :type conn: sqlite3.Connection
+
+    :param date_from: The first date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :return: The (month, path) of each partition, with (None, None) standing for the hot table.
+    :rtype: list
+    """
+    rows = conn.execute(SELECT_PARTITIONS, (date_from, date_from, date_to, date_to)).fetchall()
+    return [(None, None)] + [(row[0], row[1]) for row in rows]
+
+def _query_sales(sql, params, date_from=None, date_to=None, limit=None):
+    """
+    Runs a query against the 'sales' table of every partition between two dates.
+
+    When a limit is given the query must return sales newest first, and partitions are read from newest
+    to oldest until enough sales have been found; older archives are then not opened at all.
+
+    :param sql: The SQL statement, reading from a table named 'sales'.
+    :type sql: str
+
+    :param params: The statement's parameters.
+    :type params: tuple or list
+
+    :param date_from: The first date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :param limit: The number of newest sales wanted, or None to read every partition.
+    :type limit: int or None
+
+    :return: The rows of every partition read, the hot table first and then the archives from newest to oldest.
+    :rtype: list of sqlite3.Row
+    """
+    rows = []
+    conn = connect_to_db()
+    try:
+        for month, path in _sales_partitions(conn, date_from, date_to):
+            if limit is not None and month is not None and len(rows) >= limit:
+                newest = sorted((row['sale_date'] for row in rows), reverse=True)
+                if newest[limit - 1] >= _month_bounds(month)[1]:
+                    break
+            partition = conn if path is None else _connect_to_archive(path)
+            try:
+                partition.row_factory = sqlite3.Row
+                rows.extend(partition.execute(sql, params).fetchall())
+            finally:
+                if partition is not conn:
+                    partition.close()
+    finally:
+        conn.close()
+    return rows
+
+def iter_sales(after_sale_id=0, batch_size=10000):
+    """
+    Yields every sale with a sale_id above after_sale_id in batches of bounded size.
+
+    Archived months are read before the hot table, each in sale_id order; archived months whose last sale is not
+    above after_sale_id are skipped without being opened.
+
+    The hot table is read one batch at a time, each batch in a short read transaction that ends before the batch
+    is yielded, so a slow consumer never holds a lock that would block new sales. Each of these transactions also
+    lists the archived months again: the sales of a month archived since the previous batch, which are no longer
+    in the hot table, are read from its archive before the batch.
+
+    :param after_sale_id: Only sales with a greater sale_id are yielded.
+    :type after_sale_id: int
+
+    :param batch_size: The maximum number of sales per batch.
+    :type batch_size: int
+
+    :return: A generator of lists of (sale_id, customer_id, item_id, sale_date) tuples.
+    :rtype: generator
+    """
+    read_paths = set()
+    last_sale_id = after_sale_id
+    while True:
+        conn = connect_to_db()
+        try:
+            conn.execute("BEGIN")
+            paths = [row[0] for row in conn.execute(SELECT_PARTITION_PATHS_AFTER, (last_sale_id,))
+                     if row[0] not in read_paths]
+            batch = conn.execute(SELECT_SALES_BATCH_AFTER, (last_sale_id, batch_size)).fetchall()
+            conn.rollback()
+        finally:
+            conn.close()
+
+        for path in paths:
+            archive = _connect_to_archive(path)
+            try:
+                yield from _iter_partition(archive, last_sale_id, batch_size)
+            finally:
+                archive.close()
+            read_paths.add(path)
+
+        if not batch:
+            break
+        yield batch
+        last_sale_id = batch[-1][0]
+
+def _iter_partition(conn, after_sale_id, batch_size):
+    """
+    Yields the sales of one partition with a sale_id above after_sale_id in batches of bounded size.
+
+    :param conn: An open connection to the partition.
+    :type conn: sqlite3.Connection
+
+    :param after_sale_id: Only sales with a greater sale_id are yielded.
+    :type after_sale_id: int
+
+    :param batch_size: The maximum number of sales per batch.
+    :type batch_size: int
+
+    :return: A generator of lists of (sale_id, customer_id, item_id, sale_date) tuples.
+    :rtype: generator
+    """
+    cur = conn.execute(SELECT_SALES_AFTER, (after_sale_id,))
+    while True:
+        batch = cur.fetchmany(batch_size)
+        if not batch:
+            break
+        yield batch
+
+def get_sales_in_range(date_from=None, date_to=None):
+    """
+    Retrieves the sales made between two dates, reading only the partitions that can hold them.
+
+    :param date_from: The first date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :return: A list of dictionaries with sale_id, customer_id, item_id and sale_date, ordered by sale_id.
+    :rtype: list
+    """
+    sales = []
+    try:
+        rows = _query_sales(SELECT_SALES_IN_RANGE, (date_from, date_from, date_to, date_to), date_from, date_to)
+        sales = sorted((dict(row) for row in rows), key=lambda sale: sale['sale_id'])
+    except Exception as e:
+        print(f"Error getting sales in range: {e}")
+
+    return sales
+
+def archive_month(month):
+    """
+    Moves the sales of a closed month out of the hot 'sales' table into a read-only file of its own.
+
+    The month's rows are copied into a new database in SALES_ARCHIVE_DIR and deleted from 'sales' in a single
+    transaction, and the archive is recorded in 'sales_partitions'. The archive is then vacuumed and made
+    read-only.
+
+    :param month: The month to archive, formatted as 'YYYY-MM'. It must be before the current month.
+    :type month: str
+
+    :return: A dictionary describing the archived partition or an error message.
+    :rtype: dict
+    """
+    result = {}
+    conn = None
+    try:
+        start, end = _month_bounds(month)
+        if month >= datetime.now(timezone.utc).strftime('%Y-%m'):
+            raise ValueError(f"Month {month} is not closed yet.")
+        path = os.path.join(SALES_ARCHIVE_DIR, f"sales_{month.replace('-', '_')}.db")
+
+        conn = connect_to_db()
+        if conn.execute(SELECT_PARTITION, (month,)).fetchone():
+            raise ValueError(f"Month {month} is already archived.")
+        os.makedirs(SALES_ARCHIVE_DIR, exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+
+        conn.execute(ATTACH_ARCHIVE, (path,))
+        create_sales_schema(conn, 'archive')
+        conn.execute(COPY_SALES_TO_ARCHIVE, (start, end))
+        count, first_sale_id, last_sale_id = conn.execute(SELECT_ARCHIVE_BOUNDS).fetchone()
+        if count == 0:
+            conn.rollback()
+            conn.execute(DETACH_ARCHIVE)
+            os.remove(path)
+            return {"month": month, "sales": 0}
+
+        conn.execute(DELETE_SALES_BETWEEN, (start, end))
+        conn.execute(INSERT_PARTITION, (month, path, count, first_sale_id, last_sale_id))
+        conn.commit()
+        conn.execute(DETACH_ARCHIVE)
+
+        archive = sqlite3.connect(path)
+        archive.execute("VACUUM")
+        archive.close()
+        os.chmod(path, 0o444)
+        result = {"month": month, "path": path, "sales": count,
+                  "first_sale_id": first_sale_id, "last_sale_id": last_sale_id}
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
+            # The connection returns to the pool, which must not keep the archive attached.
+            try:
+                conn.execute(DETACH_ARCHIVE)
+            except sqlite3.Error:
+                pass
+        result = {"error": f"Error archiving month: {e}"}
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return result
+
+def archive_closed_months():
+    """
+    Archives every month before the current one that still has sales in the hot 'sales' table.
+
+    :return: A list of dictionaries describing each archived month or the error it failed with.
+    :rtype: list
+    """
+    current_month_start = datetime.now(timezone.utc).strftime('%Y-%m-01')
+    try:
+        conn = connect_to_db()
+        months = [row[0] for row in conn.execute(
+            SELECT_OPEN_MONTHS_BEFORE,
+            (current_month_start,)
+        )]
+    finally:
+        conn.close()
+    return [archive_month(month) for month in months]
+
 def get_customer_sales(customer_id):
     """
-    Retrieves sales made by a specific customer.
+    Retrieves sales made by a specific customer, from the hot 'sales' table and every archived month.
 
     :param customer_id: The unique identifier for the customer.
     :type customer_id: int
 
-    :return: A list of dictionaries, where each dictionary represents a sale with sale_id, sale_date,
-             item_name, and price_per_item details.
+    :return: A list of Sale models, which can be used as dictionaries, with sale_id, sale_date, item_name and
+             price_per_item details.
     :rtype: list
 
     :raises: Exception if an error occurs during the database operation.
     """
     sales = []
     try:
-        conn_sales = connect_to_db()
-        conn_sales.row_factory = sqlite3.Row
-        cur_sales = conn_sales.cursor()
-        cur_sales.execute('''
-            SELECT sales.sale_id, sales.sale_date, sales.item_id
-            FROM sales
-            WHERE sales.customer_id = ?
-        ''', (customer_id,))
-        rows_sales = cur_sales.fetchall()
-
-        conn_inventory = connect_to_dbi()
-        conn_inventory.row_factory = sqlite3.Row
-        cur_inventory = conn_inventory.cursor()
+        rows_sales = _query_sales(SELECT_CUSTOMER_SALES, (customer_id,))
+        rows_sales.sort(key=lambda row_sales: row_sales['sale_id'])
+
+        items = inventory_client().get_items_by_ids(row_sales['item_id'] for row_sales in rows_sales)
 
         for row_sales in rows_sales:
-            cur_inventory.execute('''
-                SELECT inventory.name, inventory.price_per_item
-                FROM inventory
-                WHERE inventory.item_id = ?
-            ''', (row_sales['item_id'],))
-            row_inventory = cur_inventory.fetchone()
-
-            sale = {
-                'sale_id': row_sales['sale_id'],
-                'sale_date': row_sales['sale_date'],
-                'item_name': row_inventory['name'],
-                'price_per_item': row_inventory['price_per_item']
-            }
-            sales.append(sale)
+            item = items.get(row_sales['item_id'], {})
+            sales.append(Sale(row_sales['sale_id'], row_sales['sale_date'], item.get('name'), item.get('price_per_item')))
 
     except Exception as e:
         print(f"Error getting customer sales: {e}")
-    finally:
-        conn_sales.close()
-        conn_inventory.close()
+
+    return sales
+
+def encode_sales_cursor(sale):
+    """
+    Builds the opaque pagination cursor that continues a customer's order history after the given sale.
+
+    :param sale: The last sale of the current page.
+    :type sale: dict
+
+    :return: The cursor to pass to get_customer_sales_page to fetch the next page.
+    :rtype: str
+    """
+    position = [sale['sale_date'], sale['sale_id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_sales_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_sales_cursor.
+
+    :param cursor: The opaque cursor.
+    :type cursor: str
+
+    :return: The sale_date and sale_id of the last sale of the previous page.
+    :rtype: tuple
+
+    :raises ValueError: If the cursor is malformed.
+    """
+    try:
+        sale_date, sale_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(sale_date, str):
+            raise ValueError(sale_date)
+        return sale_date, int(sale_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def get_customer_sales_page(customer_id, date_from=None, date_to=None, limit=HISTORY_DEFAULT_LIMIT, cursor=None):
+    """
+    Retrieves a page of a customer's sales, newest first.
+
+    Each page is read from the (customer_id, sale_date) index starting at the cursor. Archived months newer than
+    the cursor are skipped, and older ones are only opened when the page reaches back into them, so the cost of a
+    page does not grow with the customer's number of purchases.
+
+    :param customer_id: The unique identifier for the customer.
+    :type customer_id: int
+
+    :param date_from: The first date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_from: str or None
+
+    :param date_to: The last date to include, formatted as 'YYYY-MM-DD', or None.
+    :type date_to: str or None
+
+    :param limit: The maximum number of sales to return, capped at HISTORY_MAX_LIMIT.
+    :type limit: int
+
+    :param cursor: The cursor returned for the previous page, or None for the most recent sales.
+    :type cursor: str or None
+
+    :return: A list of Sale models, which can be used as dictionaries, with sale_id, sale_date, item_name and
+             price_per_item details, or a dictionary containing an error message.
+    :rtype: list or dict
+
+    :raises ServiceUnavailableError: If the inventory service cannot be reached.
+    :raises ServiceRequestError: If the inventory service refused the lookup of the items.
+    """
+    limit = max(1, min(int(limit), HISTORY_MAX_LIMIT))
+    before_date, before_id = None, None
+    if cursor:
+        try:
+            before_date, before_id = decode_sales_cursor(cursor)
+        except ValueError as e:
+            return {"error": str(e)}
+
+    params = [customer_id]
+    if date_from:
+        params.append(date_from)
+    if date_to:
+        params.append(date_to)
+    if cursor:
+        params.extend([before_date, before_id])
+    params.append(limit)
+
+    sales = []
+    try:
+        newest = min(date_to, before_date) if date_to and before_date else date_to or before_date
+        rows_sales = _query_sales(customer_sales_page(bool(date_from), bool(date_to), bool(cursor)), params, date_from,
+                                  newest, limit)
+        rows_sales.sort(key=lambda row_sales: (row_sales['sale_date'], row_sales['sale_id']), reverse=True)
+        rows_sales = rows_sales[:limit]
+
+        items = inventory_client().get_items_by_ids(row_sales['item_id'] for row_sales in rows_sales)
+
+        for row_sales in rows_sales:
+            item = items.get(row_sales['item_id'], {})
+            sales.append(Sale(row_sales['sale_id'], row_sales['sale_date'], item.get('name'), item.get('price_per_item')))
+
+    except (ServiceUnavailableError, ServiceRequestError):
+        raise
+    except Exception as e:
+        sales = {"error": f"Error getting customer sales: {e}"}
 
     return sales
@@ -1,4 +1,8 @@
+import base64
+import os
 import pytest
+from datetime import datetime, timezone
+import database3
 from database3 import *
 from database2 import *
 from database1 import *
@@ -68,3 +72,123 @@ def test_get_customer_sales(setup_test_sales_database, sample_sale):
     """
     sales = get_customer_sales(sample_sale['customer_id'])
     assert len(sales) == 1
+
+@pytest.fixture
+def partitioned_sales_database(tmp_path, monkeypatch):
+    """
+    Fixture to set up a fresh sales database in a temporary directory holding sales from two closed
+    months and from today.
+    :return: The sale_ids of the sales made in the closed months.
+    :rtype: list
+    """
+    monkeypatch.chdir(tmp_path)
+    create_inventory_table()
+    create_sales_table()
+    conn = database3.connect_to_db()
+    old_sale_ids = []
+    for customer_id, sale_date in [(1, '2024-01-10 10:00:00'), (2, '2024-01-20 10:00:00'), (1, '2024-02-05 10:00:00')]:
+        cur = conn.execute("INSERT INTO sales (customer_id, item_id, sale_date) VALUES (?, 1, ?)", (customer_id, sale_date))
+        old_sale_ids.append(cur.lastrowid)
+    conn.commit()
+    conn.close()
+    make_sale(1, 1)
+    return old_sale_ids
+
+def test_archive_month(partitioned_sales_database):
+    """
+    Test if archiving a month moves its sales to a read-only file and keeps them readable.
+    :param partitioned_sales_database: Fixture to set up the partitioned sales database.
+    """
+    archived = archive_month('2024-01')
+    assert archived['sales'] == 2
+    assert not os.access(archived['path'], os.W_OK) or os.geteuid() == 0
+    conn = database3.connect_to_db()
+    assert conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == 2
+    conn.close()
+    assert [sale['sale_id'] for sale in get_sales_in_range()][:3] == partitioned_sales_database
+    assert [sale['customer_id'] for sale in get_sales_in_range('2024-01-01', '2024-01-15')] == [1]
+    assert len(get_customer_sales(1)) == 3
+
+def test_archive_month_rejects_open_and_archived_months(partitioned_sales_database):
+    """
+    Test if archiving the current month or an already archived month returns an error.
+    :param partitioned_sales_database: Fixture to set up the partitioned sales database.
+    """
+    assert 'error' in archive_month(datetime.now(timezone.utc).strftime('%Y-%m'))
+    archive_month('2024-02')
+    assert 'error' in archive_month('2024-02')
+
+def test_archive_closed_months(partitioned_sales_database):
+    """
+    Test if every closed month is archived and only today's sale stays in the hot table.
+    :param partitioned_sales_database: Fixture to set up the partitioned sales database.
+    """
+    assert [archived['month'] for archived in archive_closed_months()] == ['2024-01', '2024-02']
+    conn = database3.connect_to_db()
+    assert conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == 1
+    conn.close()
+    assert len(get_sales_in_range()) == 4
+
+def test_get_customer_sales_page(partitioned_sales_database):
+    """
+    Test if a customer's order history is paged newest first across the hot table and archived months.
+    :param partitioned_sales_database: Fixture to set up the partitioned sales database.
+    """
+    archive_month('2024-01')
+    first_page = get_customer_sales_page(1, limit=2)
+    assert first_page[1]['sale_id'] == partitioned_sales_database[2]
+    second_page = get_customer_sales_page(1, limit=2, cursor=encode_sales_cursor(first_page[-1]))
+    assert [sale['sale_id'] for sale in second_page] == [partitioned_sales_database[0]]
+
+def test_get_customer_sales_page_date_range(partitioned_sales_database):
+    """
+    Test if a customer's order history can be restricted to a range of dates.
+    :param partitioned_sales_database: Fixture to set up the partitioned sales database.
+    """
+    archive_month('2024-01')
+    sales = get_customer_sales_page(1, date_from='2024-01-01', date_to='2024-02-05')
+    assert [sale['sale_id'] for sale in sales] == [partitioned_sales_database[2], partitioned_sales_database[0]]
+    assert 'error' in get_customer_sales_page(1, cursor='not-a-cursor')
+    for position in (b'["2024-01-01", null]', b'[null, 5]', b'{}', b'[1, 2, 3]'):
+        with pytest.raises(ValueError):
+            decode_sales_cursor(base64.urlsafe_b64encode(position).decode())
+        assert 'error' in get_customer_sales_page(1, cursor=base64.urlsafe_b64encode(position).decode())
+
+def test_get_customer_sales_page_skips_newer_months(partitioned_sales_database, monkeypatch):
+    """
+    Test if a page starting at a cursor does not open the archived months newer than the cursor.
+    :param partitioned_sales_database: Fixture to set up the partitioned sales database.
+    """
+    archive_closed_months()
+    opened = []
+    connect_to_archive = database3._connect_to_archive
+
+    def record(path):
+        opened.append(os.path.basename(path))
+        return connect_to_archive(path)
+
+    monkeypatch.setattr(database3, '_connect_to_archive', record)
+    cursor = encode_sales_cursor({'sale_date': '2024-01-31 00:00:00', 'sale_id': partitioned_sales_database[2]})
+    assert [sale['sale_id'] for sale in get_customer_sales_page(1, cursor=cursor)] == [partitioned_sales_database[0]]
+    assert opened == ['sales_2024_01.db']
+
+def test_iter_sales_sees_month_archived_meanwhile(partitioned_sales_database, monkeypatch):
+    """
+    Test if a month archived between two batches of the hot table is still read, once.
+    :param partitioned_sales_database: Fixture to set up the partitioned sales database.
+    """
+    connect = database3.connect_to_db
+    calls = []
+
+    def connect_then_archive():
+        calls.append(None)
+        if len(calls) == 2:
+            monkeypatch.setattr(database3, 'connect_to_db', connect)
+            archive_month('2024-01')
+        return connect()
+
+    monkeypatch.setattr(database3, 'connect_to_db', connect_then_archive)
+    sale_ids = [sale[0] for batch in iter_sales(batch_size=2) for sale in batch]
+    assert sorted(sale_ids) == sorted(set(sale_ids))
+    assert set(partitioned_sales_database) <= set(sale_ids)
+    assert len(sale_ids) == 4
@@ -0,0 +1,342 @@
+"""
+Module that exports snapshots of the sales, customers and inventory databases to columnar files for analytics.
+
+Sales are joined with the inventory and written together with full snapshots of the customers and inventory as
+compressed Parquet or Arrow IPC files, in batches of bounded size. A manifest in the output directory remembers
+the last exported sale_id, so later runs only export the sales made since.
+
+Exporting requires the optional ``pyarrow`` package.
+
+Usage::
+
+    python export.py <output_dir> [--format parquet|arrow] [--full] [--batch-size N]
+"""
+
+import argparse
+import io
+import json
+import os
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+import database1
+import database2
+from database3 import iter_sales
+from service_client import inventory_client
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_BATCH_SIZE = 10000
+
+SALES_COLUMNS = [
+    ('sale_id', 'int64'),
+    ('customer_id', 'int64'),
+    ('item_id', 'int64'),
+    ('sale_date', 'string'),
+    ('item_name', 'string'),
+    ('category', 'string'),
+    ('price_per_item', 'float64'),
+]
+CUSTOMERS_COLUMNS = [
+    ('customer_id', 'int64'),
+    ('full_name', 'string'),
+    ('username', 'string'),
+    ('age', 'int64'),
+    ('address', 'string'),
+    ('gender', 'string'),
+    ('marital_status', 'string'),
+    ('wallet_balance', 'float64'),
+    ('version', 'int64'),
+]
+INVENTORY_COLUMNS = [
+    ('item_id', 'int64'),
+    ('name', 'string'),
+    ('category', 'string'),
+    ('price_per_item', 'float64'),
+    ('description', 'string'),
+    ('count_in_stock', 'int64'),
+    ('version', 'int64'),
+]
+
+
+def _require_pyarrow():
+    """
+    Checks that the optional pyarrow dependency is installed.
+
+    :raises RuntimeError: If pyarrow cannot be imported.
+    """
+    if pa is None:
+        raise RuntimeError("Exporting requires the pyarrow package: pip install pyarrow")
+
+
+def make_schema(columns):
+    """
+    Builds the Arrow schema of an exported table.
+
+    :param columns: The (name, Arrow type name) of every column.
+    :type columns: list
+    :return: The schema.
+    :rtype: pyarrow.Schema
+    """
+    _require_pyarrow()
+    return pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in columns])
+
+
+def make_batch(schema, rows):
+    """
+    Converts rows into an Arrow record batch, one column at a time.
+
+    :param schema: The schema of the batch.
+    :type schema: pyarrow.Schema
+    :param rows: The rows, as tuples in schema order.
+    :type rows: list
+    :return: The record batch.
+    :rtype: pyarrow.RecordBatch
+    """
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+class BatchWriter:
+    """
+    Writes record batches to a compressed Parquet or Arrow IPC file.
+
+    The file is written under a temporary name and moved into place when the writer is closed, so readers
+    never see a partially written file.
+    """
+
+    def __init__(self, path, schema, format='parquet'):
+        _require_pyarrow()
+        self.path = path
+        self.temporary_path = path + '.tmp'
+        if format == 'parquet':
+            self.writer = pa.parquet.ParquetWriter(self.temporary_path, schema, compression='zstd')
+        else:
+            options = pa.ipc.IpcWriteOptions(compression='zstd')
+            self.writer = pa.ipc.new_file(self.temporary_path, schema, options=options)
+        self.rows = 0
+
+    def write(self, batch):
+        """
+        Appends a record batch to the file.
+
+        :param batch: The record batch.
+        :type batch: pyarrow.RecordBatch
+        """
+        if batch.num_rows:
+            self.writer.write_batch(batch)
+            self.rows += batch.num_rows
+
+    def close(self):
+        """
+        Finishes the file and moves it into place.
+        """
+        self.writer.close()
+        os.replace(self.temporary_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.writer.close()
+            os.remove(self.temporary_path)
+
+
+def iter_sales_batches(after_sale_id=0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yields the sales made after a sale_id joined with the name, category and price of their item.
+
+    :param after_sale_id: Only sales with a greater sale_id are exported.
+    :type after_sale_id: int
+    :param batch_size: The maximum number of sales per batch.
+    :type batch_size: int
+    :return: A generator of Arrow record batches with the SALES_COLUMNS columns.
+    :rtype: generator
+    """
+    schema = make_schema(SALES_COLUMNS)
+    for sales in iter_sales(after_sale_id, batch_size):
+        items = inventory_client().get_items_by_ids(sale[2] for sale in sales)
+        rows = []
+        for sale_id, customer_id, item_id, sale_date in sales:
+            item = items.get(item_id, {})
+            rows.append((sale_id, customer_id, item_id, sale_date,
+                         item.get('name'), item.get('category'), item.get('price_per_item')))
+        yield make_batch(schema, rows)
+
+
+def iter_table_batches(connect, table, columns, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yields every row of a table as Arrow record batches.
+
+    :param connect: The function opening a connection to the table's database.
+    :type connect: callable
+    :param table: The name of the table.
+    :type table: str
+    :param columns: The (name, Arrow type name) of the columns to export.
+    :type columns: list
+    :param batch_size: The maximum number of rows per batch.
+    :type batch_size: int
+    :return: A generator of Arrow record batches.
+    :rtype: generator
+    """
+    schema = make_schema(columns)
+    conn = connect()
+    try:
+        cur = conn.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table}")
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield make_batch(schema, rows)
+    finally:
+        conn.close()
+
+
+def read_manifest(output_dir):
+    """
+    Reads the export manifest of an output directory.
+
+    :param output_dir: The directory exports are written to.
+    :type output_dir: str
+    :return: The manifest, with the last exported sale_id under 'last_sale_id'.
+    :rtype: dict
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {'last_sale_id': 0, 'exports': []}
+
+
+def export_snapshot(output_dir, format='parquet', full=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Exports the sales made since the previous export and full snapshots of the customers and inventory.
+
+    Sales are written to a new file named after the range of sale_ids it holds; the customers and inventory
+    snapshots replace the previous ones. Customers' passwords are not exported.
+
+    :param output_dir: The directory to write the files and manifest to.
+    :type output_dir: str
+    :param format: 'parquet' or 'arrow' (Arrow IPC file format).
+    :type format: str
+    :param full: Export every sale instead of only those made since the previous export.
+    :type full: bool
+    :param batch_size: The maximum number of rows held in memory at once.
+    :type batch_size: int
+    :return: A dictionary describing the exported files or an error message.
+    :rtype: dict
+    """
+    result = {}
+    try:
+        _require_pyarrow()
+        if format not in FORMATS:
+            raise ValueError(f"Unknown export format: {format}")
+        extension = FORMATS[format]
+        os.makedirs(output_dir, exist_ok=True)
+        manifest = read_manifest(output_dir)
+        after_sale_id = 0 if full else manifest['last_sale_id']
+
+        sales_path = os.path.join(output_dir, f'sales_after_{after_sale_id}{extension}')
+        last_sale_id = after_sale_id
+        with BatchWriter(sales_path, make_schema(SALES_COLUMNS), format) as sales_writer:
+            for batch in iter_sales_batches(after_sale_id, batch_size):
+                sales_writer.write(batch)
+                last_sale_id = max(last_sale_id, batch.column(0)[-1].as_py())
+        final_sales_path = os.path.join(output_dir, f'sales_{after_sale_id + 1}_{last_sale_id}{extension}')
+        if sales_writer.rows:
+            os.replace(sales_path, final_sales_path)
+        else:
+            os.remove(sales_path)
+
+        snapshots = {}
+        # The customers are read from every shard in turn.
+        for name, connectors, columns in (('customers', database1.shard_connectors(), CUSTOMERS_COLUMNS),
+                                          ('inventory', [database2.connect_to_db], INVENTORY_COLUMNS)):
+            path = os.path.join(output_dir, f'{name}{extension}')
+            with BatchWriter(path, make_schema(columns), format) as writer:
+                for connect in connectors:
+                    for batch in iter_table_batches(connect, name, columns, batch_size):
+                        writer.write(batch)
+            snapshots[name] = writer.rows
+
+        result = {
+            'exported_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            'format': format,
+            'sales_file': os.path.basename(final_sales_path) if sales_writer.rows else None,
+            'sales': sales_writer.rows,
+            'first_sale_id': after_sale_id + 1 if sales_writer.rows else None,
+            'last_sale_id': last_sale_id,
+            'customers': snapshots['customers'],
+            'inventory': snapshots['inventory'],
+        }
+        manifest['last_sale_id'] = last_sale_id
+        manifest['exports'].append(result)
+        with open(os.path.join(output_dir, MANIFEST_NAME + '.tmp'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(os.path.join(output_dir, MANIFEST_NAME + '.tmp'), os.path.join(output_dir, MANIFEST_NAME))
+    except Exception as e:
+        result = {"error": f"Error exporting snapshot: {e}"}
+
+    return result
+
+
+def stream_sales(after_sale_id=0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams the sales made after a sale_id, joined with their item, in the Arrow IPC streaming format.
+
+    Every batch is encoded and handed out as soon as it is read, so memory use does not depend on the number
+    of sales exported.
+
+    :param after_sale_id: Only sales with a greater sale_id are exported.
+    :type after_sale_id: int
+    :param batch_size: The maximum number of sales per batch.
+    :type batch_size: int
+    :return: A generator of the encoded stream's chunks.
+    :rtype: generator
+    """
+    _require_pyarrow()
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, make_schema(SALES_COLUMNS), options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    def take():
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    for batch in iter_sales_batches(after_sale_id, batch_size):
+        writer.write_batch(batch)
+        yield take()
+    writer.close()
+    yield take()
+
+
+def main():
+    """
+    Runs an export from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Export sales, customers and inventory to columnar files.")
+    parser.add_argument('output_dir', help="directory to write the files and manifest to")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    parser.add_argument('--full', action='store_true', help="export every sale, not only those since the last export")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    result = export_snapshot(args.output_dir, args.format, args.full, args.batch_size)
+    print(json.dumps(result, indent=2))
+    if 'error' in result:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import pytest
+from export import *
+from database1 import create_customers_table, insert_customer
+from database2 import create_inventory_table, add_item
+from database3 import create_sales_table, make_sale
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet
+
+@pytest.fixture
+def export_databases(tmp_path, monkeypatch):
+    """
+    Fixture to set up fresh databases in a temporary directory with a customer, an item and two sales.
+
+    :return: The directory to export to.
+    :rtype: str
+    """
+    monkeypatch.chdir(tmp_path)
+    create_customers_table()
+    create_inventory_table()
+    create_sales_table()
+    insert_customer({'full_name': 'Jane Doe', 'username': 'jane', 'password': 'secret', 'age': 40,
+                     'address': 'Main Street', 'gender': 'Female', 'marital_status': 'Single'})
+    item = add_item({'name': 'Lamp', 'category': 'accessories', 'price_per_item': 12.5,
+                     'description': 'A lamp', 'count_in_stock': 3})
+    make_sale(1, item['item_id'])
+    make_sale(1, item['item_id'])
+    return str(tmp_path / 'export')
+
+def test_export_snapshot(export_databases):
+    """
+    Test if an export writes the sales joined with the inventory and the customers without passwords.
+    :param export_databases: Fixture to set up the databases.
+    """
+    result = export_snapshot(export_databases, batch_size=1)
+    assert result['sales'] == 2 and result['last_sale_id'] == 2
+    sales = pa.parquet.read_table(os.path.join(export_databases, result['sales_file'])).to_pydict()
+    assert sales['item_name'] == ['Lamp', 'Lamp']
+    assert sales['price_per_item'] == [12.5, 12.5]
+    customers = pa.parquet.read_table(os.path.join(export_databases, 'customers.parquet'))
+    assert customers.num_rows == 1 and 'password' not in customers.column_names
+
+def test_export_snapshot_incremental(export_databases):
+    """
+    Test if a second export only writes the sales made since the first one.
+    :param export_databases: Fixture to set up the databases.
+    """
+    export_snapshot(export_databases, format='arrow')
+    assert export_snapshot(export_databases, format='arrow')['sales'] == 0
+    make_sale(1, 1)
+    result = export_snapshot(export_databases, format='arrow')
+    assert (result['sales'], result['first_sale_id'], result['last_sale_id']) == (1, 3, 3)
+    with pa.ipc.open_file(os.path.join(export_databases, result['sales_file'])) as reader:
+        assert reader.read_all().column('sale_id').to_pylist() == [3]
+    assert read_manifest(export_databases)['last_sale_id'] == 3
+
+def test_stream_sales(export_databases):
+    """
+    Test if the streamed Arrow IPC sales can be read back.
+    :param export_databases: Fixture to set up the databases.
+    """
+    stream = b''.join(stream_sales(after_sale_id=1, batch_size=1))
+    assert pa.ipc.open_stream(stream).read_all().column('sale_id').to_pylist() == [2]
+
+def test_stream_sales_does_not_block_sales(export_databases):
+    """
+    Test if a sale can be made while a stream is paused part-way through, and is streamed after the others.
+    :param export_databases: Fixture to set up the databases.
+    """
+    stream = stream_sales(batch_size=1)
+    chunks = [next(stream)]
+    assert make_sale(1, 1) == 3
+    chunks.extend(stream)
+    assert pa.ipc.open_stream(b''.join(chunks)).read_all().column('sale_id').to_pylist() == [1, 2, 3]
+
+def test_export_snapshot_unknown_format(export_databases):
+    """
+    Test if exporting to an unknown format returns an error.
+    :param export_databases: Fixture to set up the databases.
+    """
+    assert 'error' in export_snapshot(export_databases, format='csv')
@@ -0,0 +1,113 @@
+"""
+Module that contains helpers for answering conditional HTTP requests from row versions.
+
+Every versioned row (items, customers) gets an entity tag built from its key and version, so a client
+that already holds the current representation can be answered with ``304 Not Modified`` after a
+cheap version lookup, without reading or serialising the row. The tags sent by clients are compared without the
+encoding suffix that the compression module adds to compressed responses.
+"""
+
+from flask import request, make_response, jsonify
+
+from compression import decoded_etag
+
+
+def make_etag(kind, key, version):
+    """
+    Builds the entity tag of a versioned row.
+
+    :param kind: A short name for the type of row, e.g. 'item' or 'customer'.
+    :type kind: str
+    :param key: The row's primary key.
+    :type key: int or str
+    :param version: The row's version.
+    :type version: int
+    :return: The unquoted entity tag.
+    :rtype: str
+    """
+    return f"{kind}-{key}-{version}"
+
+
+def _matching_tag(etags, etag):
+    """
+    Finds the tag of a request header that names a representation of the given entity tag.
+
+    :param etags: The tags of the header.
+    :type etags: werkzeug.datastructures.ETags
+    :param etag: The unquoted entity tag of the uncompressed representation.
+    :type etag: str
+    :return: The matching tag, with its encoding suffix if it has one, or None.
+    :rtype: str or None
+    """
+    for tag in etags.as_set():
+        if decoded_etag(tag) == etag:
+            return tag
+    return None
+
+
+def is_not_modified(etag):
+    """
+    Checks whether the current request's ``If-None-Match`` header matches the given entity tag.
+
+    :param etag: The unquoted entity tag of the current representation.
+    :type etag: str
+    :return: True if the client's copy is current and a 304 response can be sent.
+    :rtype: bool
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return request.if_none_match.star_tag or _matching_tag(request.if_none_match, etag) is not None
+
+
+def not_modified(etag):
+    """
+    Builds an empty ``304 Not Modified`` response carrying the entity tag of the client's representation, which is
+    the given tag with the encoding suffix the client's copy has, if any.
+
+    :param etag: The unquoted entity tag of the current representation.
+    :type etag: str
+    :return: The 304 response.
+    :rtype: flask.Response
+    """
+    response = make_response('', 304)
+    response.set_etag(_matching_tag(request.if_none_match, etag) or etag)
+    return response
+
+
+def if_match_version(kind, key):
+    """
+    Extracts the version a conditional write is based on from the current request's ``If-Match`` header.
+
+    :param kind: A short name for the type of row, e.g. 'item' or 'customer'.
+    :type kind: str
+    :param key: The row's primary key.
+    :type key: int or str
+    :return: None if the header is absent or ``*``, otherwise the version named by the entity tag for
+             this row, or 0 (a version no row has) if no entity tag refers to this row.
+    :rtype: int or None
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    prefix = make_etag(kind, key, '')
+    for etag in map(decoded_etag, if_match.as_set()):
+        if etag.startswith(prefix) and etag[len(prefix):].isdigit():
+            return int(etag[len(prefix):])
+    return 0
+
+
+def precondition_failed(message, etag=None):
+    """
+    Builds a ``412 Precondition Failed`` response for a conditional write that lost a race.
+
+    :param message: The error message to send.
+    :type message: str
+    :param etag: The unquoted entity tag of the row's current version, if it still exists.
+    :type etag: str or None
+    :return: The 412 response.
+    :rtype: flask.Response
+    """
+    response = make_response(jsonify({"error": message}), 412)
+    if etag:
+        response.set_etag(etag)
+    return response
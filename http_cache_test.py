@@ -0,0 +1,88 @@
+import pytest
+from flask import Flask
+from http_cache import *
+
+@pytest.fixture
+def app():
+    """
+    Fixture providing a bare Flask application to build request contexts from.
+
+    :return: Flask application
+    :rtype: Flask
+    """
+    return Flask(__name__)
+
+def test_make_etag():
+    """
+    Test if the entity tag changes with the row's version.
+    """
+    assert make_etag('item', 1, 1) != make_etag('item', 1, 2)
+    assert make_etag('item', 1, 1) != make_etag('customer', 1, 1)
+
+def test_is_not_modified(app):
+    """
+    Test if a matching If-None-Match header is detected.
+
+    :param app: Flask application
+    :type app: Flask
+    """
+    etag = make_etag('item', 1, 3)
+    with app.test_request_context(headers={'If-None-Match': f'"{etag}"'}):
+        assert is_not_modified(etag)
+        assert not is_not_modified(make_etag('item', 1, 4))
+    with app.test_request_context():
+        assert not is_not_modified(etag)
+
+def test_not_modified(app):
+    """
+    Test if the 304 response is empty and carries the entity tag.
+
+    :param app: Flask application
+    :type app: Flask
+    """
+    with app.test_request_context():
+        response = not_modified('item-1-3')
+    assert response.status_code == 304
+    assert response.get_etag() == ('item-1-3', False)
+    assert response.get_data() == b''
+
+def test_if_match_version(app):
+    """
+    Test if the version is extracted from an If-Match header naming the row.
+
+    :param app: Flask application
+    :type app: Flask
+    """
+    with app.test_request_context(headers={'If-Match': '"item-7-4"'}):
+        assert if_match_version('item', 7) == 4
+        assert if_match_version('item', 8) == 0
+    with app.test_request_context(headers={'If-Match': '*'}):
+        assert if_match_version('item', 7) is None
+    with app.test_request_context():
+        assert if_match_version('item', 7) is None
+
+def test_compressed_representation_tags(app):
+    """
+    Test if the tags of compressed representations match their row, and a 304 echoes the client's tag.
+
+    :param app: Flask application
+    :type app: Flask
+    """
+    with app.test_request_context(headers={'If-None-Match': '"item-1-3-gzip"', 'If-Match': '"item-1-3-br"'}):
+        assert is_not_modified('item-1-3')
+        assert not is_not_modified('item-1-4')
+        assert not_modified('item-1-3').get_etag() == ('item-1-3-gzip', False)
+        assert if_match_version('item', 1) == 3
+
+def test_precondition_failed(app):
+    """
+    Test if the 412 response carries the error and the current entity tag.
+
+    :param app: Flask application
+    :type app: Flask
+    """
+    with app.test_request_context():
+        response = precondition_failed('conflict', 'item-7-5')
+    assert response.status_code == 412
+    assert response.get_etag() == ('item-7-5', False)
+    assert response.json == {'error': 'conflict'}
@@ -0,0 +1,146 @@
+"""
+Module that contains the JSON provider used by the three Flask applications.
+
+Responses are encoded with ``orjson`` when it is installed, and with the standard library's ``json`` module
+otherwise. Besides what Flask can serialise, the provider serialises the row models of the models module,
+``sqlite3.Row`` objects and RowSet, the rows of a query together with their column names.
+
+A RowSet keeps the rows as the tuples sqlite3 returns, and is only turned into dictionaries when it is encoded.
+The dictionaries share the RowSet's key strings, whose encoding orjson caches, but one is still built per row: the
+C encoders turn a list of dictionaries into JSON faster than Python code can splice row tuples between column
+names encoded once per query (see benchmark_json.py, which measures both).
+
+``orjson`` is an optional dependency; install it with ``pip install orjson`` for faster responses.
+"""
+
+import json
+import sqlite3
+
+from flask.json.provider import DefaultJSONProvider
+
+from models import RowModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def encode(obj):
+    """
+    Serialises plain JSON values (dictionaries, lists, strings, numbers, booleans and None) to compact UTF-8 JSON.
+
+    :param obj: The value.
+    :return: The JSON document.
+    :rtype: bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+class RowSet:
+    """
+    The rows returned by a query, as tuples, with the names of their columns.
+    """
+
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        """
+        :param columns: The names of the columns.
+        :type columns: tuple
+        :param rows: The rows, as tuples in column order.
+        :type rows: list
+        """
+        self.columns = tuple(columns)
+        self.rows = rows
+
+    @classmethod
+    def from_cursor(cls, cur):
+        """
+        Fetches every remaining row of an executed query.
+
+        :param cur: The cursor the query was executed with. Its connection must not use sqlite3.Row as row factory.
+        :type cur: sqlite3.Cursor
+        :return: The rows.
+        :rtype: RowSet
+        """
+        return cls([column[0] for column in cur.description], cur.fetchall())
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        """
+        Iterates over the rows as dictionaries.
+        """
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def to_list(self):
+        """
+        Converts the rows to dictionaries.
+
+        :return: A list of dictionaries, one per row.
+        :rtype: list
+        """
+        return list(self)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    A JSON provider encoding with orjson when available, which also serialises RowSet and sqlite3.Row.
+
+    Keys are not sorted, so objects keep the order of their columns.
+    """
+
+    sort_keys = False
+
+    if orjson is not None:
+        # Dates are left to Flask's default, so both encoders produce the same output.
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    @staticmethod
+    def default(o):
+        """
+        Converts the objects the encoders do not handle themselves.
+
+        :param o: The object.
+        :return: A serialisable equivalent of the object.
+        :raises TypeError: If the object cannot be serialised.
+        """
+        if isinstance(o, RowModel):
+            return o.to_dict()
+        if isinstance(o, RowSet):
+            return o.to_list()
+        if isinstance(o, sqlite3.Row):
+            return dict(zip(o.keys(), o))
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialises an object to a JSON string.
+
+        :param obj: The object.
+        :return: The JSON string.
+        :rtype: str
+        """
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=self.default, option=self.options).decode()
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """
+        Serialises the arguments to a JSON response, as ``flask.jsonify`` does.
+
+        With orjson, the encoded bytes are used as the body without decoding them to a string first. In debug
+        mode the output is indented and encoded by the standard library.
+
+        :return: The response.
+        :rtype: flask.Response
+        """
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
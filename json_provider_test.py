@@ -0,0 +1,73 @@
+import datetime
+import json
+import sqlite3
+import pytest
+from flask import Flask, jsonify
+import json_provider
+from json_provider import *
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def app(request, monkeypatch):
+    """
+    Fixture providing an application using FastJSONProvider, once with orjson and once with the standard library.
+
+    :return: The application.
+    :rtype: flask.Flask
+    """
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(json_provider, 'orjson', None)
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    return app
+
+@pytest.fixture
+def cursor():
+    """
+    Fixture providing a cursor on a small in-memory table.
+
+    :return: The cursor.
+    :rtype: sqlite3.Cursor
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER, name TEXT, price REAL)")
+    conn.executemany("INSERT INTO t VALUES (?, ?, ?)", [(1, 'a "quoted" name', 1.5), (2, None, 2.0)])
+    yield conn.cursor()
+    conn.close()
+
+def test_row_set(cursor):
+    """
+    Test if a RowSet holds the query's columns and converts its rows to dictionaries.
+    """
+    rows = RowSet.from_cursor(cursor.execute("SELECT * FROM t ORDER BY id"))
+    assert rows.columns == ('id', 'name', 'price')
+    assert len(rows) == 2
+    assert rows.to_list() == [{'id': 1, 'name': 'a "quoted" name', 'price': 1.5}, {'id': 2, 'name': None, 'price': 2.0}]
+
+def test_jsonify_row_set(app, cursor):
+    """
+    Test if a RowSet is serialised as a list of objects in column order.
+    """
+    rows = RowSet.from_cursor(cursor.execute("SELECT * FROM t ORDER BY id"))
+    with app.app_context():
+        response = jsonify(rows)
+    assert response.mimetype == 'application/json'
+    assert response.get_data(as_text=True).endswith('\n')
+    assert json.loads(response.get_data()) == rows.to_list()
+    assert list(json.loads(response.get_data())[0]) == ['id', 'name', 'price']
+
+def test_dumps_sqlite_rows_and_flask_types(app, cursor):
+    """
+    Test if sqlite3.Row objects, integer keys and dates are serialised like Flask's default provider does.
+    """
+    cursor.connection.row_factory = sqlite3.Row
+    row = cursor.connection.execute("SELECT * FROM t WHERE id = 1").fetchone()
+    value = {'row': row, 'by_id': {7: 'seven'}, 'when': datetime.date(2024, 1, 2)}
+    with app.app_context():
+        encoded = json.loads(app.json.dumps(value))
+    assert encoded == {'row': {'id': 1, 'name': 'a "quoted" name', 'price': 1.5}, 'by_id': {'7': 'seven'},
+                       'when': 'Tue, 02 Jan 2024 00:00:00 GMT'}
+    with pytest.raises(TypeError):
+        app.json.dumps({'value': object()})
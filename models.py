@@ -0,0 +1,107 @@
+"""
+Module that contains the compact row models returned by the listing functions of the databases.
+
+A model is a class with ``__slots__``, built directly from the row tuple by a ``row_factory``, so a listing holds
+one small object per row instead of a ``sqlite3.Row`` and a dictionary. The slots are declared by hand rather
+than with ``dataclass(slots=True)``, which needs Python 3.10 while the services run on 3.8.
+
+Models are read-only mappings of their column names to their values: ``item['name']``, ``dict(item)`` and
+comparisons with dictionaries work as they did with the dictionaries the functions used to return, and they are
+serialised to the same JSON objects (see the json_provider module).
+"""
+
+from collections.abc import Mapping
+
+class RowModel(Mapping):
+    """
+    The mapping interface shared by the row models. Subclasses declare the columns, in the order they are
+    selected, as their ``__slots__``.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        """
+        :param values: The values of the columns, in order.
+        :raises TypeError: If there is not one value per column.
+        """
+        if len(values) != len(self.__slots__):
+            raise TypeError(f"{type(self).__name__} takes {len(self.__slots__)} values, got {len(values)}")
+        for column, value in zip(self.__slots__, values):
+            setattr(self, column, value)
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """
+        Builds a model from a row, for use as a connection's or cursor's ``row_factory``.
+
+        The query must select the model's columns in order, as listed by column_list.
+
+        :param cursor: The cursor the row was read with.
+        :type cursor: sqlite3.Cursor
+        :param row: The row.
+        :type row: tuple
+        :return: The model.
+        :rtype: RowModel
+        """
+        return cls(*row)
+
+    @classmethod
+    def column_list(cls):
+        """
+        Lists the model's columns for a SELECT statement.
+
+        :return: The comma-separated column names.
+        :rtype: str
+        """
+        return ', '.join(cls.__slots__)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        values = ', '.join(f"{column}={getattr(self, column)!r}" for column in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+    def to_dict(self):
+        """
+        Converts the model to a dictionary.
+
+        :return: The columns and their values.
+        :rtype: dict
+        """
+        return {column: getattr(self, column) for column in self.__slots__}
+
+
+class Customer(RowModel):
+    """
+    A row of the 'customers' table, without the password hash, which never leaves the database module.
+    """
+
+    __slots__ = ('customer_id', 'full_name', 'username', 'age', 'address', 'gender', 'marital_status',
+                 'wallet_balance', 'version')
+
+
+class Item(RowModel):
+    """
+    A row of the 'inventory' table.
+    """
+
+    __slots__ = ('item_id', 'name', 'category', 'price_per_item', 'description', 'count_in_stock', 'version')
+
+
+class Sale(RowModel):
+    """
+    A sale as listed in a customer's order history, with the name and price of the item sold.
+    """
+
+    __slots__ = ('sale_id', 'sale_date', 'item_name', 'price_per_item')
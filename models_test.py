@@ -0,0 +1,64 @@
+import json
+import sqlite3
+import pytest
+from models import *
+
+
+@pytest.fixture
+def cursor():
+    """
+    Fixture providing a cursor on an in-memory inventory table with one item, building Item models.
+
+    :return: The cursor.
+    :rtype: sqlite3.Cursor
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE inventory (item_id INTEGER PRIMARY KEY, name TEXT, category TEXT, price_per_item REAL,
+                                description TEXT, count_in_stock INTEGER, version INTEGER)
+    ''')
+    conn.execute("INSERT INTO inventory VALUES (1, 'Mug', 'accessories', 8.0, 'A mug', 4, 1)")
+    conn.row_factory = Item.row_factory
+    yield conn.cursor()
+    conn.close()
+
+def test_row_factory(cursor):
+    """
+    Test if rows are built into models that behave like the dictionaries they replace.
+    """
+    item = cursor.execute(f"SELECT {Item.column_list()} FROM inventory").fetchone()
+    expected = {'item_id': 1, 'name': 'Mug', 'category': 'accessories', 'price_per_item': 8.0,
+                'description': 'A mug', 'count_in_stock': 4, 'version': 1}
+    assert isinstance(item, Item)
+    assert item['name'] == item.name == 'Mug'
+    assert item.get('colour') is None
+    with pytest.raises(KeyError):
+        item['colour']
+    assert 'price_per_item' in item and len(item) == 7
+    assert item == expected and dict(item) == expected and item.to_dict() == expected
+    assert list(item) == list(expected)
+
+def test_models_have_no_instance_dictionary():
+    """
+    Test if models keep their values in slots.
+    """
+    sale = Sale(1, '2024-01-02 10:00:00', 'Mug', 8.0)
+    assert not hasattr(sale, '__dict__')
+    with pytest.raises(AttributeError):
+        sale.colour = 'red'
+
+def test_models_serialised_as_objects(cursor):
+    """
+    Test if the services' JSON provider serialises models like the dictionaries they replace, with either encoder.
+    """
+    from flask import Flask
+    import json_provider
+    item = cursor.execute(f"SELECT {Item.column_list()} FROM inventory").fetchone()
+    app = Flask(__name__)
+    app.json = json_provider.FastJSONProvider(app)
+    encoded = app.json.dumps([item])
+    orjson, json_provider.orjson = json_provider.orjson, None
+    try:
+        assert json.loads(app.json.dumps([item])) == json.loads(encoded) == [item.to_dict()]
+    finally:
+        json_provider.orjson = orjson
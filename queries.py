@@ -0,0 +1,272 @@
+"""
+Module that contains the SQL statements run by the database modules of the three services.
+
+Every statement is defined once, here, as a constant string, and statements whose text depends on the request,
+such as the UPDATE of a subset of columns or a listing with optional filters, are generated once per shape: the
+UPDATE statements of every subset of the updatable columns are generated when the module is imported, and the
+other families are built on first use and memoised. A given operation therefore always runs the very same string,
+which sqlite3 finds in the statement cache of the pooled connection (see the connection_pool module) instead of
+parsing and preparing it again.
+
+Schema definitions (tables, indexes and triggers) are run once at start up and stay with the functions creating
+them.
+"""
+
+import functools
+import itertools
+
+from models import Customer, Item
+
+CUSTOMER_UPDATABLE_COLUMNS = ('full_name', 'username', 'password', 'age', 'address', 'gender', 'marital_status', 'wallet_balance')
+ITEM_UPDATABLE_COLUMNS = ('name', 'category', 'price_per_item', 'description', 'count_in_stock')
+
+# Customers.
+
+INSERT_CUSTOMER = '''
+    INSERT INTO customers (full_name, username, password, age, address, gender, marital_status)
+    VALUES (?, ?, ?, ?, ?, ?, ?)'''
+SELECT_ALL_CUSTOMERS = f"SELECT {Customer.column_list()} FROM customers ORDER BY customer_id"
+SELECT_CUSTOMER_BY_ID = f"SELECT {Customer.column_list()} FROM customers WHERE customer_id = ?"
+SELECT_CUSTOMER_BY_USERNAME = f"SELECT {Customer.column_list()} FROM customers WHERE username = ?"
+SELECT_CUSTOMER_CREDENTIALS = f"SELECT password, {Customer.column_list()} FROM customers WHERE username = ?"
+SELECT_CUSTOMER_USERNAME = "SELECT username FROM customers WHERE customer_id = ?"
+SELECT_CUSTOMER_VERSION = "SELECT version FROM customers WHERE customer_id = ?"
+SELECT_CUSTOMER_VERSION_BY_USERNAME = "SELECT customer_id, version FROM customers WHERE username = ?"
+DELETE_CUSTOMER = "DELETE FROM customers WHERE customer_id = ?"
+CHARGE_WALLET = "UPDATE customers SET wallet_balance = wallet_balance + ?, version = version + 1 WHERE customer_id = ?"
+DEDUCT_WALLET = "UPDATE customers SET wallet_balance = wallet_balance - ?, version = version + 1 WHERE customer_id = ?"
+REHASH_PASSWORD = "UPDATE customers SET password = ?, version = version + 1 WHERE customer_id = ? AND password = ?"
+
+# Customer shards and their directory (see the sharding module). The statements prefixed by 'directory.' run on a
+# shard's connection with the directory attached.
+
+INSERT_CUSTOMER_WITH_ID = '''
+    INSERT INTO customers (customer_id, full_name, username, password, age, address, gender, marital_status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+ATTACH_DIRECTORY = "ATTACH DATABASE ? AS directory"
+ALLOCATE_CUSTOMER_ID = "UPDATE customer_id_sequence SET last_id = last_id + 1 RETURNING last_id"
+SELECT_LAST_CUSTOMER_ID = "SELECT last_id FROM customer_id_sequence"
+RAISE_LAST_CUSTOMER_ID = '''
+    UPDATE customer_id_sequence
+    SET last_id = MAX(last_id, ?, (SELECT COALESCE(MAX(customer_id), 0) FROM customer_directory))'''
+SELECT_DIRECTORY_ID = "SELECT customer_id FROM customer_directory WHERE username = ?"
+INSERT_DIRECTORY_ENTRY = "INSERT INTO directory.customer_directory (customer_id, username) VALUES (?, ?)"
+RENAME_DIRECTORY_ENTRY = "UPDATE directory.customer_directory SET username = ? WHERE customer_id = ?"
+DELETE_DIRECTORY_ENTRY = "DELETE FROM directory.customer_directory WHERE customer_id = ?"
+CLEAR_DIRECTORY = "DELETE FROM customer_directory"
+FILL_DIRECTORY = "INSERT INTO customer_directory (customer_id, username) VALUES (?, ?)"
+ATTACH_SHARD = "ATTACH DATABASE ? AS shard"
+DETACH_SHARD = "DETACH DATABASE shard"
+COPY_CUSTOMERS_TO_SHARD = f'''
+    INSERT INTO shard.customers (password, {Customer.column_list()})
+    SELECT password, {Customer.column_list()} FROM main.customers WHERE shard_index(customer_id, ?) = ?'''
+DELETE_CUSTOMERS_OF_SHARD = "DELETE FROM main.customers WHERE shard_index(customer_id, ?) = ?"
+COUNT_CUSTOMERS = "SELECT COUNT(*) FROM customers"
+SELECT_CUSTOMER_USERNAMES = "SELECT customer_id, username FROM customers"
+SELECT_CUSTOMER_SEQUENCE = "SELECT seq FROM sqlite_sequence WHERE name = 'customers'"
+RAISE_CUSTOMER_SEQUENCE = "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'customers'"
+START_CUSTOMER_SEQUENCE = "INSERT INTO sqlite_sequence (name, seq) VALUES ('customers', ?)"
+
+# Inventory.
+
+INSERT_ITEM = '''
+    INSERT INTO inventory (name, category, price_per_item, description, count_in_stock)
+    VALUES (?, ?, ?, ?, ?)'''
+SELECT_ALL_ITEMS = f"SELECT {Item.column_list()} FROM inventory"
+SELECT_ITEM_BY_ID = f"SELECT {Item.column_list()} FROM inventory WHERE item_id = ?"
+SELECT_ITEM_BY_NAME = f"SELECT {Item.column_list()} FROM inventory WHERE name = ?"
+SELECT_ITEM_VERSION = "SELECT version FROM inventory WHERE item_id = ?"
+DEDUCT_STOCK = "UPDATE inventory SET count_in_stock = count_in_stock - ?, version = version + 1 WHERE item_id = ?"
+SEARCH_ITEMS = '''
+    SELECT inventory.*
+    FROM inventory_fts
+    JOIN inventory ON inventory.item_id = inventory_fts.rowid
+    WHERE inventory_fts MATCH ?
+    ORDER BY bm25(inventory_fts, 10.0, 1.0) LIMIT ? OFFSET ?'''
+SEARCH_ITEMS_IN_CATEGORY = '''
+    SELECT inventory.*
+    FROM inventory_fts
+    JOIN inventory ON inventory.item_id = inventory_fts.rowid
+    WHERE inventory_fts MATCH ? AND inventory.category = ?
+    ORDER BY bm25(inventory_fts, 10.0, 1.0) LIMIT ? OFFSET ?'''
+
+# Sales.
+
+INSERT_SALE = "INSERT INTO sales (customer_id, item_id, sale_date) VALUES (?, ?, ?)"
+SELECT_PARTITIONS = '''
+    SELECT month, path FROM sales_partitions
+    WHERE (? IS NULL OR month >= substr(?, 1, 7)) AND (? IS NULL OR month <= substr(?, 1, 7))
+    ORDER BY month DESC'''
+SELECT_PARTITION_PATHS_AFTER = "SELECT path FROM sales_partitions WHERE last_sale_id > ? ORDER BY first_sale_id"
+SELECT_PARTITION = "SELECT 1 FROM sales_partitions WHERE month = ?"
+SELECT_SALES_AFTER = "SELECT sale_id, customer_id, item_id, sale_date FROM sales WHERE sale_id > ? ORDER BY sale_id"
+SELECT_SALES_BATCH_AFTER = SELECT_SALES_AFTER + " LIMIT ?"
+SELECT_SALES_IN_RANGE = '''
+    SELECT sale_id, customer_id, item_id, sale_date FROM sales
+    WHERE (? IS NULL OR sale_date >= ?) AND (? IS NULL OR sale_date < date(?, '+1 day'))'''
+SELECT_CUSTOMER_SALES = "SELECT sale_id, sale_date, item_id FROM sales WHERE customer_id = ?"
+SELECT_OPEN_MONTHS_BEFORE = "SELECT DISTINCT substr(sale_date, 1, 7) FROM sales WHERE sale_date < ? ORDER BY 1"
+ATTACH_ARCHIVE = "ATTACH DATABASE ? AS archive"
+DETACH_ARCHIVE = "DETACH DATABASE archive"
+COPY_SALES_TO_ARCHIVE = '''
+    INSERT INTO archive.sales (sale_id, customer_id, item_id, sale_date)
+    SELECT sale_id, customer_id, item_id, sale_date FROM main.sales
+    WHERE sale_date >= ? AND sale_date < ?'''
+SELECT_ARCHIVE_BOUNDS = "SELECT COUNT(*), MIN(sale_id), MAX(sale_id) FROM archive.sales"
+DELETE_SALES_BETWEEN = "DELETE FROM main.sales WHERE sale_date >= ? AND sale_date < ?"
+INSERT_PARTITION = '''
+    INSERT INTO sales_partitions (month, path, sales, first_sale_id, last_sale_id, archived_at)
+    VALUES (?, ?, ?, ?, ?, datetime('now'))'''
+
+def _update_statements(table, key_column, updatable_columns):
+    """
+    Generates the UPDATE statements of a table for every non-empty subset of its updatable columns, with and
+    without a check of the row's version.
+
+    :param table: The name of the table.
+    :type table: str
+    :param key_column: The primary key of the table.
+    :type key_column: str
+    :param updatable_columns: The columns updates can set, in the order their values are bound.
+    :type updatable_columns: tuple
+    :return: A dictionary mapping (columns, check_version) to the statement, where columns is a subset of
+             updatable_columns in their order.
+    :rtype: dict
+    """
+    statements = {}
+    for count in range(1, len(updatable_columns) + 1):
+        for columns in itertools.combinations(updatable_columns, count):
+            assignments = ''.join(f"{column} = ?, " for column in columns)
+            statement = f"UPDATE {table} SET {assignments}version = version + 1 WHERE {key_column} = ?"
+            statements[columns, False] = statement
+            statements[columns, True] = statement + " AND version = ?"
+    return statements
+
+UPDATE_CUSTOMER = _update_statements('customers', 'customer_id', CUSTOMER_UPDATABLE_COLUMNS)
+UPDATE_ITEM = _update_statements('inventory', 'item_id', ITEM_UPDATABLE_COLUMNS)
+
+@functools.lru_cache(maxsize=None)
+def select_customers_in(column, count):
+    """
+    Builds the statement selecting the customers whose value in a column is one of count values.
+
+    :param column: The column to match, either 'customer_id' or 'username'.
+    :type column: str
+    :param count: The number of values, at most the size of a lookup chunk.
+    :type count: int
+    :return: The SQL statement.
+    :rtype: str
+    """
+    return f"SELECT {Customer.column_list()} FROM customers WHERE {column} IN ({', '.join('?' * count)})"
+
+@functools.lru_cache(maxsize=None)
+def select_wallets_in(count):
+    """
+    Builds the statement selecting the ID, username and wallet balance of the customers whose ID is one of count
+    values.
+
+    :param count: The number of IDs, at most the size of a lookup chunk.
+    :type count: int
+    :return: The SQL statement.
+    :rtype: str
+    """
+    return f"SELECT customer_id, username, wallet_balance FROM customers WHERE customer_id IN ({', '.join('?' * count)})"
+
+@functools.lru_cache(maxsize=None)
+def select_directory_ids_in(count):
+    """
+    Builds the statement selecting the username and customer ID of the directory entries whose username is one of
+    count values.
+
+    :param count: The number of usernames, at most the size of a lookup chunk.
+    :type count: int
+    :return: The SQL statement.
+    :rtype: str
+    """
+    return f"SELECT username, customer_id FROM customer_directory WHERE username IN ({', '.join('?' * count)})"
+
+@functools.lru_cache(maxsize=None)
+def select_items_in(count):
+    """
+    Builds the statement selecting the items whose ID is one of count values.
+
+    :param count: The number of IDs, at most the size of a lookup chunk.
+    :type count: int
+    :return: The SQL statement.
+    :rtype: str
+    """
+    return f"SELECT {Item.column_list()} FROM inventory WHERE item_id IN ({', '.join('?' * count)})"
+
+@functools.lru_cache(maxsize=None)
+def list_items(sort_column, category=False, min_price=False, max_price=False, in_stock=False, after=False):
+    """
+    Builds the statement listing a page of items, for a sort column and the filters in use.
+
+    The parameters are bound in the order category, minimum price, maximum price, the position after which the
+    page starts (the sort value, unless sorting by item_id, followed by the item_id) and the page size.
+
+    :param sort_column: The column to sort by, ties broken by item_id.
+    :type sort_column: str
+    :param category: Whether the items are filtered by category.
+    :type category: bool
+    :param min_price: Whether the items are filtered by a minimum price.
+    :type min_price: bool
+    :param max_price: Whether the items are filtered by a maximum price.
+    :type max_price: bool
+    :param in_stock: Whether only items in stock are listed.
+    :type in_stock: bool
+    :param after: Whether the page starts after a position.
+    :type after: bool
+    :return: The SQL statement.
+    :rtype: str
+    """
+    conditions = []
+    if category:
+        conditions.append("category = ?")
+    if min_price:
+        conditions.append("price_per_item >= ?")
+    if max_price:
+        conditions.append("price_per_item <= ?")
+    if in_stock:
+        conditions.append("count_in_stock > 0")
+    if after:
+        conditions.append("item_id > ?" if sort_column == 'item_id' else f"({sort_column}, item_id) > (?, ?)")
+
+    sql = f"SELECT {Item.column_list()} FROM inventory"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if sort_column == 'item_id':
+        sql += " ORDER BY item_id"
+    else:
+        sql += f" ORDER BY {sort_column}, item_id"
+    return sql + " LIMIT ?"
+
+@functools.lru_cache(maxsize=None)
+def customer_sales_page(date_from=False, date_to=False, before=False):
+    """
+    Builds the statement reading a page of a customer's sales, newest first, for the filters in use.
+
+    The parameters are bound in the order customer_id, first date, last date, the sale_date and sale_id the page
+    starts before, and the page size.
+
+    :param date_from: Whether the sales are filtered by a first date.
+    :type date_from: bool
+    :param date_to: Whether the sales are filtered by a last date.
+    :type date_to: bool
+    :param before: Whether the page starts before a position.
+    :type before: bool
+    :return: The SQL statement.
+    :rtype: str
+    """
+    conditions = ["customer_id = ?"]
+    if date_from:
+        conditions.append("sale_date >= ?")
+    if date_to:
+        conditions.append("sale_date < date(?, '+1 day')")
+    if before:
+        conditions.append("(sale_date, sale_id) < (?, ?)")
+    return f'''
+        SELECT sale_id, sale_date, item_id FROM sales
+        WHERE {" AND ".join(conditions)}
+        ORDER BY sale_date DESC, sale_id DESC
+        LIMIT ?'''
@@ -0,0 +1,40 @@
+import sqlite3
+from queries import *
+
+
+def test_update_statements_cover_every_subset():
+    """
+    Test if an UPDATE statement is generated for every subset of the updatable columns, with and without a
+    version check.
+    """
+    assert len(UPDATE_CUSTOMER) == 2 * (2 ** len(CUSTOMER_UPDATABLE_COLUMNS) - 1)
+    assert len(UPDATE_ITEM) == 2 * (2 ** len(ITEM_UPDATABLE_COLUMNS) - 1)
+    assert UPDATE_ITEM[('name', 'count_in_stock'), False] == \
+        "UPDATE inventory SET name = ?, count_in_stock = ?, version = version + 1 WHERE item_id = ?"
+    assert UPDATE_CUSTOMER[('age',), True] == \
+        "UPDATE customers SET age = ?, version = version + 1 WHERE customer_id = ? AND version = ?"
+
+def test_generated_statements_are_reused():
+    """
+    Test if statements built on demand are built once per shape, so the same string is run every time.
+    """
+    assert select_items_in(3) is select_items_in(3)
+    assert select_items_in(3).count('?') == 3
+    assert list_items('price_per_item', category=True, after=True) is list_items('price_per_item', category=True, after=True)
+    assert customer_sales_page(date_from=True) is customer_sales_page(date_from=True)
+
+def test_list_items_binds_parameters_in_order():
+    """
+    Test if a listing statement takes its parameters in the documented order.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE inventory (item_id INTEGER PRIMARY KEY, name TEXT, category TEXT, price_per_item REAL,
+                                description TEXT, count_in_stock INTEGER, version INTEGER)
+    ''')
+    conn.executemany("INSERT INTO inventory VALUES (?, ?, 'food', ?, '', 1, 1)",
+                     [(1, 'Apple', 1.0), (2, 'Bread', 2.0), (3, 'Cheese', 3.0), (4, 'Dates', 2.0)])
+    sql = list_items('price_per_item', category=True, min_price=True, max_price=True, after=True)
+    rows = conn.execute(sql, ('food', 1.5, 3.0, 2.0, 2, 10)).fetchall()
+    assert [row[0] for row in rows] == [4, 3]
+    conn.close()
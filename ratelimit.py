@@ -0,0 +1,323 @@
+"""
+Module that contains the rate limiting and admission control applied to the three services.
+
+Rate limiting is off unless ``RATE_LIMIT_PER_SECOND`` is set. Every client, identified by its validated identity
+or else its IP address, then has a token bucket that refills at that many tokens per second up to
+RATE_LIMIT_BURST. Each request takes one token, or more for endpoints that return whole tables, and is answered
+with ``429 Too Many Requests`` when the bucket is empty. Buckets are kept in memory by default; when several
+worker processes serve the same service, setting ``RATE_LIMIT_DB`` to an SQLite file makes them share the
+buckets.
+
+A client's identity is the customer of its access token (see the auth module, whose ``init_auth`` must be called
+first), or its ``X-API-Key`` header when the key is one of the comma-separated ``RATE_LIMIT_API_KEYS``. Headers
+the service cannot check are ignored, so a client cannot escape its bucket, or push others' buckets out of
+memory, by sending a new value with every request. Requests made by another service with its own token, on
+behalf of all of that service's clients, are not rate limited.
+
+Behind reverse proxies, every anonymous client would share the proxy's address and so its bucket. Setting
+``RATE_LIMIT_TRUSTED_PROXIES`` to the number of proxies in front of the service makes it read the client's
+address from the ``X-Forwarded-For`` header they add, with werkzeug's ProxyFix. It must not be set when clients
+can reach the service directly, since they could then pick their address.
+
+Independently of any client, at most MAX_IN_FLIGHT requests are processed at once; further requests are answered
+at once with ``503 Service Unavailable`` instead of queueing, so the latency of admitted requests stays bounded
+under overload. Both answers carry a ``Retry-After`` header.
+"""
+
+import hmac
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+RATE_LIMIT_PER_SECOND = 0.0
+RATE_LIMIT_BURST = 100.0
+MAX_IN_FLIGHT = 64
+MEMORY_MAX_CLIENTS = 10000
+OVERLOAD_RETRY_AFTER = 1
+
+def refill(tokens, updated, now, rate, burst):
+    """
+    Computes the tokens of a bucket after refilling it.
+
+    :param tokens: The tokens the bucket held at the time of its last update.
+    :type tokens: float
+    :param updated: The time of the bucket's last update, in seconds.
+    :type updated: float
+    :param now: The current time, in seconds.
+    :type now: float
+    :param rate: The tokens added per second.
+    :type rate: float
+    :param burst: The capacity of the bucket.
+    :type burst: float
+    :return: The tokens the bucket holds now.
+    :rtype: float
+    """
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+def take(tokens, cost, rate):
+    """
+    Takes tokens out of a bucket.
+
+    :param tokens: The tokens the bucket holds.
+    :type tokens: float
+    :param cost: The tokens the request needs.
+    :type cost: float
+    :param rate: The tokens added per second.
+    :type rate: float
+    :return: The tokens left in the bucket, and 0 if the request is allowed or else the number of seconds until
+             enough tokens are available.
+    :rtype: tuple
+    """
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in the memory of one process.
+
+    Only the MEMORY_MAX_CLIENTS most recently seen clients are kept; a forgotten client starts again with a
+    full bucket.
+    """
+
+    def __init__(self, max_clients=MEMORY_MAX_CLIENTS):
+        """
+        :param max_clients: The maximum number of buckets kept.
+        :type max_clients: int
+        """
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """
+        Takes tokens out of a client's bucket.
+
+        :param key: The client.
+        :type key: str
+        :param cost: The tokens the request needs.
+        :type cost: float
+        :param rate: The tokens added per second.
+        :type rate: float
+        :param burst: The capacity of the bucket.
+        :type burst: float
+        :return: 0 if the request is allowed, or else the number of seconds until enough tokens are available.
+        :rtype: float
+        """
+        now = time.monotonic()
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets.pop(key)
+                tokens = refill(tokens, updated, now, rate, burst)
+            else:
+                tokens = burst
+                if len(self.buckets) >= self.max_clients:
+                    self.buckets.popitem(last=False)
+            tokens, wait = take(tokens, cost, rate)
+            self.buckets[key] = (tokens, now)
+        return wait
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets kept in an SQLite database, shared by every process using the same file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the database file.
+        :type path: str
+        """
+        self.path = path
+        self.local = threading.local()
+
+    def connect_to_db(self):
+        """
+        Returns this thread's connection to the database, opening it and creating the 'rate_limit_buckets'
+        table on first use.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                ) WITHOUT ROWID;
+            ''')
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, cost, rate, burst):
+        """
+        Takes tokens out of a client's bucket, in a write transaction so that processes do not race.
+
+        :param key: The client.
+        :type key: str
+        :param cost: The tokens the request needs.
+        :type cost: float
+        :param rate: The tokens added per second.
+        :type rate: float
+        :param burst: The capacity of the bucket.
+        :type burst: float
+        :return: 0 if the request is allowed, or else the number of seconds until enough tokens are available.
+        :rtype: float
+        """
+        conn = self.connect_to_db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else refill(row[0], row[1], now, rate, burst)
+            tokens, wait = take(tokens, cost, rate)
+            conn.execute("INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def prune(self, idle_seconds):
+        """
+        Deletes the buckets of clients not seen for idle_seconds, which would be full again by now anyway when
+        idle_seconds is at least RATE_LIMIT_BURST / RATE_LIMIT_PER_SECOND.
+
+        :param idle_seconds: The idle time after which a bucket is deleted.
+        :type idle_seconds: float
+        :return: The number of buckets deleted.
+        :rtype: int
+        """
+        cur = self.connect_to_db().execute("DELETE FROM rate_limit_buckets WHERE updated < ?",
+                                           (time.time() - idle_seconds,))
+        return cur.rowcount
+
+
+class ConcurrencyLimiter:
+    """
+    Admits at most a fixed number of requests at once, rejecting the others rather than queueing them.
+    """
+
+    def __init__(self, capacity=MAX_IN_FLIGHT):
+        """
+        :param capacity: The maximum number of requests processed at once.
+        :type capacity: int
+        """
+        self.capacity = capacity
+        self.slots = threading.BoundedSemaphore(capacity)
+
+    def acquire(self):
+        """
+        Admits a request if there is spare capacity.
+
+        :return: True if the request was admitted and must call release when done.
+        :rtype: bool
+        """
+        return self.slots.acquire(blocking=False)
+
+    def release(self):
+        """
+        Marks an admitted request as done.
+        """
+        self.slots.release()
+
+
+def client_key(api_keys=()):
+    """
+    Identifies the client of the current request by the customer of its access token, or else its API key if the
+    key is known, or else its IP address.
+
+    :param api_keys: The API keys clients may identify themselves with.
+    :type api_keys: tuple
+    :return: The key of the client's bucket, or None for a service calling with its own token, which is not
+             rate limited.
+    :rtype: str or None
+    """
+    claims = g.get('auth')
+    if claims is not None:
+        if 'service' in claims:
+            return None
+        return f"customer:{claims['sub']}"
+    api_key = request.headers.get('X-API-Key')
+    if api_key and any(hmac.compare_digest(api_key, known) for known in api_keys):
+        return 'key:' + api_key
+    return 'ip:' + (request.remote_addr or 'unknown')
+
+def init_rate_limit(app, costs=None, unlimited_endpoints=()):
+    """
+    Makes an application rate limit its clients and shed load above its concurrency limit.
+
+    The limits are read from the application's settings ``RATE_LIMIT_PER_SECOND``, ``RATE_LIMIT_BURST``,
+    ``MAX_IN_FLIGHT``, ``RATE_LIMIT_DB``, ``RATE_LIMIT_API_KEYS`` and ``RATE_LIMIT_TRUSTED_PROXIES``, which default
+    to the environment variables of the same names and then to this module's constants. A rate of 0, the default,
+    disables rate limiting and a capacity of 0 disables the concurrency limit.
+
+    :param app: The application.
+    :type app: flask.Flask
+    :param costs: The tokens taken by requests to particular endpoints, by endpoint name; other endpoints
+                  take one token.
+    :type costs: dict or None
+    :param unlimited_endpoints: The names of endpoints not counted against the concurrency limit, such as
+                                long-lived streams.
+    :type unlimited_endpoints: tuple
+    """
+    app.config.setdefault('RATE_LIMIT_PER_SECOND',
+                          float(os.environ.get('RATE_LIMIT_PER_SECOND', RATE_LIMIT_PER_SECOND)))
+    app.config.setdefault('RATE_LIMIT_BURST', float(os.environ.get('RATE_LIMIT_BURST', RATE_LIMIT_BURST)))
+    app.config.setdefault('MAX_IN_FLIGHT', int(os.environ.get('MAX_IN_FLIGHT', MAX_IN_FLIGHT)))
+    app.config.setdefault('RATE_LIMIT_DB', os.environ.get('RATE_LIMIT_DB'))
+    app.config.setdefault('RATE_LIMIT_API_KEYS', tuple(key.strip() for key in
+                                                      os.environ.get('RATE_LIMIT_API_KEYS', '').split(',')
+                                                      if key.strip()))
+    app.config.setdefault('RATE_LIMIT_TRUSTED_PROXIES', int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0)))
+    if app.config['RATE_LIMIT_TRUSTED_PROXIES'] > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['RATE_LIMIT_TRUSTED_PROXIES'])
+    costs = costs or {}
+    unlimited_endpoints = set(unlimited_endpoints)
+    state = {}
+
+    def bucket_store():
+        if 'store' not in state:
+            path = app.config['RATE_LIMIT_DB']
+            state['store'] = SQLiteBucketStore(path) if path else MemoryBucketStore()
+        return state['store']
+
+    def limiter():
+        if 'limiter' not in state:
+            state['limiter'] = ConcurrencyLimiter(app.config['MAX_IN_FLIGHT'])
+        return state['limiter']
+
+    @app.before_request
+    def admit_request():
+        g.admitted = False
+        if request.method == 'OPTIONS':
+            return None
+        rate = app.config['RATE_LIMIT_PER_SECOND']
+        if rate > 0:
+            cost = costs.get(request.endpoint, 1)
+            key = client_key(app.config['RATE_LIMIT_API_KEYS'])
+            wait = 0 if key is None else bucket_store().take(key, cost, rate, max(app.config['RATE_LIMIT_BURST'], cost))
+            if wait > 0:
+                return jsonify({"error": "Too many requests"}), 429, {'Retry-After': str(math.ceil(wait))}
+        if app.config['MAX_IN_FLIGHT'] > 0 and request.endpoint not in unlimited_endpoints:
+            if not limiter().acquire():
+                return jsonify({"error": "Service overloaded"}), 503, {'Retry-After': str(OVERLOAD_RETRY_AFTER)}
+            g.admitted = True
+        return None
+
+    @app.teardown_request
+    def release_request(exc):
+        if g.pop('admitted', False):
+            limiter().release()
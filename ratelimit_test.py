@@ -0,0 +1,139 @@
+import threading
+import pytest
+from flask import Flask
+from auth import init_auth, issue_token, issue_service_token
+from ratelimit import *
+
+
+def make_app(**settings):
+    """
+    Builds a small application with rate limiting and admission control.
+
+    :return: The application.
+    :rtype: flask.Flask
+    """
+    app = Flask(__name__)
+    app.config.update(settings)
+    app.config.setdefault('RATE_LIMIT_DB', None)
+    release = threading.Event()
+    app.release = release
+
+    @app.route('/cheap')
+    def cheap():
+        return 'ok'
+
+    @app.route('/expensive')
+    def expensive():
+        return 'ok'
+
+    @app.route('/slow')
+    def slow():
+        release.wait(5)
+        return 'ok'
+
+    init_auth(app)
+    init_rate_limit(app, costs={'expensive': 5})
+    return app
+
+def test_refill_and_take():
+    """
+    Test if a bucket refills at the given rate up to its capacity and tells how long to wait when empty.
+    """
+    assert refill(0, 10.0, 11.0, 2, 5) == 2
+    assert refill(4, 10.0, 20.0, 2, 5) == 5
+    assert take(3, 1, 2) == (2, 0.0)
+    assert take(0.5, 1, 2) == (0.5, 0.25)
+
+def test_memory_bucket_store():
+    """
+    Test if each client has its own bucket.
+    """
+    store = MemoryBucketStore()
+    assert [store.take('a', 1, 0.001, 3) for _ in range(4)][-1] > 0
+    assert store.take('b', 1, 0.001, 3) == 0
+
+def test_sqlite_bucket_store_is_shared(tmp_path):
+    """
+    Test if two stores on the same file share the buckets.
+    """
+    path = str(tmp_path / 'buckets.db')
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take('a', 2, 0.001, 3) == 0
+    assert second.take('a', 2, 0.001, 3) > 0
+    assert second.take('b', 2, 0.001, 3) == 0
+    assert first.prune(-1) == 2
+
+def test_rate_limit_middleware():
+    """
+    Test if clients are limited separately, expensive endpoints take more tokens and 429 carries Retry-After.
+    """
+    app = make_app(RATE_LIMIT_PER_SECOND=0.01, RATE_LIMIT_BURST=6, RATE_LIMIT_API_KEYS=('known',))
+    client = app.test_client()
+    assert client.get('/expensive').status_code == 200
+    assert client.get('/cheap').status_code == 200
+    response = client.get('/cheap')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert client.get('/cheap', headers={'X-API-Key': 'known'}).status_code == 200
+    token = issue_token({'customer_id': 7, 'username': 'jane'})
+    assert client.get('/cheap', headers={'Authorization': f'Bearer {token}'}).status_code == 200
+
+def test_rate_limit_ignores_unchecked_headers():
+    """
+    Test if a client cannot escape its bucket with an unknown API key or an invalid token.
+    """
+    app = make_app(RATE_LIMIT_PER_SECOND=0.01, RATE_LIMIT_BURST=1, RATE_LIMIT_API_KEYS=('known',))
+    client = app.test_client()
+    assert client.get('/cheap').status_code == 200
+    assert client.get('/cheap', headers={'X-API-Key': 'made-up'}).status_code == 429
+    assert client.get('/cheap', headers={'Authorization': 'Bearer forged'}).status_code == 429
+
+def test_rate_limit_exempts_services():
+    """
+    Test if a service calling with its own token is not rate limited, and if the limit is off by default.
+    """
+    app = make_app(RATE_LIMIT_PER_SECOND=0.01, RATE_LIMIT_BURST=1)
+    client = app.test_client()
+    assert client.get('/cheap').status_code == 200
+    assert client.get('/cheap').status_code == 429
+    headers = {'Authorization': f'Bearer {issue_service_token("sales")}'}
+    assert [client.get('/cheap', headers=headers).status_code for _ in range(5)] == [200] * 5
+
+    client = make_app().test_client()
+    assert [client.get('/cheap').status_code for _ in range(200)] == [200] * 200
+
+def test_rate_limit_behind_trusted_proxies():
+    """
+    Test if clients behind a trusted proxy are told apart by the address the proxy forwards.
+    """
+    app = make_app(RATE_LIMIT_PER_SECOND=0.01, RATE_LIMIT_BURST=1, RATE_LIMIT_TRUSTED_PROXIES=1)
+    client = app.test_client()
+    assert client.get('/cheap', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 200
+    assert client.get('/cheap', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 429
+    assert client.get('/cheap', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 200
+
+    client = make_app(RATE_LIMIT_PER_SECOND=0.01, RATE_LIMIT_BURST=1).test_client()
+    assert client.get('/cheap', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 200
+    assert client.get('/cheap', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 429
+
+def test_concurrency_limit_middleware():
+    """
+    Test if requests beyond the concurrency limit are shed with 503 and the slot is released afterwards.
+    """
+    app = make_app(RATE_LIMIT_PER_SECOND=0, MAX_IN_FLIGHT=1)
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(app.test_client().get('/slow').status_code))
+    thread.start()
+    try:
+        for _ in range(100):
+            response = app.test_client().get('/cheap')
+            if response.status_code == 503:
+                break
+            threading.Event().wait(0.01)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        app.release.set()
+        thread.join()
+    assert responses == [200]
+    assert app.test_client().get('/cheap').status_code == 200
@@ -0,0 +1,273 @@
+"""
+Module that keeps read-only replicas of the customers and inventory databases and routes reads to them.
+
+A replica is a copy of a primary database file, taken with SQLite's online backup API, which copies a consistent
+snapshot while the primary stays available to readers and writers. The copy is written to a temporary file and
+renamed over the replica, so readers always open a complete snapshot; the connection pool notices the new file and
+drops its connections to the old one. The modification time of the replica is set to the time its snapshot was
+taken, which tells every process how stale the replica is without any other bookkeeping.
+
+A ReplicaRouter sends reads to the replica of a database while the replica is at most MAX_STALENESS seconds old,
+and to the primary otherwise, for instance before the first snapshot or when refreshing falls behind. Writes, and
+the reads that must see them, always go to the primary.
+
+The replica is refreshed every REFRESH_INTERVAL seconds by a single worker of each machine: every process starts a
+background thread, but only the one holding the lock on the replica's refresher file (on platforms with ``fcntl``)
+refreshes, and the others wait to take over if it exits. A refresh only copies the primary when it was written
+since the last snapshot, and otherwise just dates the replica anew. The copy is taken BACKUP_PAGES pages at a time
+with a pause in between, so writers to the primary are never blocked for the whole copy.
+
+Replicas are enabled by setting ``CUSTOMERS_REPLICA_DB`` and ``INVENTORY_REPLICA_DB`` to the paths of the replica
+files. Each customer shard has its own replica, named after the given path as the shard is after shard 0.
+``REPLICA_MAX_STALENESS`` and ``REPLICA_REFRESH_INTERVAL`` override the defaults.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from connection_pool import connect
+from sharding import shard_path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAX_STALENESS = 15.0
+REFRESH_INTERVAL = 5.0
+BACKUP_PAGES = 1024
+BACKUP_SLEEP = 0.005
+# Margin for file systems that record modification times coarsely.
+MTIME_GRANULARITY = 1.0
+
+def refresh_replica(primary_path, replica_path, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP):
+    """
+    Replaces a replica with a new snapshot of its primary database.
+
+    The primary is copied a number of pages at a time, and its read lock is released for a pause between two
+    steps. A write to the primary during the copy makes SQLite start it again.
+
+    :param primary_path: The path of the primary database file.
+    :type primary_path: str
+    :param replica_path: The path of the replica file.
+    :type replica_path: str
+    :param pages: The number of pages copied per step.
+    :type pages: int
+    :param sleep: The number of seconds to pause between two steps.
+    :type sleep: float
+    :return: The time the snapshot was taken.
+    :rtype: float
+    """
+    temporary_path = f"{replica_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    taken_at = time.time()
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(temporary_path)
+    try:
+        source.backup(target, pages=pages, sleep=sleep)
+    finally:
+        target.close()
+        source.close()
+    try:
+        os.utime(temporary_path, (taken_at, taken_at))
+        os.replace(temporary_path, replica_path)
+    except OSError:
+        os.remove(temporary_path)
+        raise
+    return taken_at
+
+def last_write_time(path):
+    """
+    Finds when a database was last written, from the modification times of its file and its write-ahead log.
+
+    :param path: The path of the database file.
+    :type path: str
+    :return: The time, as a UNIX timestamp.
+    :rtype: float
+    """
+    times = [os.stat(path).st_mtime]
+    try:
+        times.append(os.stat(f"{path}-wal").st_mtime)
+    except FileNotFoundError:
+        pass
+    return max(times)
+
+
+class ReplicaRouter:
+    """
+    Routes the reads of a database to its replica while the replica is fresh enough, and keeps it refreshed.
+    """
+
+    def __init__(self, primary_path, replica_path, max_staleness=MAX_STALENESS, refresh_interval=REFRESH_INTERVAL):
+        """
+        :param primary_path: The path of the primary database file.
+        :type primary_path: str
+        :param replica_path: The path of the replica file.
+        :type replica_path: str
+        :param max_staleness: The age in seconds above which the replica is not read.
+        :type max_staleness: float
+        :param refresh_interval: The number of seconds between two snapshots.
+        :type refresh_interval: float
+        """
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.max_staleness = max_staleness
+        self.refresh_interval = refresh_interval
+        self.refresher_pid = None
+        self.lock = threading.Lock()
+
+    def snapshot_time(self):
+        """
+        Reads the time the replica's snapshot was taken.
+
+        :return: The time, or None if there is no replica yet.
+        :rtype: float or None
+        """
+        try:
+            return os.stat(self.replica_path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def staleness(self):
+        """
+        Computes how far the replica lags behind the primary, at most.
+
+        :return: The age of the replica in seconds, or None if there is no replica yet.
+        :rtype: float or None
+        """
+        taken_at = self.snapshot_time()
+        return None if taken_at is None else max(0.0, time.time() - taken_at)
+
+    def refresh(self, force=False):
+        """
+        Brings the replica up to date, unless it is younger than the refresh interval or another process of the
+        machine is refreshing it. When the primary was not written since the replica's snapshot, the replica is
+        only dated anew rather than copied again.
+
+        :param force: Whether to take a snapshot regardless of the replica's age and of the primary's writes.
+        :type force: bool
+        :return: True if a snapshot was taken.
+        :rtype: bool
+        """
+        with open(f"{self.replica_path}.lock", 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return False
+            taken_at = self.snapshot_time()
+            # Dated before the primary is checked, so a write made meanwhile is not taken to be in the replica.
+            checked_at = time.time()
+            if not force and taken_at is not None:
+                if checked_at - taken_at < self.refresh_interval:
+                    return False
+                if last_write_time(self.primary_path) + MTIME_GRANULARITY < taken_at:
+                    os.utime(self.replica_path, (checked_at, checked_at))
+                    return False
+            refresh_replica(self.primary_path, self.replica_path)
+            return True
+
+    def _refresh_forever(self):
+        """
+        Refreshes the replica every refresh interval for the life of the process, once it is the machine's
+        refresher.
+        """
+        with open(f"{self.replica_path}.refresher", 'a') as refresher_file:
+            while fcntl is not None:
+                try:
+                    fcntl.flock(refresher_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    time.sleep(self.refresh_interval)
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Error refreshing replica {self.replica_path}: {e}")
+                time.sleep(self.refresh_interval)
+
+    def start(self):
+        """
+        Starts refreshing the replica on a background thread of this process, unless it already is.
+        """
+        pid = os.getpid()
+        if self.refresher_pid == pid:
+            return
+        with self.lock:
+            if self.refresher_pid == pid:
+                return
+            # A thread started before a fork does not run in the child, which starts its own; it waits while
+            # another process is the machine's refresher.
+            threading.Thread(target=self._refresh_forever, name='replica-refresh', daemon=True).start()
+            self.refresher_pid = pid
+
+    def connect_for_read(self):
+        """
+        Opens a connection for reads that tolerate the staleness bound: to the replica, read-only, if it is fresh
+        enough, and to the primary otherwise.
+
+        The connection's ``snapshot_time`` is the time of the replica's snapshot, or None for the primary; values
+        read from a replica must not be cached as if they had been read now.
+
+        :return: The connection, which returns to its pool when closed.
+        :rtype: connection_pool.PooledConnection
+        """
+        self.start()
+        taken_at = self.snapshot_time()
+        if taken_at is None or time.time() - taken_at > self.max_staleness:
+            return connect(self.primary_path)
+        conn = connect(self.replica_path, read_only=True)
+        conn.snapshot_time = taken_at
+        return conn
+
+    def status(self):
+        """
+        Describes the replica.
+
+        :return: The replica's path, its staleness in seconds (None if there is no replica yet) and whether reads
+                 are routed to it.
+        :rtype: dict
+        """
+        staleness = self.staleness()
+        return {"replica": self.replica_path, "staleness": staleness,
+                "serving_reads": staleness is not None and staleness <= self.max_staleness}
+
+
+def open_replica_router(primary_path, variable, shard=0):
+    """
+    Creates the router of a database whose replica path is given by an environment variable.
+
+    The staleness bound and refresh interval are read from ``REPLICA_MAX_STALENESS`` and
+    ``REPLICA_REFRESH_INTERVAL``. The refresher thread is started by the first read.
+
+    :param primary_path: The path of the primary database file.
+    :type primary_path: str
+    :param variable: The name of the environment variable.
+    :type variable: str
+    :param shard: The index of the shard the database is, whose replica is named accordingly.
+    :type shard: int
+    :return: The router, or None if the variable is not set.
+    :rtype: ReplicaRouter or None
+    """
+    replica_path = os.environ.get(variable)
+    if not replica_path:
+        return None
+    return ReplicaRouter(primary_path, shard_path(replica_path, shard),
+                         max_staleness=float(os.environ.get('REPLICA_MAX_STALENESS', MAX_STALENESS)),
+                         refresh_interval=float(os.environ.get('REPLICA_REFRESH_INTERVAL', REFRESH_INTERVAL)))
+
+def open_replica_routers(primary_paths, variable):
+    """
+    Creates the routers of the shards of a database, see open_replica_router.
+
+    :param primary_paths: The paths of the shards, in order.
+    :type primary_paths: list
+    :param variable: The name of the environment variable giving the path of shard 0's replica.
+    :type variable: str
+    :return: One router per shard, or None if the variable is not set.
+    :rtype: list or None
+    """
+    if not os.environ.get(variable):
+        return None
+    return [open_replica_router(path, variable, shard) for shard, path in enumerate(primary_paths)]
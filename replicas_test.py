@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import time
+import pytest
+import database2
+from replicas import *
+
+
+@pytest.fixture
+def primary(tmp_path):
+    """
+    Fixture providing the path of a primary database with one table.
+
+    :return: The path of the database file.
+    :rtype: str
+    """
+    path = str(tmp_path / 'primary.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+    conn.close()
+    return path
+
+def _router(primary, tmp_path, **kwargs):
+    """
+    Creates a router whose replica is only refreshed by the test.
+    """
+    router = ReplicaRouter(primary, str(tmp_path / 'replica.db'), **kwargs)
+    router.refresher_pid = os.getpid()
+    return router
+
+def _insert(path, value):
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO t VALUES (?)", (value,))
+    conn.commit()
+    conn.close()
+
+def test_refresh_replica(primary, tmp_path):
+    """
+    Test if a refresh copies the primary and dates the replica with the time of the snapshot.
+    """
+    replica = str(tmp_path / 'replica.db')
+    before = time.time()
+    taken_at = refresh_replica(primary, replica)
+    assert before - 1 <= os.stat(replica).st_mtime <= time.time()
+    assert abs(os.stat(replica).st_mtime - taken_at) < 0.01
+    conn = sqlite3.connect(replica)
+    assert conn.execute("SELECT x FROM t").fetchall() == [(1,)]
+    conn.close()
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+def test_reads_go_to_fresh_replica(primary, tmp_path):
+    """
+    Test if reads see the replica's snapshot, read-only, while it is within the staleness bound.
+    """
+    router = _router(primary, tmp_path, max_staleness=60)
+    assert router.refresh()
+    _insert(primary, 2)
+
+    conn = router.connect_for_read()
+    try:
+        assert conn.execute("SELECT x FROM t").fetchall() == [(1,)]
+        assert conn.snapshot_time == router.snapshot_time()
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO t VALUES (3)")
+    finally:
+        conn.close()
+
+    # Too young to refresh, unless forced.
+    assert not router.refresh()
+    assert router.refresh(force=True)
+    conn = router.connect_for_read()
+    try:
+        assert conn.execute("SELECT x FROM t ORDER BY x").fetchall() == [(1,), (2,)]
+    finally:
+        conn.close()
+
+def test_stale_replica_falls_back_to_primary(primary, tmp_path):
+    """
+    Test if reads go to the primary when there is no replica, or when it is older than the staleness bound.
+    """
+    router = _router(primary, tmp_path, max_staleness=5)
+    conn = router.connect_for_read()
+    assert conn.snapshot_time is None
+    conn.close()
+    assert router.status()["serving_reads"] is False
+
+    router.refresh()
+    _insert(primary, 2)
+    old = time.time() - 10
+    os.utime(router.replica_path, (old, old))
+    conn = router.connect_for_read()
+    try:
+        assert conn.snapshot_time is None
+        assert len(conn.execute("SELECT x FROM t").fetchall()) == 2
+    finally:
+        conn.close()
+    assert router.staleness() >= 10
+
+def test_refresh_copies_in_steps(primary, tmp_path):
+    """
+    Test if a replica copied a few pages at a time holds all of the primary.
+    """
+    conn = sqlite3.connect(primary)
+    conn.executemany("INSERT INTO t VALUES (?)", [(n,) for n in range(5000)])
+    conn.commit()
+    conn.close()
+    replica = str(tmp_path / 'replica.db')
+    refresh_replica(primary, replica, pages=2, sleep=0)
+    conn = sqlite3.connect(replica)
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 5001
+    conn.close()
+
+def test_refresh_skips_unchanged_primary(primary, tmp_path, monkeypatch):
+    """
+    Test if a replica whose primary was not written since its snapshot is dated anew instead of copied again.
+    """
+    router = _router(primary, tmp_path, refresh_interval=1)
+    assert router.refresh()
+    old = time.time() - 100
+    os.utime(primary, (old, old))
+    os.utime(router.replica_path, (old + 50, old + 50))
+    copies = []
+    monkeypatch.setattr('replicas.refresh_replica', lambda *args: copies.append(args))
+    assert not router.refresh()
+    assert copies == [] and router.staleness() < 1
+
+    os.utime(router.replica_path, (old + 50, old + 50))
+    _insert(primary, 2)
+    assert router.refresh()
+    assert len(copies) == 1
+
+def test_inventory_reads_route_to_replica(tmp_path, monkeypatch):
+    """
+    Test if the inventory's get functions read the replica while writes, and the reads returning their result,
+    go to the primary.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database2, 'item_cache', None)
+    database2.create_inventory_table()
+    item = database2.add_item({"name": "Lamp", "category": "electronics", "price_per_item": 20.0,
+                               "description": "A desk lamp", "count_in_stock": 5})
+
+    router = ReplicaRouter('ecommerce_inventory.db', str(tmp_path / 'replica.db'), max_staleness=60)
+    router.refresher_pid = os.getpid()
+    router.refresh()
+    monkeypatch.setattr(database2, 'item_replicas', router)
+
+    updated = database2.update_item(item['item_id'], {"count_in_stock": 3})
+    assert updated['count_in_stock'] == 3
+    assert database2.get_item_by_id(item['item_id'])['count_in_stock'] == 5
+    assert database2.get_items_by_ids([item['item_id']])[item['item_id']]['count_in_stock'] == 5
+    assert database2.get_item_by_id(item['item_id'], primary=True)['count_in_stock'] == 3
+
+    router.refresh(force=True)
+    assert database2.get_item_by_id(item['item_id'])['count_in_stock'] == 3
@@ -0,0 +1,271 @@
+"""
+Module that protects a service from slow or failing dependencies.
+
+A CircuitBreaker watches the calls made to one dependency over a rolling window of WINDOW_SECONDS, in one bucket
+per second. Once enough calls were made in the window, and too many of them failed or were slow, the circuit
+opens: calls fail at once with CircuitOpenError instead of waiting on the dependency, so request threads are not
+held up behind it. After OPEN_SECONDS a single trial call is let through; the circuit closes again if it succeeds
+quickly and stays open for another period otherwise.
+
+``hedged`` sends a second, identical request when the first has not answered after a delay, and returns the
+first answer, which cuts the tail latency of idempotent lookups at the cost of some extra load. Hedged requests
+run on a bounded thread pool, and a call made while the pool is busy is simply not hedged. Arguments that can only
+be iterated once, such as generators, are turned into tuples first, so both requests see the same values.
+"""
+
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+
+WINDOW_SECONDS = 10
+MIN_CALLS = 20
+FAILURE_RATIO = 0.5
+SLOW_CALL_SECONDS = 1.0
+SLOW_CALL_RATIO = 0.5
+OPEN_SECONDS = 5.0
+HEDGE_WORKERS = 16
+
+class ServiceUnavailableError(Exception):
+    """
+    Raised when a service cannot be reached, does not answer in time, or answers with a server error.
+    """
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """
+    Raised instead of calling a dependency whose circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast while it is failing or slow.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, window_seconds=WINDOW_SECONDS, min_calls=MIN_CALLS, failure_ratio=FAILURE_RATIO,
+                 slow_call_seconds=SLOW_CALL_SECONDS, slow_call_ratio=SLOW_CALL_RATIO, open_seconds=OPEN_SECONDS,
+                 clock=time.monotonic):
+        """
+        :param name: The name of the dependency.
+        :type name: str
+        :param window_seconds: The length of the rolling window calls are counted over.
+        :type window_seconds: int
+        :param min_calls: The number of calls in the window below which the circuit does not open.
+        :type min_calls: int
+        :param failure_ratio: The share of failed calls in the window that opens the circuit.
+        :type failure_ratio: float
+        :param slow_call_seconds: The duration above which a call counts as slow.
+        :type slow_call_seconds: float
+        :param slow_call_ratio: The share of slow calls in the window that opens the circuit.
+        :type slow_call_ratio: float
+        :param open_seconds: The time the circuit stays open before a trial call is let through.
+        :type open_seconds: float
+        :param clock: The function returning the current time in seconds.
+        :type clock: callable
+        """
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_ratio = slow_call_ratio
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.trial_in_flight = False
+        # [second, calls, failures, slow calls] per second of the window, oldest first.
+        self.buckets = deque()
+        self.lock = threading.Lock()
+
+    def _totals(self, now):
+        """
+        Drops the buckets that left the window and adds up the others. The caller holds the lock.
+
+        :param now: The current time.
+        :type now: float
+        :return: The numbers of calls, failed calls and slow calls in the window.
+        :rtype: tuple
+        """
+        while self.buckets and self.buckets[0][0] <= int(now) - self.window_seconds:
+            self.buckets.popleft()
+        return tuple(sum(bucket[i] for bucket in self.buckets) for i in (1, 2, 3))
+
+    def allow(self):
+        """
+        Decides whether a call may be made now.
+
+        :return: False if the circuit is open, or half open with its trial call in flight.
+        :rtype: bool
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record(self, duration, failed):
+        """
+        Records the outcome of a call, opening or closing the circuit as needed.
+
+        :param duration: The duration of the call in seconds.
+        :type duration: float
+        :param failed: Whether the call failed.
+        :type failed: bool
+        """
+        slow = duration > self.slow_call_seconds
+        with self.lock:
+            now = self.clock()
+            if self.state == self.HALF_OPEN:
+                self.trial_in_flight = False
+                if failed or slow:
+                    self.state, self.opened_at = self.OPEN, now
+                else:
+                    self.state = self.CLOSED
+                    self.buckets.clear()
+                return
+            if not self.buckets or self.buckets[-1][0] != int(now):
+                self.buckets.append([int(now), 0, 0, 0])
+            bucket = self.buckets[-1]
+            bucket[1] += 1
+            bucket[2] += failed
+            bucket[3] += slow
+            calls, failures, slow_calls = self._totals(now)
+            if self.state == self.CLOSED and calls >= self.min_calls \
+                    and (failures >= calls * self.failure_ratio or slow_calls >= calls * self.slow_call_ratio):
+                self.state, self.opened_at = self.OPEN, now
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls a function through the breaker. Any exception the function raises counts as a failure.
+
+        :param function: The function calling the dependency.
+        :type function: callable
+        :return: What the function returns.
+        :raises CircuitOpenError: If the circuit is open.
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"The {self.name} service is unavailable")
+        start = self.clock()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record(self.clock() - start, True)
+            raise
+        self.record(self.clock() - start, False)
+        return result
+
+    def status(self):
+        """
+        Describes the state of the circuit and the calls in its window.
+
+        :return: The name, state and counts of calls, failed calls and slow calls.
+        :rtype: dict
+        """
+        with self.lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.open_seconds:
+                state = self.HALF_OPEN
+            else:
+                state = self.state
+            calls, failures, slow_calls = self._totals(self.clock())
+        return {"name": self.name, "state": state, "calls": calls, "failures": failures, "slow_calls": slow_calls}
+
+
+class Hedger:
+    """
+    Runs idempotent calls with a backup request after a delay, on a bounded pool of threads.
+    """
+
+    def __init__(self, workers=HEDGE_WORKERS):
+        """
+        :param workers: The number of threads, which bounds the number of hedged calls in flight.
+        :type workers: int
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def _submit(self, function, args, kwargs):
+        """
+        Runs a call on a free thread of the pool.
+
+        :return: The future of the call, or None if every thread is busy.
+        :rtype: concurrent.futures.Future or None
+        """
+        if not self.slots.acquire(blocking=False):
+            return None
+        future = self.executor.submit(function, *args, **kwargs)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def call(self, delay, function, *args, **kwargs):
+        """
+        Calls a function, calling it a second time if the first call has not returned after delay seconds, and
+        returns the first successful result. The function must be safe to call twice.
+
+        :param delay: The number of seconds to wait before the second call.
+        :type delay: float
+        :param function: The function.
+        :type function: callable
+        :return: What the function returns.
+        :raises Exception: What the function raised, if both calls failed.
+        """
+        args = tuple(_reusable(arg) for arg in args)
+        kwargs = {name: _reusable(value) for name, value in kwargs.items()}
+        first = self._submit(function, args, kwargs)
+        if first is None:
+            return function(*args, **kwargs)
+        done, _ = concurrent.futures.wait([first], timeout=delay)
+        if done:
+            return first.result()
+        second = self._submit(function, args, kwargs)
+        pending = {first, second} if second is not None else {first}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+def _reusable(value):
+    """
+    Turns an argument that can only be iterated once into one that can be passed to two calls.
+
+    :param value: The argument.
+    :return: A tuple of the values of an iterator, such as a generator, and the argument itself otherwise.
+    """
+    return tuple(value) if isinstance(value, Iterator) else value
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+def hedged(delay, function, *args, **kwargs):
+    """
+    Calls an idempotent function with a backup call after delay seconds, on the process's shared Hedger.
+
+    :param delay: The number of seconds to wait before the backup call.
+    :type delay: float
+    :param function: The function.
+    :type function: callable
+    :return: What the first successful call returns.
+    """
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger()
+    return _hedger.call(delay, function, *args, **kwargs)
@@ -0,0 +1,115 @@
+import threading
+import time
+import pytest
+from resilience import *
+
+
+class FakeClock:
+    """
+    A clock that only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail():
+    raise ServiceUnavailableError("down")
+
+def test_breaker_opens_on_failures_and_recovers():
+    """
+    Test if the circuit opens once too many calls fail, fails fast while open, and closes after a good trial call.
+    """
+    clock = FakeClock()
+    breaker = CircuitBreaker('inventory', min_calls=4, failure_ratio=0.5, open_seconds=5, clock=clock)
+    assert breaker.call(lambda: 'ok') == 'ok'
+    for _ in range(3):
+        with pytest.raises(ServiceUnavailableError):
+            breaker.call(fail)
+    assert breaker.status()['state'] == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+
+    clock.now += 5
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(0.01, False)
+    assert breaker.status() == {"name": 'inventory', "state": 'closed', "calls": 0, "failures": 0, "slow_calls": 0}
+
+def test_breaker_opens_on_slow_calls():
+    """
+    Test if the circuit opens when too many calls are slow, and reopens when the trial call is slow too.
+    """
+    clock = FakeClock()
+    breaker = CircuitBreaker('customers', min_calls=2, slow_call_seconds=1.0, open_seconds=5, clock=clock)
+    breaker.record(0.1, False)
+    assert breaker.status()['state'] == 'closed'
+    breaker.record(2.0, False)
+    assert breaker.status()['state'] == 'open'
+    clock.now += 5
+    assert breaker.allow()
+    breaker.record(2.0, False)
+    assert breaker.status()['state'] == 'open'
+
+def test_breaker_window_forgets_old_calls():
+    """
+    Test if calls older than the window no longer count.
+    """
+    clock = FakeClock()
+    breaker = CircuitBreaker('inventory', window_seconds=10, min_calls=3, clock=clock)
+    breaker.record(0.1, True)
+    breaker.record(0.1, True)
+    clock.now += 10
+    breaker.record(0.1, True)
+    assert breaker.status()['state'] == 'closed'
+    assert breaker.status()['failures'] == 1
+
+def test_hedged_call_returns_first_answer():
+    """
+    Test if a slow call is hedged and the faster answer is returned.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def lookup():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.01)
+        return 'slow' if first else 'fast'
+
+    start = time.monotonic()
+    assert hedged(0.05, lookup) == 'fast'
+    assert time.monotonic() - start < 0.5
+    assert len(calls) == 2
+    assert hedged(0.5, lambda: 'quick') == 'quick'
+
+def test_hedged_call_raises_when_every_call_fails():
+    """
+    Test if a hedged call raises the error of its calls when none succeeds.
+    """
+    with pytest.raises(ServiceUnavailableError):
+        hedged(0.01, fail)
+
+def test_hedged_call_shares_generator_arguments():
+    """
+    Test if both calls of a hedged lookup see every value of a generator argument, so the backup does not win
+    with an empty answer.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def lookup(ids):
+        ids = list(ids)
+        with lock:
+            calls.append(ids)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.01)
+        return ids
+
+    assert hedged(0.05, lookup, (n for n in range(3))) == [0, 1, 2]
+    assert calls == [[0, 1, 2], [0, 1, 2]]
+    assert hedged(0.5, lookup, ids=iter([4])) == [4]
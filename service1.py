@@ -2,12 +2,32 @@
 Module that defines a Flask application for managing customer-related operations on the platform.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
 from database1 import *
+from auth import init_auth, issue_token, revoke_token, is_operator, TOKEN_MAX_AGE
+from cdc import changes_blueprint, last_change_seq
+from compression import init_compression
+from json_provider import FastJSONProvider
+from ratelimit import init_rate_limit
+from http_cache import make_etag, is_not_modified, not_modified, if_match_version, precondition_failed
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app, resources={r"/*": {"origins": "*"}})
+# Each shard has its own change log; shard 0's is served at /api/changes and shard i's at /api/changes/shard/i.
+change_logs = []
+for shard, connect_to_shard_db in enumerate(shard_connectors()):
+    name = 'changes' if shard == 0 else f'changes_shard_{shard}'
+    path = '/api/changes' if shard == 0 else f'/api/changes/shard/{shard}'
+    app.register_blueprint(changes_blueprint(connect_to_shard_db, name, path))
+    change_logs.append(f'{name}.api_get_changes')
+init_compression(app)
+init_auth(app, public_endpoints=('api_register_customer', 'api_login_customer'))
+init_rate_limit(app, costs={'api_get_all_customers': 10, 'api_apply_wallet_batch': 10},
+                unlimited_endpoints=tuple(change_logs))
+
+BATCH_MAX_IDS = 1000
 
 if __name__ == "__main__":
     create_customers_table()  # Create the customers table when the application runs
@@ -24,40 +44,137 @@ def api_register_customer():
     customer_data = request.get_json()
     return jsonify(insert_customer(customer_data))
 
+@app.route('/api/customers/login', methods=['POST'])
+def api_login_customer():
+    """
+    Check a customer's username and password and issue an access token.
+
+    :return: A JSON response containing the customer's details and an access token to send as
+             ``Authorization: Bearer <token>``, or an error message with status 401 if the username or password
+             is wrong.
+    :rtype: dict
+    """
+    credentials = request.get_json() or {}
+    if not credentials.get('username') or not credentials.get('password'):
+        return jsonify({"error": "username and password are required"}), 400
+    customer = authenticate_customer(credentials['username'], credentials['password'])
+    if customer is None:
+        return jsonify({"error": "Invalid username or password"}), 401
+    return jsonify({
+        "customer": customer,
+        "access_token": issue_token(customer),
+        "token_type": "Bearer",
+        "expires_in": TOKEN_MAX_AGE,
+    })
+
+@app.route('/api/customers/logout', methods=['POST'])
+def api_logout_customer():
+    """
+    Revoke the access token the request was made with.
+
+    :return: A JSON response confirming the logout, or an error message with status 401 if the request carries no
+             valid token.
+    :rtype: dict
+    """
+    if g.auth is None:
+        return jsonify({"error": "Authentication required"}), 401
+    revoke_token(g.auth)
+    return jsonify({"status": "Logged out"})
+
 @app.route('/api/customers/all', methods=['GET'])
 def api_get_all_customers():
     """
     Retrieve details of all customers.
 
+    The response carries an ``ETag`` built from the positions of the shards' change logs, so it changes with every
+    write.
+    When the request's ``If-None-Match`` header matches it, an empty ``304 Not Modified`` response is sent instead.
+
     :return: A JSON response containing details of all customers or an error message.
     :rtype: dict
     """
-    return jsonify(get_all_customers())
+    # The tag is read before the rows, so that it never claims a newer state than the body.
+    etag = make_etag('customers', 'all', '.'.join(str(last_change_seq(connect)) for connect in shard_connectors()))
+    if is_not_modified(etag):
+        return not_modified(etag)
+    response = jsonify(get_all_customer_rows())
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/customers/batch', methods=['POST'])
+def api_get_customers_batch():
+    """
+    Retrieve details of several customers in one call.
+
+    The request body contains either a list of customer IDs under ``ids`` or a list of usernames
+    under ``usernames``.
+
+    :return: A JSON response mapping each found customer ID (or username) to the customer's details,
+             or an error message.
+    :rtype: dict
+    """
+    data = request.get_json() or {}
+    if 'ids' in data:
+        keys, lookup = data['ids'], get_customers_by_ids
+    elif 'usernames' in data:
+        keys, lookup = data['usernames'], get_customers_by_usernames
+    else:
+        return jsonify({"error": "Request body must contain ids or usernames"})
+    if not isinstance(keys, list):
+        return jsonify({"error": "ids and usernames must be lists"})
+    if len(keys) > BATCH_MAX_IDS:
+        return jsonify({"error": f"At most {BATCH_MAX_IDS} customers can be requested at once"})
+    try:
+        return jsonify(lookup(keys))
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids must be integers"})
 
 @app.route('/api/customers/<username>', methods=['GET'])
 def api_get_customer_by_username(username):
     """
     Retrieve details of a customer by their username.
 
+    The response carries an ``ETag`` built from the customer's version. When the request's ``If-None-Match``
+    header matches the current version, an empty ``304 Not Modified`` response is sent instead.
+
     :param username: The username of the customer.
     :type username: str
     :return: A JSON response containing the customer's details or an error message.
     :rtype: dict
     """
-    return jsonify(get_customer_by_username(username))
+    version = get_customer_version(username)
+    if version is not None and is_not_modified(make_etag('customer', *version)):
+        return not_modified(make_etag('customer', *version))
+
+    customer = get_customer_by_username(username)
+    response = jsonify(customer)
+    if customer:
+        response.set_etag(make_etag('customer', customer['customer_id'], customer['version']))
+    return response
 
 @app.route('/api/customers/update/<customer_id>', methods=['PUT'])
 def api_update_customer(customer_id):
     """
     Update details of a customer.
 
+    When the request carries an ``If-Match`` header with the customer's ETag, the update is only applied if
+    the customer is still at that version; otherwise a ``412 Precondition Failed`` response is sent.
+
     :param customer_id: The ID of the customer to be updated.
     :type customer_id: int
     :return: A JSON response containing the updated customer's details or an error message.
     :rtype: dict
     """
     updates = request.get_json()
-    return jsonify(update_customer(customer_id, updates))
+    try:
+        customer = update_customer(customer_id, updates, if_match_version('customer', customer_id))
+    except VersionConflictError as e:
+        return precondition_failed(str(e), make_etag('customer', customer_id, e.current_version))
+
+    response = jsonify(customer)
+    if 'version' in customer:
+        response.set_etag(make_etag('customer', customer['customer_id'], customer['version']))
+    return response
 
 @app.route('/api/customers/delete/<customer_id>', methods=['DELETE'])
 def api_delete_customer(customer_id):
@@ -97,5 +214,45 @@ def api_deduce_money_from_wallet(customer_id):
     amount = float(request.get_json().get('amount', 0))
     return jsonify(deduce_money_from_wallet(customer_id, amount))
 
+@app.route('/api/customers/wallets/batch', methods=['POST'])
+def api_apply_wallet_batch():
+    """
+    Credit or debit the wallets of many customers in one transaction.
+
+    The request body contains a list of ``{"customer_id": ..., "delta": ...}`` objects under ``operations`` and
+    an optional ``mode``: ``all_or_nothing`` (the default) rejects the whole batch if any operation fails, while
+    ``best_effort`` applies the operations that can be applied and reports the others.
+
+    Only operators (see the auth module) can apply a batch, whether or not authentication is required.
+
+    An ``all_or_nothing`` batch must stay within one customer shard (see the sharding module); a batch spanning
+    several shards is refused with the indexes of its operations grouped by shard under ``shards``.
+
+    :return: A JSON response with the new balance of every updated customer and the failed operations, or an
+             error message with status 401 without a valid token, 403 for a customer who is not an operator, 400
+             for a malformed request or an atomic batch spanning several shards, 409 for a rejected batch and 500
+             if the database could not be updated.
+    :rtype: dict
+    """
+    if g.auth is None:
+        return jsonify({"error": "Authentication required"}), 401
+    if not is_operator(g.auth):
+        return jsonify({"error": "Only operators can apply wallet batches"}), 403
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    mode = data.get('mode', 'all_or_nothing')
+    if not isinstance(operations, list):
+        return jsonify({"error": "Request body must contain a list of operations"}), 400
+    if mode not in ('all_or_nothing', 'best_effort'):
+        return jsonify({"error": "mode must be all_or_nothing or best_effort"}), 400
+    if len(operations) > WALLET_BATCH_MAX_OPERATIONS:
+        return jsonify({"error": f"At most {WALLET_BATCH_MAX_OPERATIONS} operations can be applied at once"}), 400
+    result = apply_wallet_deltas(operations, atomic=mode == 'all_or_nothing')
+    if 'shards' in result:
+        return jsonify(result), 400
+    if 'error' in result:
+        return jsonify(result), 409 if 'failed' in result else 500
+    return jsonify(result)
+
 if __name__ == "__main__":
     app.run(port=5000)
@@ -117,3 +117,130 @@ def test_deduce_money_from_wallet(client):
     response = client.put(f'/api/customers/deduce-wallet/{customer_id}', json=data)
     assert response.status_code == 200
     assert 'error' not in response.json
+
+def test_apply_wallet_batch(client, new_customer_data, monkeypatch):
+    """
+    Test crediting several wallets in one call through the API, in both modes.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param new_customer_data: Data for registering a new customer
+    :type new_customer_data: dict
+
+    :param monkeypatch: Pytest fixture to change the application's settings for this test only
+    """
+    # Batch calls are expensive for the rate limiter; keep this test from using up the other tests' budget.
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_PER_SECOND', 0)
+    customer = client.post('/api/customers/batch', json={'usernames': [new_customer_data['username']]}).json[new_customer_data['username']]
+    operations = [{'customer_id': customer['customer_id'], 'delta': 25.0}, {'customer_id': 999999, 'delta': 1.0}]
+    assert client.post('/api/customers/wallets/batch', json={'operations': operations}).status_code == 401
+    credentials = {'username': new_customer_data['username'], 'password': new_customer_data['password']}
+    token = client.post('/api/customers/login', json=credentials).json['access_token']
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    assert client.post('/api/customers/wallets/batch', json={'operations': operations}).status_code == 403
+    monkeypatch.setitem(app.config, 'AUTH_OPERATORS', (new_customer_data['username'],))
+
+    response = client.post('/api/customers/wallets/batch', json={'operations': operations})
+    assert response.status_code == 409
+    assert response.json['failed'][0]['index'] == 1
+    response = client.post('/api/customers/wallets/batch', json={'operations': operations, 'mode': 'best_effort'})
+    assert response.status_code == 200
+    assert response.json['balances'] == {str(customer['customer_id']): customer['wallet_balance'] + 25.0}
+    assert client.post('/api/customers/wallets/batch', json={'operations': operations, 'mode': 'some'}).status_code == 400
+    assert client.post('/api/customers/wallets/batch', json={}).status_code == 400
+
+def test_get_customers_batch(client, new_customer_data):
+    """
+    Test retrieving several customers by username and by ID through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param new_customer_data: Data for registering a new customer
+    :type new_customer_data: dict
+    """
+    response = client.post('/api/customers/batch', json={'usernames': [new_customer_data['username'], 'nobody']})
+    assert response.status_code == 200
+    assert list(response.json) == [new_customer_data['username']]
+    customer_id = response.json[new_customer_data['username']]['customer_id']
+    response = client.post('/api/customers/batch', json={'ids': [customer_id]})
+    assert response.json[str(customer_id)]['username'] == new_customer_data['username']
+    assert 'error' in client.post('/api/customers/batch', json={}).json
+
+def test_get_customer_conditional(client, new_customer_data):
+    """
+    Test if retrieving a customer with a current ETag answers 304 and a stale one returns the customer.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param new_customer_data: Data for registering a new customer
+    :type new_customer_data: dict
+    """
+    response = client.get(f"/api/customers/{new_customer_data['username']}")
+    etag = response.headers['ETag']
+    cached = client.get(f"/api/customers/{new_customer_data['username']}", headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    client.put(f"/api/customers/charge-wallet/{response.json['customer_id']}", json={'amount': 1.0})
+    changed = client.get(f"/api/customers/{new_customer_data['username']}", headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+def test_update_customer_if_match(client, new_customer_data):
+    """
+    Test if an update with a stale If-Match answers 412.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param new_customer_data: Data for registering a new customer
+    :type new_customer_data: dict
+    """
+    customer = client.get(f"/api/customers/{new_customer_data['username']}").json
+    stale_etag = f'"customer-{customer["customer_id"]}-{customer["version"] - 1}"'
+    response = client.put(f"/api/customers/update/{customer['customer_id']}", json={'age': 27},
+                          headers={'If-Match': stale_etag})
+    assert response.status_code == 412
+
+def test_login_customer(client, new_customer_data):
+    """
+    Test logging a customer in through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param new_customer_data: Data for registering a new customer
+    :type new_customer_data: dict
+    """
+    credentials = {'username': new_customer_data['username'], 'password': new_customer_data['password']}
+    response = client.post('/api/customers/login', json=credentials)
+    assert response.status_code == 200
+    assert response.json['customer']['username'] == new_customer_data['username']
+    assert 'password' not in response.json['customer']
+    assert response.json['token_type'] == 'Bearer'
+    credentials['password'] = 'wrong'
+    assert client.post('/api/customers/login', json=credentials).status_code == 401
+    assert client.post('/api/customers/login', json={}).status_code == 400
+
+def test_auth_required(client, new_customer_data, monkeypatch):
+    """
+    Test that, when authentication is required, requests need the token issued on login until logging out.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param new_customer_data: Data for registering a new customer
+    :type new_customer_data: dict
+
+    :param monkeypatch: Pytest fixture to change the application's settings for this test only
+    """
+    monkeypatch.setitem(app.config, 'AUTH_REQUIRED', True)
+    assert client.get('/api/customers/all').status_code == 401
+    credentials = {'username': new_customer_data['username'], 'password': new_customer_data['password']}
+    token = client.post('/api/customers/login', json=credentials).json['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/customers/all', headers=headers).status_code == 200
+    assert client.get('/api/customers/all', headers={'Authorization': f'Bearer {token}x'}).status_code == 401
+    assert client.post('/api/customers/logout', headers=headers).status_code == 200
+    assert client.get('/api/customers/all', headers=headers).status_code == 401
@@ -2,12 +2,33 @@
 Module that defines a Flask application for managing inventory-related operations in the platform.
 """
 
-from flask import Flask, request, jsonify
+import json
+import os
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from database2 import *
+from auth import init_auth
+from catalogue import CatalogueSnapshot
+from cdc import changes_blueprint
+from compression import init_compression
+from json_provider import FastJSONProvider
+from ratelimit import init_rate_limit
+from stock_stream import StockBroadcaster
+from http_cache import make_etag, is_not_modified, not_modified, if_match_version, precondition_failed
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app, resources={r"/*": {"origins": "*"}})
+app.register_blueprint(changes_blueprint(connect_to_db))
+init_compression(app)
+init_auth(app)
+init_rate_limit(app, costs={'api_get_all_items': 10}, unlimited_endpoints=('changes.api_get_changes', 'api_stream_stock'))
+
+BATCH_MAX_IDS = 1000
+STREAM_KEEPALIVE_SECONDS = 15
+
+stock_broadcaster = StockBroadcaster(connect_to_db)
+catalogue = CatalogueSnapshot(connect_to_db, CHANGE_CAPTURE_COLUMNS, os.environ.get('CATALOGUE_SNAPSHOT_DIR'))
 
 if __name__ == "__main__":
     create_inventory_table()  # Create the inventory table when the application runs
@@ -24,40 +45,184 @@ def api_add_item():
     item_data = request.get_json()
     return jsonify(add_item(item_data))
 
+@app.route('/api/inventory', methods=['GET'])
+def api_get_items():
+    """
+    Retrieve a filtered and sorted page of items.
+
+    Accepts the query string parameters ``category``, ``min_price``, ``max_price``, ``in_stock=true``,
+    ``sort`` (one of ``id``, ``price``, ``name`` or ``stock``), ``limit`` and ``cursor``. When more items
+    may follow, the cursor for the next page is sent in the ``X-Next-Cursor`` header.
+
+    :return: A JSON response containing the page of items or an error message.
+    :rtype: dict
+    """
+    args = request.args
+    sort = args.get('sort', 'id')
+    try:
+        min_price = float(args['min_price']) if 'min_price' in args else None
+        max_price = float(args['max_price']) if 'max_price' in args else None
+        limit = int(args.get('limit', LIST_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "min_price, max_price and limit must be numbers"})
+    limit = max(1, min(limit, LIST_MAX_LIMIT))
+    in_stock = args.get('in_stock', '').lower() in ('1', 'true', 'yes')
+
+    items = get_items(args.get('category'), min_price, max_price, in_stock, sort, args.get('cursor'), limit)
+    response = jsonify(items)
+    if isinstance(items, list) and items and len(items) >= limit:
+        response.headers['X-Next-Cursor'] = encode_items_cursor(items[-1], sort)
+    return response
+
 @app.route('/api/inventory/all', methods=['GET'])
 def api_get_all_items():
     """
     Retrieve details of all items in the inventory.
 
+    The catalogue is served from a pre-serialised snapshot that is brought up to date from the change log. The
+    response carries an ``ETag`` built from the position of the change log, so it changes with every write. When
+    the request's ``If-None-Match`` header matches it, an empty ``304 Not Modified`` response is sent instead.
+
     :return: A JSON response containing details of all items or an error message.
     :rtype: dict
     """
-    return jsonify(get_all_items())
+    try:
+        snapshot, body = catalogue.current_body()
+        etag = make_etag('inventory', 'all', snapshot.seq)
+        if is_not_modified(etag):
+            if not isinstance(body, bytes):
+                body.close()
+            return not_modified(etag)
+        if isinstance(body, bytes):
+            response = Response(body, mimetype='application/json')
+        else:
+            response = send_file(body, mimetype='application/json', etag=False, max_age=None)
+            response.content_length = os.fstat(body.fileno()).st_size
+    except Exception as e:
+        return jsonify({"error": f"Error getting all items: {e}"})
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/inventory/search', methods=['GET'])
+def api_search_items():
+    """
+    Search items by name and description.
+
+    Accepts the query string parameters ``q`` (the search text, matched by word prefix), ``category``,
+    ``limit`` and ``offset``. Results are ordered by relevance.
+
+    :return: A JSON response containing the matching items or an error message.
+    :rtype: dict
+    """
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"})
+    return jsonify(search_items(request.args.get('q', ''), request.args.get('category'), limit, offset))
+
+@app.route('/api/inventory/batch', methods=['GET'])
+def api_get_items_by_ids():
+    """
+    Retrieve details of several items in one call.
+
+    The item IDs are given as a comma separated list in the ``ids`` query string parameter,
+    e.g. ``/api/inventory/batch?ids=1,2,3``.
+
+    :return: A JSON response mapping each found item ID to the item's details, or an error message.
+    :rtype: dict
+    """
+    try:
+        item_ids = [int(item_id) for item_id in request.args.get('ids', '').split(',') if item_id.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma separated list of integers"})
+    if len(item_ids) > BATCH_MAX_IDS:
+        return jsonify({"error": f"At most {BATCH_MAX_IDS} ids can be requested at once"})
+    return jsonify(get_items_by_ids(item_ids))
+
+@app.route('/api/inventory/stream', methods=['GET'])
+def api_stream_stock():
+    """
+    Stream stock level changes as Server-Sent Events.
+
+    The optional ``items`` query string parameter restricts the stream to a comma separated list of item IDs.
+    Each ``stock`` event carries the item_id, count_in_stock and version of an item whose stock changed; changes
+    arriving faster than the client reads them are coalesced to the latest level. A ``resync`` event means that
+    events were dropped because the client fell too far behind, and that current levels should be fetched again.
+
+    :return: A ``text/event-stream`` response, or a JSON error message.
+    :rtype: flask.Response
+    """
+    item_ids = None
+    if request.args.get('items'):
+        try:
+            item_ids = {int(item_id) for item_id in request.args['items'].split(',') if item_id.strip()}
+        except ValueError:
+            return jsonify({"error": "items must be a comma separated list of integers"})
+    subscription = stock_broadcaster.subscribe(item_ids)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                overflowed, events = subscription.take(STREAM_KEEPALIVE_SECONDS)
+                if overflowed:
+                    yield "event: resync\ndata: {}\n\n"
+                if not events and not overflowed:
+                    yield ": keep-alive\n\n"
+                for event in events:
+                    yield f"event: stock\ndata: {json.dumps(event)}\n\n"
+        finally:
+            stock_broadcaster.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/inventory/<item_id>', methods=['GET'])
 def api_get_item_by_id(item_id):
     """
     Retrieve details of an item by its ID.
 
+    The response carries an ``ETag`` built from the item's version. When the request's ``If-None-Match``
+    header matches the current version, an empty ``304 Not Modified`` response is sent instead.
+
     :param item_id: The ID of the item.
     :type item_id: int
     :return: A JSON response containing the item's details or an error message.
     :rtype: dict
     """
-    return jsonify(get_item_by_id(item_id))
+    version = get_item_version(item_id)
+    if version is not None and is_not_modified(make_etag('item', item_id, version)):
+        return not_modified(make_etag('item', item_id, version))
+
+    item = get_item_by_id(item_id)
+    response = jsonify(item)
+    if item:
+        response.set_etag(make_etag('item', item['item_id'], item['version']))
+    return response
 
 @app.route('/api/inventory/update/<item_id>', methods=['PUT'])
 def api_update_item(item_id):
     """
     Update details of an item.
 
+    When the request carries an ``If-Match`` header with the item's ETag, the update is only applied if
+    the item is still at that version; otherwise a ``412 Precondition Failed`` response is sent.
+
     :param item_id: The ID of the item to be updated.
     :type item_id: int
     :return: A JSON response containing the updated item's details or an error message.
     :rtype: dict
     """
     updates = request.get_json()
-    return jsonify(update_item(item_id, updates))
+    try:
+        item = update_item(item_id, updates, if_match_version('item', item_id))
+    except VersionConflictError as e:
+        return precondition_failed(str(e), make_etag('item', item_id, e.current_version))
+
+    response = jsonify(item)
+    if 'version' in item:
+        response.set_etag(make_etag('item', item['item_id'], item['version']))
+    return response
 
 @app.route('/api/inventory/deduce-stock/<item_id>', methods=['PUT'])
 def api_deduce_item_from_stock(item_id):
@@ -93,3 +93,101 @@ def test_api_deduce_item_from_stock(client):
     response = client.put(f'/api/inventory/deduce-stock/{item_id}', json=data)
     assert response.status_code == 200
     assert 'item_id' in response.json
+
+def test_api_search_items(client):
+    """
+    Test searching items in the inventory through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    response = client.get('/api/inventory/search?q=new&category=electronics&limit=5')
+    assert response.status_code == 200
+    assert isinstance(response.json, list)
+    assert all(item['category'] == 'electronics' for item in response.json)
+
+def test_api_get_items(client):
+    """
+    Test retrieving a filtered, sorted page of items through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    response = client.get('/api/inventory?category=electronics&in_stock=true&sort=price&limit=1')
+    assert response.status_code == 200
+    assert len(response.json) == 1
+    assert response.json[0]['category'] == 'electronics'
+    next_page = client.get(f"/api/inventory?category=electronics&in_stock=true&sort=price&limit=1"
+                           f"&cursor={response.headers['X-Next-Cursor']}")
+    assert next_page.status_code == 200
+    assert all(item['price_per_item'] >= response.json[0]['price_per_item'] for item in next_page.json)
+
+def test_api_get_items_by_ids(client):
+    """
+    Test retrieving several items by ID through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    response = client.get('/api/inventory/batch?ids=1,999999')
+    assert response.status_code == 200
+    assert list(response.json) == ['1']
+    assert 'error' in client.get('/api/inventory/batch?ids=1,abc').json
+
+def test_api_get_item_conditional(client):
+    """
+    Test if retrieving an item with a current ETag answers 304 and a stale one returns the item.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    response = client.get('/api/inventory/1')
+    etag = response.headers['ETag']
+    assert client.get('/api/inventory/1', headers={'If-None-Match': etag}).status_code == 304
+    client.put('/api/inventory/deduce-stock/1', json={'quantity': 1})
+    changed = client.get('/api/inventory/1', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+def test_api_update_item_if_match(client):
+    """
+    Test if an update with a current If-Match applies and one with a stale If-Match answers 412.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    etag = client.get('/api/inventory/1').headers['ETag']
+    response = client.put('/api/inventory/update/1', json={'price_per_item': 80.0}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    stale = client.put('/api/inventory/update/1', json={'price_per_item': 81.0}, headers={'If-Match': etag})
+    assert stale.status_code == 412
+    assert stale.headers['ETag'] == response.headers['ETag']
+
+def test_api_stream_stock(client):
+    """
+    Test opening the stock level event stream through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    response = client.get('/api/inventory/stream?items=1', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert next(response.response) == b'retry: 3000\n\n'
+    response.close()
+    assert client.get('/api/inventory/stream?items=x').json['error']
+
+def test_api_get_all_items_conditional(client):
+    """
+    Test if the full catalogue answers 304 to a current ETag and changes its ETag when an item changes.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+    """
+    etag = client.get('/api/inventory/all').headers['ETag']
+    assert client.get('/api/inventory/all', headers={'If-None-Match': etag}).status_code == 304
+    client.put('/api/inventory/deduce-stock/1', json={'quantity': 1})
+    changed = client.get('/api/inventory/all', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
@@ -2,14 +2,29 @@
 Module that defines a Flask application for managing sales on the platform.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from datetime import date
+import database3
+from auth import init_auth
+from cdc import changes_blueprint
+from compression import init_compression
+from json_provider import FastJSONProvider
+from ratelimit import init_rate_limit
 from database3 import *
-from database1 import get_customer_by_username
-from database2 import *
+from export import stream_sales, pa
+from analytics import get_daily_revenue, get_item_revenue, get_category_revenue, get_top_customers, TOP_DEFAULT_LIMIT
+from database2 import create_inventory_table
+from service_client import customer_client, inventory_client, dependency_status, ServiceUnavailableError, \
+    ServiceRequestError
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app, resources={r"/*": {"origins": "*"}})
+app.register_blueprint(changes_blueprint(database3.connect_to_db))
+init_compression(app)
+init_auth(app)
+init_rate_limit(app, costs={'api_export_sales': 10}, unlimited_endpoints=('changes.api_get_changes', 'api_export_sales'))
 
 if __name__ == "__main__":
     create_sales_table()  # Create the sales table when the application runs
@@ -21,6 +36,9 @@ def api_make_sale():
     """
     Make a sale transaction for a customer.
 
+    The sale is only reported as completed once it is recorded and the item's stock is deduced; a sale recorded
+    whose stock could not be deduced is answered with an error saying so.
+
     :return: A JSON response indicating the status of the sale or any errors.
     :rtype: dict
     """
@@ -28,13 +46,28 @@ def api_make_sale():
     customer_username = sale_data.get('customer_username')
     item_id = sale_data.get('item_id')
     if customer_username and item_id:
-        customer = get_customer_by_username(customer_username)
-        item = get_item_by_id(item_id)
+        try:
+            customer = customer_client().get_customer_by_username(customer_username)
+            item = inventory_client().get_item_by_id(item_id)
+        except ServiceUnavailableError as e:
+            return jsonify({"error": f"Service unavailable: {e}"}), 503
+        except ServiceRequestError as e:
+            return jsonify({"error": f"Service refused the request: {e}"}), 502
 
-        if customer and item:
+        if customer and item and 'error' not in customer and 'error' not in item:
             if customer['wallet_balance'] >= item['price_per_item'] and item['count_in_stock'] > 0:
-                make_sale(customer['customer_id'], item['item_id'])
-                deduce_item_from_stock(item['item_id'], 1)
+                sale_id = make_sale(customer['customer_id'], item['item_id'], item['price_per_item'], item['category'])
+                if sale_id is None:
+                    return jsonify({"error": "Sale could not be recorded"}), 500
+                try:
+                    updated = inventory_client().deduce_item_from_stock(item['item_id'], 1) \
+                        or {"error": "Item not found"}
+                except ServiceUnavailableError as e:
+                    return jsonify({"error": f"Sale recorded but stock not updated: {e}"}), 503
+                except ServiceRequestError as e:
+                    return jsonify({"error": f"Sale recorded but stock not updated: {e}"}), 502
+                if 'error' in updated:
+                    return jsonify({"error": f"Sale recorded but stock not updated: {updated['error']}"}), 502
                 return jsonify({"status": "Sale completed successfully"})
             else:
                 return jsonify({"error": "Insufficient funds or item out of stock"})
@@ -46,19 +79,144 @@ def api_make_sale():
 @app.route('/api/sales/customer/<customer_username>', methods=['GET'])
 def api_get_customer_sales(customer_username):
     """
-    Retrieve sales transactions for a specific customer.
+    Retrieve sales transactions for a specific customer, most recent first.
+
+    Accepts the query string parameters ``from`` and ``to`` (dates formatted as YYYY-MM-DD), ``limit`` and
+    ``cursor``. When more sales may follow, the cursor for the next page is sent in the ``X-Next-Cursor`` header.
 
     :param customer_username: The username of the customer.
     :type customer_username: str
     :return: A JSON response containing the customer's sales or an error message.
     :rtype: dict
     """
-    customer = get_customer_by_username(customer_username)
+    try:
+        customer = customer_client().get_customer_by_username(customer_username)
+    except ServiceUnavailableError as e:
+        return jsonify({"error": f"Service unavailable: {e}"}), 503
+    except ServiceRequestError as e:
+        return jsonify({"error": f"Service refused the request: {e}"}), 502
 
-    if customer:
-        return jsonify(get_customer_sales(customer['customer_id']))
+    if customer and 'error' not in customer:
+        try:
+            date_from, date_to = _stats_range()
+            limit = max(1, min(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), HISTORY_MAX_LIMIT))
+        except ValueError:
+            return jsonify({"error": "from and to must be dates formatted as YYYY-MM-DD and limit an integer"})
+        try:
+            sales = get_customer_sales_page(customer['customer_id'], date_from, date_to, limit,
+                                            request.args.get('cursor'))
+        except ServiceUnavailableError as e:
+            return jsonify({"error": f"Service unavailable: {e}"}), 503
+        except ServiceRequestError as e:
+            return jsonify({"error": f"Service refused the request: {e}"}), 502
+        response = jsonify(sales)
+        if isinstance(sales, list) and len(sales) == limit:
+            response.headers['X-Next-Cursor'] = encode_sales_cursor(sales[-1])
+        return response
     else:
         return jsonify({"error": "Customer not found"})
 
+def _stats_range():
+    """
+    Reads the ``from`` and ``to`` query string parameters of a statistics request.
+
+    :return: The first and last day to include, formatted as 'YYYY-MM-DD' (or None when not given).
+    :rtype: tuple
+
+    :raises ValueError: If a parameter is not a valid date.
+    """
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    for value in (date_from, date_to):
+        if value:
+            date.fromisoformat(value)
+    return date_from, date_to
+
+@app.route('/api/sales/stats/daily', methods=['GET'])
+def api_get_daily_revenue():
+    """
+    Retrieve the units sold and revenue of each day, optionally between the ``from`` and ``to`` dates.
+
+    :return: A JSON response containing the daily statistics or an error message.
+    :rtype: dict
+    """
+    try:
+        date_from, date_to = _stats_range()
+    except ValueError:
+        return jsonify({"error": "from and to must be dates formatted as YYYY-MM-DD"})
+    return jsonify(get_daily_revenue(date_from, date_to))
+
+@app.route('/api/sales/stats/items', methods=['GET'])
+def api_get_item_revenue():
+    """
+    Retrieve the best selling items by revenue, optionally between the ``from`` and ``to`` dates.
+    The number of items is set with ``limit``.
+
+    :return: A JSON response containing the item statistics or an error message.
+    :rtype: dict
+    """
+    try:
+        date_from, date_to = _stats_range()
+        limit = int(request.args.get('limit', TOP_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "from and to must be dates formatted as YYYY-MM-DD and limit an integer"})
+    return jsonify(get_item_revenue(date_from, date_to, limit))
+
+@app.route('/api/sales/stats/categories', methods=['GET'])
+def api_get_category_revenue():
+    """
+    Retrieve the units sold and revenue of each category, optionally between the ``from`` and ``to`` dates.
+
+    :return: A JSON response containing the category statistics or an error message.
+    :rtype: dict
+    """
+    try:
+        date_from, date_to = _stats_range()
+    except ValueError:
+        return jsonify({"error": "from and to must be dates formatted as YYYY-MM-DD"})
+    return jsonify(get_category_revenue(date_from, date_to))
+
+@app.route('/api/sales/stats/top-customers', methods=['GET'])
+def api_get_top_customers():
+    """
+    Retrieve the customers with the highest lifetime revenue. The number of customers is set with ``limit``.
+
+    :return: A JSON response containing the customer statistics or an error message.
+    :rtype: dict
+    """
+    try:
+        limit = int(request.args.get('limit', TOP_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"})
+    return jsonify(get_top_customers(limit))
+
+@app.route('/api/sales/dependencies', methods=['GET'])
+def api_get_dependency_status():
+    """
+    Retrieve the state of the circuit breakers of the customer and inventory services, and the number of calls,
+    failed calls and slow calls in their rolling windows.
+
+    :return: A JSON response listing the status of each breaker.
+    :rtype: list
+    """
+    return jsonify(dependency_status())
+
+@app.route('/api/sales/export', methods=['GET'])
+def api_export_sales():
+    """
+    Stream the sales made after the sale ID given in ``since`` (all sales by default), joined with their item,
+    as a compressed Arrow IPC stream. Requires the optional pyarrow package.
+
+    :return: A streamed ``application/vnd.apache.arrow.stream`` response, or a JSON error message.
+    :rtype: flask.Response
+    """
+    if pa is None:
+        return jsonify({"error": "Exporting requires the pyarrow package"})
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"error": "since must be an integer"})
+    return Response(stream_sales(since), mimetype='application/vnd.apache.arrow.stream')
+
 if __name__ == "__main__":
     app.run(port=8080, debug=True)
@@ -1,5 +1,7 @@
 import pytest
 from service3 import *
+from resilience import CircuitBreaker
+from service_client import GuardedClient, LocalCustomerClient, LocalInventoryClient
 
 
 @pytest.fixture
@@ -55,3 +57,154 @@ def test_api_get_customer_sales(client, setup_sales_table):
     response = client.get('/api/sales/customer/test_customer')
     assert response.status_code == 200
     assert 'error' in response.json
+
+
+def test_api_get_sales_stats(client, setup_sales_table):
+    """
+    Test getting the sales statistics through the API.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param setup_sales_table: Fixture to set up the sales table
+    :type setup_sales_table: None
+
+    """
+    for path in ('daily', 'items', 'categories', 'top-customers'):
+        response = client.get(f'/api/sales/stats/{path}')
+        assert response.status_code == 200
+        assert isinstance(response.json, list)
+    assert 'error' in client.get('/api/sales/stats/daily?from=yesterday').json
+
+
+def test_api_get_customer_sales_page(client, setup_sales_table):
+    """
+    Test getting a page of a customer's sales through the API.
+    Assumes the customer 'johndoe' registered by the customers service tests exists.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param setup_sales_table: Fixture to set up the sales table
+    :type setup_sales_table: None
+
+    """
+    response = client.get('/api/sales/customer/johndoe?from=2000-01-01&limit=1')
+    assert response.status_code == 200
+    assert isinstance(response.json, list)
+    assert 'error' in client.get('/api/sales/customer/johndoe?from=yesterday').json
+
+
+def test_api_export_sales(client, setup_sales_table):
+    """
+    Test streaming the sales through the API as Arrow IPC.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param setup_sales_table: Fixture to set up the sales table
+    :type setup_sales_table: None
+
+    """
+    pa = pytest.importorskip('pyarrow')
+    response = client.get('/api/sales/export?since=0')
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.data).read_all()
+    assert 'item_name' in table.column_names
+
+
+def test_api_fails_fast_when_a_dependency_is_down(client, setup_sales_table, monkeypatch):
+    """
+    Test that sales fail fast with 503 while the customer service's circuit is open, and that the breakers
+    are reported.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param setup_sales_table: Fixture to set up the sales table
+    :type setup_sales_table: None
+
+    :param monkeypatch: Pytest fixture to replace the customer client for this test only
+    """
+    breaker = CircuitBreaker('customers', min_calls=1)
+    breaker.record(0.0, True)
+    monkeypatch.setattr('service3.customer_client', lambda: GuardedClient(LocalCustomerClient(), breaker))
+    response = client.post('/api/sales/make-sale', json={'customer_username': 'johndoe', 'item_id': 1})
+    assert response.status_code == 503
+    assert client.get('/api/sales/customer/johndoe').status_code == 503
+    response = client.get('/api/sales/dependencies')
+    assert response.status_code == 200
+    assert isinstance(response.json, list)
+
+def test_api_history_fails_fast_when_inventory_is_down(client, setup_sales_table, monkeypatch):
+    """
+    Test that a customer's history answers 503 while the inventory service's circuit is open, as it does for the
+    customer service.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param setup_sales_table: Fixture to set up the sales table
+    :type setup_sales_table: None
+
+    :param monkeypatch: Pytest fixture to replace the clients for this test only
+    """
+    class Customers:
+        def get_customer_by_username(self, username):
+            return {'customer_id': 1, 'username': username, 'wallet_balance': 0.0}
+
+    make_sale(1, 1, 5.0, 'food')
+    breaker = CircuitBreaker('inventory', min_calls=1)
+    breaker.record(0.0, True)
+    monkeypatch.setattr('service3.customer_client', lambda: Customers())
+    monkeypatch.setattr('database3.inventory_client', lambda: GuardedClient(LocalInventoryClient(), breaker))
+    response = client.get('/api/sales/customer/johndoe')
+    assert response.status_code == 503
+    assert 'error' in response.json
+
+def test_api_make_sale_reports_failed_stock_update(client, setup_sales_table, monkeypatch):
+    """
+    Test that a sale is not reported as completed when its stock could not be deduced, and that error messages
+    from a dependency are not taken for a customer or an item.
+
+    :param client: Flask test client
+    :type client: FlaskClient
+
+    :param setup_sales_table: Fixture to set up the sales table
+    :type setup_sales_table: None
+
+    :param monkeypatch: Pytest fixture to replace the clients for this test only
+    """
+    class Customers:
+        def __init__(self, found):
+            self.found = found
+
+        def get_customer_by_username(self, username):
+            return self.found
+
+    class Inventory:
+        def __init__(self, deduced):
+            self.deduced = deduced
+
+        def get_item_by_id(self, item_id):
+            return {'item_id': int(item_id), 'price_per_item': 5.0, 'count_in_stock': 1, 'category': 'food'}
+
+        def deduce_item_from_stock(self, item_id, quantity):
+            return self.deduced
+
+    monkeypatch.setattr('service3.customer_client',
+                        lambda: Customers({'customer_id': 1, 'username': 'johndoe', 'wallet_balance': 100.0}))
+    data = {'customer_username': 'johndoe', 'item_id': 1}
+    for deduced in ({"error": "Insufficient stock"}, None):
+        monkeypatch.setattr('service3.inventory_client', lambda: Inventory(deduced))
+        response = client.post('/api/sales/make-sale', json=data)
+        assert response.status_code == 502
+        assert 'Sale recorded but stock not updated' in response.json['error']
+
+    monkeypatch.setattr('service3.inventory_client', lambda: Inventory({'item_id': 1, 'count_in_stock': 0}))
+    response = client.post('/api/sales/make-sale', json=data)
+    assert response.json == {"status": "Sale completed successfully"}
+
+    monkeypatch.setattr('service3.customer_client', lambda: Customers({"error": "Database locked"}))
+    response = client.post('/api/sales/make-sale', json=data)
+    assert response.json == {"error": "Invalid customer or item"}
@@ -0,0 +1,524 @@
+"""
+Module that contains the clients the sales service uses to reach the customer and inventory services.
+
+Each service has a local client, which calls the functions of its database module in the same process, and a
+remote client, which calls its HTTP API. The remote clients go through an HTTPTransport, which keeps a pool of
+persistent HTTP/1.1 connections per service, bounds every request with a timeout, and retries idempotent requests
+that fail to connect or meet a temporary server error. A lookup answered 404 finds nothing, and any other refused
+request raises ServiceRequestError rather than passing the error body off as data. Lookups of several rows use the
+batch endpoints, one request per BATCH_MAX_IDS rows.
+
+``customer_client`` and ``inventory_client`` return the remote client when ``CUSTOMERS_SERVICE_URL`` or
+``INVENTORY_SERVICE_URL`` is set, and the local client otherwise, so co-located services keep calling the
+database directly. ``SERVICE_TIMEOUT``, ``SERVICE_RETRIES`` and ``SERVICE_API_KEY`` (sent as ``X-API-Key``, which
+the services' rate limiter identifies clients by) configure the remote clients. When ``AUTH_SECRET_KEY`` is set,
+the remote clients authenticate as the sales service with a bearer token they sign themselves (see
+ServiceCredential), so they keep working when the other services require authentication.
+
+Both clients are wrapped in a GuardedClient, which calls them through a circuit breaker per service (see the
+resilience module), so a failing or slow service makes calls fail fast with CircuitOpenError rather than tie up
+the caller's threads. When ``SERVICE_HEDGE_DELAY`` is set, the idempotent lookups are also hedged: a second
+request is sent if the first has not answered after that many seconds.
+"""
+
+import functools
+import http.client
+import json
+import os
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+import auth
+from resilience import CircuitBreaker, CircuitOpenError, ServiceUnavailableError, hedged
+
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 0.05
+POOL_SIZE = 16
+IDLE_TIMEOUT_SECONDS = 1.5
+BATCH_MAX_IDS = 1000
+RETRY_STATUSES = (502, 503, 504)
+
+class ServiceRequestError(Exception):
+    """
+    Raised when a service refuses a request, for instance because it is not authenticated or malformed.
+    """
+
+    def __init__(self, message, status):
+        """
+        :param message: The description of the error.
+        :type message: str
+        :param status: The HTTP status the service answered with.
+        :type status: int
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class ServiceCredential:
+    """
+    The bearer token a service authenticates with when calling the other services, reissued before it expires.
+    """
+
+    def __init__(self, name, lifetime=auth.TOKEN_MAX_AGE / 2):
+        """
+        :param name: The name of the calling service.
+        :type name: str
+        :param lifetime: The number of seconds a token is used before a new one is issued.
+        :type lifetime: float
+        """
+        self.name = name
+        self.lifetime = lifetime
+        self.token = None
+        self.issued_at = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        """
+        :return: The value of the ``Authorization`` header.
+        :rtype: str
+        """
+        with self.lock:
+            if self.token is None or time.monotonic() - self.issued_at >= self.lifetime:
+                self.token = auth.issue_service_token(self.name)
+                self.issued_at = time.monotonic()
+            return f"Bearer {self.token}"
+
+
+class HTTPTransport:
+    """
+    Sends JSON requests to a service over a pool of persistent connections.
+    """
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, pool_size=POOL_SIZE, headers=None,
+                 credential=None):
+        """
+        :param base_url: The URL of the service, such as ``http://inventory:5001``.
+        :type base_url: str
+        :param timeout: The number of seconds to wait for a connection or a response.
+        :type timeout: float
+        :param retries: The number of times an idempotent request is retried.
+        :type retries: int
+        :param pool_size: The maximum number of idle connections kept open.
+        :type pool_size: int
+        :param headers: Headers sent with every request.
+        :type headers: dict or None
+        :param credential: The function returning the ``Authorization`` header of each request, or None.
+        :type credential: callable or None
+        """
+        url = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.headers = dict(headers or {})
+        self.credential = credential
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        """
+        Takes an idle connection, or opens a new one if there is none.
+
+        Connections idle for more than IDLE_TIMEOUT_SECONDS are closed instead of reused, since servers close
+        idle keep-alive connections after a few seconds and a request that is not retried must not be sent on a
+        connection the server is closing.
+
+        :return: The connection.
+        :rtype: http.client.HTTPConnection
+        """
+        expired = []
+        conn = None
+        with self.lock:
+            while self.idle:
+                idle_conn, released_at = self.idle.pop()
+                if time.monotonic() - released_at <= IDLE_TIMEOUT_SECONDS:
+                    conn = idle_conn
+                    break
+                expired.append(idle_conn)
+        for idle_conn in expired:
+            idle_conn.close()
+        if conn is not None:
+            return conn
+        return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn):
+        """
+        Keeps a connection for the next request, or closes it if enough connections are idle.
+
+        :param conn: The connection, with its last response read.
+        :type conn: http.client.HTTPConnection
+        """
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def request(self, method, path, body=None, idempotent=True):
+        """
+        Sends a request and decodes its JSON response.
+
+        Requests that fail to connect, time out, lose their connection or receive one of RETRY_STATUSES are
+        retried when idempotent, after a short growing pause.
+
+        :param method: The HTTP method.
+        :type method: str
+        :param path: The path of the endpoint, with its query string.
+        :type path: str
+        :param body: The JSON body, or None.
+        :param idempotent: Whether the request can safely be sent again.
+        :type idempotent: bool
+        :return: The decoded response body, or None if the service answered 404.
+        :raises ServiceUnavailableError: If no attempt succeeded, or the service answered with a server error or
+                                         rejected the request because of its rate limit.
+        :raises ServiceRequestError: If the service refused the request with another client error.
+        """
+        headers = dict(self.headers, Accept='application/json')
+        if self.credential is not None:
+            headers['Authorization'] = self.credential()
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        attempts = self.retries + 1 if idempotent else 1
+        error = None
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            conn = self._acquire()
+            try:
+                conn.request(method, self.prefix + path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                error = ServiceUnavailableError(f"{method} {path} failed: {e}")
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            if response.status in RETRY_STATUSES:
+                error = ServiceUnavailableError(f"{method} {path} answered {response.status}")
+                continue
+            if response.status >= 500 or response.status == 429:
+                raise ServiceUnavailableError(f"{method} {path} answered {response.status}")
+            if response.status == 404:
+                return None
+            if response.status >= 400:
+                raise ServiceRequestError(f"{method} {path} answered {response.status}: {_error_message(data)}",
+                                          response.status)
+            return json.loads(data) if data else None
+        raise error
+
+
+class LocalCustomerClient:
+    """
+    Reaches the customers in the same process, through the database1 module.
+    """
+
+    def __init__(self):
+        import database1
+        self.database = database1
+
+    def get_customer_by_username(self, username):
+        """
+        Retrieves a customer by username.
+
+        :param username: The username of the customer.
+        :type username: str
+        :return: The customer's details, or an empty dictionary if not found.
+        :rtype: dict
+        """
+        return self.database.get_customer_by_username(username)
+
+    def get_customers_by_ids(self, customer_ids):
+        """
+        Retrieves several customers by ID.
+
+        :param customer_ids: The IDs of the customers.
+        :type customer_ids: iterable of int
+        :return: A dictionary mapping each found customer ID to the customer's details.
+        :rtype: dict
+        """
+        return self.database.get_customers_by_ids(customer_ids)
+
+
+class RemoteCustomerClient:
+    """
+    Reaches the customers through the customer service's API.
+    """
+
+    def __init__(self, transport):
+        """
+        :param transport: The transport to the customer service.
+        :type transport: HTTPTransport
+        """
+        self.transport = transport
+
+    def get_customer_by_username(self, username):
+        """
+        Retrieves a customer by username.
+
+        :param username: The username of the customer.
+        :type username: str
+        :return: The customer's details, or an empty dictionary if not found.
+        :rtype: dict
+        """
+        return self.transport.request('GET', f"/api/customers/{quote(username, safe='')}") or {}
+
+    def get_customers_by_ids(self, customer_ids):
+        """
+        Retrieves several customers by ID, with one batch request per BATCH_MAX_IDS IDs.
+
+        :param customer_ids: The IDs of the customers.
+        :type customer_ids: iterable of int
+        :return: A dictionary mapping each found customer ID to the customer's details.
+        :rtype: dict
+        """
+        customer_ids = list(dict.fromkeys(int(customer_id) for customer_id in customer_ids))
+        customers = {}
+        for start in range(0, len(customer_ids), BATCH_MAX_IDS):
+            found = self.transport.request('POST', '/api/customers/batch',
+                                           {'ids': customer_ids[start:start + BATCH_MAX_IDS]})
+            customers.update(_by_integer_key(found))
+        return customers
+
+
+class LocalInventoryClient:
+    """
+    Reaches the inventory in the same process, through the database2 module.
+    """
+
+    def __init__(self):
+        import database2
+        self.database = database2
+
+    def get_item_by_id(self, item_id):
+        """
+        Retrieves an item by ID.
+
+        :param item_id: The ID of the item.
+        :type item_id: int
+        :return: The item's details, or an empty dictionary if not found.
+        :rtype: dict
+        """
+        return self.database.get_item_by_id(item_id)
+
+    def get_items_by_ids(self, item_ids):
+        """
+        Retrieves several items by ID.
+
+        :param item_ids: The IDs of the items.
+        :type item_ids: iterable of int
+        :return: A dictionary mapping each found item ID to the item's details.
+        :rtype: dict
+        """
+        return self.database.get_items_by_ids(item_ids)
+
+    def deduce_item_from_stock(self, item_id, quantity):
+        """
+        Removes units of an item from the stock.
+
+        :param item_id: The ID of the item.
+        :type item_id: int
+        :param quantity: The number of units.
+        :type quantity: int
+        :return: The updated item's details or an error message.
+        :rtype: dict
+        """
+        return self.database.deduce_item_from_stock(item_id, quantity)
+
+
+class RemoteInventoryClient:
+    """
+    Reaches the inventory through the inventory service's API.
+    """
+
+    def __init__(self, transport):
+        """
+        :param transport: The transport to the inventory service.
+        :type transport: HTTPTransport
+        """
+        self.transport = transport
+
+    def get_item_by_id(self, item_id):
+        """
+        Retrieves an item by ID.
+
+        :param item_id: The ID of the item.
+        :type item_id: int
+        :return: The item's details, or an empty dictionary if not found.
+        :rtype: dict
+        """
+        return self.transport.request('GET', f"/api/inventory/{int(item_id)}") or {}
+
+    def get_items_by_ids(self, item_ids):
+        """
+        Retrieves several items by ID, with one batch request per BATCH_MAX_IDS IDs.
+
+        :param item_ids: The IDs of the items.
+        :type item_ids: iterable of int
+        :return: A dictionary mapping each found item ID to the item's details.
+        :rtype: dict
+        """
+        item_ids = list(dict.fromkeys(int(item_id) for item_id in item_ids))
+        items = {}
+        for start in range(0, len(item_ids), BATCH_MAX_IDS):
+            ids = ','.join(str(item_id) for item_id in item_ids[start:start + BATCH_MAX_IDS])
+            items.update(_by_integer_key(self.transport.request('GET', f"/api/inventory/batch?ids={ids}")))
+        return items
+
+    def deduce_item_from_stock(self, item_id, quantity):
+        """
+        Removes units of an item from the stock. The request is not retried, so the stock is never deduced twice.
+
+        :param item_id: The ID of the item.
+        :type item_id: int
+        :param quantity: The number of units.
+        :type quantity: int
+        :return: The updated item's details or an error message.
+        :rtype: dict
+        """
+        return self.transport.request('PUT', f"/api/inventory/deduce-stock/{int(item_id)}", {'quantity': quantity},
+                                      idempotent=False)
+
+
+class GuardedClient:
+    """
+    A client whose calls go through the circuit breaker of its service, with the idempotent lookups hedged when a
+    hedge delay is given.
+    """
+
+    def __init__(self, client, breaker, hedged_methods=(), hedge_delay=None):
+        """
+        :param client: The client.
+        :param breaker: The circuit breaker of the client's service.
+        :type breaker: resilience.CircuitBreaker
+        :param hedged_methods: The names of the client's methods that are safe to call twice.
+        :type hedged_methods: tuple
+        :param hedge_delay: The number of seconds after which a lookup is sent again, or None not to hedge.
+        :type hedge_delay: float or None
+        """
+        self.client = client
+        self.breaker = breaker
+        self.hedged_methods = frozenset(hedged_methods)
+        self.hedge_delay = hedge_delay
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if self.hedge_delay is not None and name in self.hedged_methods:
+            return functools.partial(self.breaker.call, hedged, self.hedge_delay, method)
+        return functools.partial(self.breaker.call, method)
+
+
+def _by_integer_key(found):
+    """
+    Restores the integer keys of a batch response, which JSON turned into strings.
+
+    :param found: The decoded response.
+    :type found: dict
+    :return: The rows by ID.
+    :rtype: dict
+    :raises ServiceUnavailableError: If the service answered with an error message.
+    """
+    if 'error' in found:
+        raise ServiceUnavailableError(found['error'])
+    return {int(key): row for key, row in found.items()}
+
+def _error_message(data):
+    """
+    Reads the error message of a refused request's body.
+
+    :param data: The body.
+    :type data: bytes
+    :return: The message the service gave, or the body itself if it gave none.
+    :rtype: str
+    """
+    try:
+        return json.loads(data)['error']
+    except (ValueError, TypeError, KeyError):
+        return data.decode(errors='replace')
+
+def _transport(url):
+    """
+    Creates the transport to a service, configured by the environment.
+
+    :param url: The URL of the service.
+    :type url: str
+    :return: The transport.
+    :rtype: HTTPTransport
+    """
+    api_key = os.environ.get('SERVICE_API_KEY')
+    return HTTPTransport(url, timeout=float(os.environ.get('SERVICE_TIMEOUT', DEFAULT_TIMEOUT)),
+                         retries=int(os.environ.get('SERVICE_RETRIES', DEFAULT_RETRIES)),
+                         headers={'X-API-Key': api_key} if api_key else None,
+                         credential=ServiceCredential('sales') if auth.SECRET_KEY else None)
+
+def _guard(name, client, hedged_methods):
+    """
+    Wraps a client in a GuardedClient with a new circuit breaker, hedging as configured by the environment.
+
+    :param name: The name of the service.
+    :type name: str
+    :param client: The client.
+    :param hedged_methods: The names of the client's idempotent lookups.
+    :type hedged_methods: tuple
+    :return: The guarded client.
+    :rtype: GuardedClient
+    """
+    hedge_delay = os.environ.get('SERVICE_HEDGE_DELAY')
+    return GuardedClient(client, CircuitBreaker(name), hedged_methods,
+                         float(hedge_delay) if hedge_delay else None)
+
+@functools.lru_cache(maxsize=None)
+def customer_client():
+    """
+    Returns the client of the customer service: remote when ``CUSTOMERS_SERVICE_URL`` is set, local otherwise.
+
+    :return: The client, behind the customer service's circuit breaker.
+    :rtype: GuardedClient
+    """
+    url = os.environ.get('CUSTOMERS_SERVICE_URL')
+    client = RemoteCustomerClient(_transport(url)) if url else LocalCustomerClient()
+    return _guard('customers', client, ('get_customer_by_username', 'get_customers_by_ids'))
+
+@functools.lru_cache(maxsize=None)
+def inventory_client():
+    """
+    Returns the client of the inventory service: remote when ``INVENTORY_SERVICE_URL`` is set, local otherwise.
+
+    :return: The client, behind the inventory service's circuit breaker.
+    :rtype: GuardedClient
+    """
+    url = os.environ.get('INVENTORY_SERVICE_URL')
+    client = RemoteInventoryClient(_transport(url)) if url else LocalInventoryClient()
+    return _guard('inventory', client, ('get_item_by_id', 'get_items_by_ids'))
+
+def dependency_status():
+    """
+    Describes the circuit breakers of the services reached so far.
+
+    :return: The status of each breaker.
+    :rtype: list
+    """
+    clients = []
+    if customer_client.cache_info().currsize:
+        clients.append(customer_client())
+    if inventory_client.cache_info().currsize:
+        clients.append(inventory_client())
+    return [client.breaker.status() for client in clients]
@@ -0,0 +1,179 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server, WSGIRequestHandler
+import auth
+import service2
+from database2 import create_inventory_table, add_item
+from service_client import *
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+@pytest.fixture
+def serve():
+    """
+    Fixture starting applications on local HTTP servers that keep connections alive.
+
+    :return: A function serving an application and returning its URL.
+    :rtype: callable
+    """
+    servers = []
+
+    def start(app):
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+@pytest.fixture
+def items(tmp_path, monkeypatch):
+    """
+    Fixture providing two items in an inventory database of their own.
+
+    :return: The items.
+    :rtype: list
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(service2.app.config, 'RATE_LIMIT_PER_SECOND', 0)
+    create_inventory_table()
+    return [add_item({'name': name, 'category': 'food', 'price_per_item': 2.0, 'description': '', 'count_in_stock': 5})
+            for name in ('Bread', 'Milk')]
+
+def test_remote_and_local_clients_agree(serve, items):
+    """
+    Test if the remote inventory client returns what the local one does, over one persistent connection.
+    """
+    transport = HTTPTransport(serve(service2.app))
+    remote, local = RemoteInventoryClient(transport), LocalInventoryClient()
+    ids = [item['item_id'] for item in items] + [999999]
+    assert remote.get_items_by_ids(ids) == local.get_items_by_ids(ids)
+    assert remote.get_item_by_id(items[0]['item_id']) == local.get_item_by_id(items[0]['item_id'])
+    assert remote.get_item_by_id(999999) == {}
+    assert remote.deduce_item_from_stock(items[1]['item_id'], 2)['count_in_stock'] == 3
+    transport.close()
+
+def test_transport_keeps_connections_alive():
+    """
+    Test if consecutive requests reuse one connection when the server keeps it open.
+    """
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            body = json.dumps({"path": self.path}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = HTTPTransport(f"http://127.0.0.1:{server.server_port}/prefix")
+    assert [transport.request('GET', f'/{n}')['path'] for n in range(3)] == ['/prefix/0', '/prefix/1', '/prefix/2']
+    assert len(connections) == 1 and len(transport.idle) == 1
+    transport.close()
+    server.shutdown()
+
+def test_transport_retries_idempotent_requests(serve):
+    """
+    Test if temporary server errors are retried for idempotent requests only.
+    """
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/flaky', methods=['GET', 'PUT'])
+    def flaky():
+        calls.append(1)
+        if len(calls) % 2:
+            return jsonify({"error": "Service overloaded"}), 503
+        return jsonify({"status": "ok"})
+
+    transport = HTTPTransport(serve(app), retries=1)
+    assert transport.request('GET', '/flaky') == {"status": "ok"}
+    assert len(calls) == 2
+    with pytest.raises(ServiceUnavailableError):
+        transport.request('PUT', '/flaky', {}, idempotent=False)
+    assert len(calls) == 3
+    transport.close()
+
+def test_transport_reports_unreachable_service():
+    """
+    Test if a service that cannot be reached raises ServiceUnavailableError after the retries.
+    """
+    transport = HTTPTransport('http://127.0.0.1:9', timeout=0.5, retries=1)
+    with pytest.raises(ServiceUnavailableError):
+        transport.request('GET', '/api/inventory/1')
+
+def test_transport_raises_on_refused_requests(serve):
+    """
+    Test if requests refused with a client error raise ServiceRequestError, while 404 finds nothing, and if the
+    credential's header is sent with every request.
+    """
+    app = Flask(__name__)
+
+    @app.route('/status/<int:status>')
+    def answer(status):
+        return jsonify({"error": f"Refused with {status}"}), status
+
+    @app.route('/whoami')
+    def whoami():
+        return jsonify({"authorization": request.headers.get('Authorization')})
+
+    transport = HTTPTransport(serve(app))
+    for status in (400, 401, 403):
+        with pytest.raises(ServiceRequestError) as raised:
+            transport.request('GET', f'/status/{status}')
+        assert raised.value.status == status and f"Refused with {status}" in str(raised.value)
+    assert transport.request('GET', '/status/404') is None
+    assert transport.request('GET', '/missing') is None
+    assert transport.request('GET', '/whoami') == {"authorization": None}
+    transport.close()
+
+    credential = ServiceCredential('sales')
+    transport = HTTPTransport(serve(app), credential=credential)
+    header = transport.request('GET', '/whoami')['authorization']
+    assert header == credential() and header.startswith('Bearer ')
+    claims = auth.verify_token(header.split(' ', 1)[1])
+    assert claims['sub'] == 'service:sales' and claims['service'] == 'sales'
+    transport.close()
+
+def test_guarded_client_hedges_generator_arguments(items):
+    """
+    Test if a hedged batch lookup given a generator finds every item, whichever of its calls answers.
+    """
+    calls = []
+    released = threading.Event()
+
+    class SlowFirstClient(LocalInventoryClient):
+        def get_items_by_ids(self, item_ids):
+            item_ids = list(item_ids)
+            calls.append(item_ids)
+            if len(calls) == 1:
+                released.wait(1.0)
+                return {}
+            return super().get_items_by_ids(item_ids)
+
+    client = GuardedClient(SlowFirstClient(), CircuitBreaker('inventory'), ('get_items_by_ids',), hedge_delay=0.05)
+    found = client.get_items_by_ids(item['item_id'] for item in items)
+    assert sorted(found) == [item['item_id'] for item in items]
+    assert len(calls) == 2 and calls[0] == calls[1]
+    released.set()
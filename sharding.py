@@ -0,0 +1,320 @@
+"""
+Module that spreads the customers over several SQLite files, and reshards them.
+
+SQLite lets one writer at a time into a database file, so with a single customers file every wallet update waits
+for every other. With N shards, customer ``customer_id`` lives in shard ``shard_index(customer_id, N)``, a hash of
+the ID, and writes to customers of different shards run in parallel. Shard 0 is 'ecommerce_customers.db', which
+also holds the tables of the other modules, and shard i is 'ecommerce_customers_<i>.db'.
+
+Usernames are unique across the shards, and a customer is found by username through the directory,
+'ecommerce_customers_directory.db', which maps each username to its customer's ID and hands out the IDs of new
+customers. A write changing a username updates the customer's shard and the directory in one transaction, with
+the directory attached to the shard's connection. With a single shard there is no directory: the shard's own
+unique index and AUTOINCREMENT counter do its job.
+
+There is no transaction across shards: a write to several shards commits them one after the other, and a failed
+commit does not undo the shards committed before it. Writes that must be all or nothing, such as atomic wallet
+batches, are therefore refused when they touch more than one shard.
+
+The number of shards is read from ``CUSTOMER_SHARDS`` (1 by default). Resharding moves the customers to the shards
+of a new count and rebuilds the directory; stop the customers service, run::
+
+    CUSTOMER_SHARDS=<current count> python sharding.py --shards <new count>
+
+and restart the service with ``CUSTOMER_SHARDS`` set to the new count. Every move of customers from one shard to
+another is a single transaction over both files, so an interrupted run can simply be started again.
+"""
+
+import argparse
+import os
+import sqlite3
+import zlib
+
+from queries import (ATTACH_SHARD, DETACH_SHARD, COPY_CUSTOMERS_TO_SHARD, DELETE_CUSTOMERS_OF_SHARD, COUNT_CUSTOMERS,
+                     SELECT_CUSTOMER_SEQUENCE, RAISE_CUSTOMER_SEQUENCE, START_CUSTOMER_SEQUENCE,
+                     SELECT_CUSTOMER_USERNAMES, CLEAR_DIRECTORY, FILL_DIRECTORY, SELECT_LAST_CUSTOMER_ID,
+                     RAISE_LAST_CUSTOMER_ID)
+
+BASE_PATH = 'ecommerce_customers.db'
+DIRECTORY_PATH = 'ecommerce_customers_directory.db'
+
+def shard_path(base_path, shard):
+    """
+    Builds the path of a shard's file from the path of shard 0.
+
+    :param base_path: The path of shard 0, e.g. 'ecommerce_customers.db'.
+    :type base_path: str
+    :param shard: The index of the shard.
+    :type shard: int
+    :return: base_path for shard 0, and the path with '_<shard>' appended to its stem otherwise.
+    :rtype: str
+    """
+    if shard == 0:
+        return base_path
+    stem, extension = os.path.splitext(base_path)
+    return f"{stem}_{shard}{extension}"
+
+def shard_index(customer_id, count):
+    """
+    Finds the shard a customer lives in.
+
+    The ID is hashed with CRC-32, which every process computes the same way and which spreads consecutive IDs
+    evenly over the shards.
+
+    :param customer_id: The ID of the customer.
+    :type customer_id: int or str
+    :param count: The number of shards.
+    :type count: int
+    :return: The index of the shard.
+    :rtype: int
+    """
+    if count == 1:
+        return 0
+    return zlib.crc32(int(customer_id).to_bytes(8, 'little', signed=True)) % count
+
+
+class ShardLayout:
+    """
+    The files of the customer shards and of their directory.
+    """
+
+    def __init__(self, count, base_path=BASE_PATH, directory_path=DIRECTORY_PATH):
+        """
+        :param count: The number of shards.
+        :type count: int
+        :param base_path: The path of shard 0.
+        :type base_path: str
+        :param directory_path: The path of the directory, which is only used with several shards.
+        :type directory_path: str
+        """
+        if count < 1:
+            raise ValueError("There must be at least one shard")
+        self.count = count
+        self.paths = [shard_path(base_path, shard) for shard in range(count)]
+        self.directory_path = directory_path if count > 1 else None
+
+    @property
+    def sharded(self):
+        """
+        Whether there are several shards, and so a directory.
+        """
+        return self.count > 1
+
+    def shard_of(self, customer_id):
+        """
+        Finds the shard a customer lives in.
+
+        :param customer_id: The ID of the customer.
+        :type customer_id: int or str
+        :return: The index of the shard.
+        :rtype: int
+        """
+        return shard_index(customer_id, self.count)
+
+    def group(self, customer_ids):
+        """
+        Groups customer IDs by the shard they live in.
+
+        :param customer_ids: The IDs.
+        :type customer_ids: iterable of int
+        :return: A dictionary mapping the index of each shard holding some of the customers to their IDs, in the
+                 order given.
+        :rtype: dict
+        """
+        groups = {}
+        for customer_id in customer_ids:
+            groups.setdefault(self.shard_of(customer_id), []).append(customer_id)
+        return groups
+
+
+def open_shard_layout():
+    """
+    Creates the layout of the customer shards, whose number is given by the ``CUSTOMER_SHARDS`` environment
+    variable.
+
+    :return: The layout, with a single shard if the variable is not set.
+    :rtype: ShardLayout
+    """
+    return ShardLayout(int(os.environ.get('CUSTOMER_SHARDS', 1)))
+
+def create_directory(conn):
+    """
+    Creates the tables of the directory if they do not already exist.
+
+    - 'customer_directory': the ID of the customer of each username.
+    - 'customer_id_sequence': the last customer ID handed out, in a single row.
+
+    :param conn: An open connection to the directory.
+    :type conn: sqlite3.Connection
+    """
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS customer_directory (
+            customer_id INTEGER PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS customer_id_sequence (
+            last_id INTEGER NOT NULL
+        );
+        INSERT INTO customer_id_sequence (last_id)
+        SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM customer_id_sequence);
+    ''')
+
+def _move_customers(source_path, target_path, target_shard, count):
+    """
+    Moves the customers of a file that belong to another shard of a new layout into that shard's file, in one
+    transaction over both files.
+
+    :param source_path: The path of the file the customers are moved out of.
+    :type source_path: str
+    :param target_path: The path of the shard the customers are moved into.
+    :type target_path: str
+    :param target_shard: The index of that shard in the new layout.
+    :type target_shard: int
+    :param count: The number of shards of the new layout.
+    :type count: int
+    :return: The number of customers moved.
+    :rtype: int
+    """
+    conn = sqlite3.connect(source_path)
+    try:
+        conn.create_function('shard_index', 2, shard_index, deterministic=True)
+        conn.execute(ATTACH_SHARD, (target_path,))
+        try:
+            moved = conn.execute(COPY_CUSTOMERS_TO_SHARD, (count, target_shard)).rowcount
+            conn.execute(DELETE_CUSTOMERS_OF_SHARD, (count, target_shard))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute(DETACH_SHARD)
+    finally:
+        conn.close()
+    return moved
+
+def reshard(count, current=None):
+    """
+    Moves the customers to the shards of a new layout and rebuilds the directory. The customers service must be
+    stopped while this runs.
+
+    When the number of shards goes down, the files of the shards dropped are left empty rather than deleted.
+
+    :param count: The number of shards of the new layout.
+    :type count: int
+    :param current: The current layout, read from ``CUSTOMER_SHARDS`` by default.
+    :type current: ShardLayout or None
+    :return: A dictionary with the number of customers moved and the customers of each new shard, or an error
+             message.
+    :rtype: dict
+    """
+    # Imported here because database1 imports this module to route its queries.
+    from database1 import create_customers_table
+
+    result = {}
+    try:
+        current = current or open_shard_layout()
+        new = ShardLayout(count, current.paths[0], current.directory_path or DIRECTORY_PATH)
+        create_customers_table(new)
+
+        moved = 0
+        for source_path in dict.fromkeys(current.paths + new.paths):
+            if not os.path.exists(source_path):
+                continue
+            for target_shard, target_path in enumerate(new.paths):
+                if target_path != source_path:
+                    moved += _move_customers(source_path, target_path, target_shard, count)
+
+        sizes = []
+        last_id = _last_directory_id(current.directory_path)
+        for path in new.paths:
+            conn = sqlite3.connect(path)
+            try:
+                sizes.append(conn.execute(COUNT_CUSTOMERS).fetchone()[0])
+                row = conn.execute(SELECT_CUSTOMER_SEQUENCE).fetchone()
+                last_id = max(last_id, row[0] if row else 0)
+            finally:
+                conn.close()
+
+        if new.sharded:
+            _rebuild_directory(new, last_id)
+        else:
+            _raise_customer_sequence(new.paths[0], last_id)
+        result = {"shards": count, "moved": moved, "customers": sizes}
+    except Exception as e:
+        result = {"error": f"Error resharding customers: {e}"}
+
+    return result
+
+def _last_directory_id(directory_path):
+    """
+    Reads the last customer ID handed out by a directory.
+
+    :param directory_path: The path of the directory, or None if there is none.
+    :type directory_path: str or None
+    :return: The ID, or 0 if there is no directory.
+    :rtype: int
+    """
+    if directory_path is None or not os.path.exists(directory_path):
+        return 0
+    conn = sqlite3.connect(directory_path)
+    try:
+        row = conn.execute(SELECT_LAST_CUSTOMER_ID).fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+def _rebuild_directory(layout, last_id):
+    """
+    Fills the directory with the usernames of every shard of a layout, and makes sure the IDs it hands out were
+    never used.
+
+    :param layout: The layout.
+    :type layout: ShardLayout
+    :param last_id: The greatest customer ID handed out so far.
+    :type last_id: int
+    """
+    conn = sqlite3.connect(layout.directory_path)
+    try:
+        create_directory(conn)
+        conn.execute(CLEAR_DIRECTORY)
+        for path in layout.paths:
+            shard = sqlite3.connect(path)
+            try:
+                conn.executemany(FILL_DIRECTORY, shard.execute(SELECT_CUSTOMER_USERNAMES))
+            finally:
+                shard.close()
+        conn.execute(RAISE_LAST_CUSTOMER_ID, (last_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _raise_customer_sequence(path, last_id):
+    """
+    Makes sure the AUTOINCREMENT counter of a single shard does not hand out IDs used under a directory.
+
+    :param path: The path of the shard.
+    :type path: str
+    :param last_id: The greatest customer ID handed out so far.
+    :type last_id: int
+    """
+    conn = sqlite3.connect(path)
+    try:
+        if conn.execute(RAISE_CUSTOMER_SEQUENCE, (last_id,)).rowcount == 0:
+            conn.execute(START_CUSTOMER_SEQUENCE, (last_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the customers to a new number of shards.")
+    parser.add_argument('--shards', type=int, required=True, help="the number of shards of the new layout")
+    args = parser.parse_args()
+    print(reshard(args.shards))
+
+
+if __name__ == '__main__':
+    main()
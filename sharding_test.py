@@ -0,0 +1,140 @@
+import sqlite3
+import pytest
+import database1
+from sharding import *
+
+
+def _customer(number):
+    return {"full_name": f"Customer {number}", "username": f"customer{number}", "password": "secret",
+            "age": 30, "address": "Beirut", "gender": "F", "marital_status": "single"}
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    """
+    Fixture spreading the customers service over four shards in a temporary directory.
+
+    :return: The layout of the shards.
+    :rtype: ShardLayout
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database1, 'customer_cache', None)
+    layout = ShardLayout(4)
+    monkeypatch.setattr(database1, 'customer_shards', layout)
+    database1.create_customers_table()
+    return layout
+
+def _shard_sizes(layout):
+    sizes = []
+    for path in layout.paths:
+        conn = sqlite3.connect(path)
+        sizes.append(conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0])
+        conn.close()
+    return sizes
+
+def test_shard_index():
+    """
+    Test if customers are spread over every shard, and the files are named after shard 0.
+    """
+    counts = [0] * 4
+    for customer_id in range(1, 1001):
+        counts[shard_index(customer_id, 4)] += 1
+    assert min(counts) > 200
+    assert shard_index('17', 4) == shard_index(17, 4)
+    assert shard_index(17, 1) == 0
+    assert shard_path('ecommerce_customers.db', 0) == 'ecommerce_customers.db'
+    assert shard_path('ecommerce_customers.db', 3) == 'ecommerce_customers_3.db'
+    assert ShardLayout(1).directory_path is None
+    with pytest.raises(ValueError):
+        ShardLayout(0)
+
+def test_sharded_customers(shards):
+    """
+    Test if customers are written to the shard of their ID and found by ID or by username.
+    """
+    inserted = [database1.insert_customer(_customer(number)) for number in range(12)]
+    assert sum(_shard_sizes(shards)) == 12
+    assert len([size for size in _shard_sizes(shards) if size]) > 1
+    for customer in inserted:
+        conn = sqlite3.connect(shards.paths[shards.shard_of(customer['customer_id'])])
+        assert conn.execute("SELECT username FROM customers WHERE customer_id = ?",
+                            (customer['customer_id'],)).fetchone() == (customer['username'],)
+        conn.close()
+
+    assert database1.get_customer_by_username('customer5')['customer_id'] == inserted[5]['customer_id']
+    assert database1.get_customer_by_id(inserted[7]['customer_id'])['username'] == 'customer7'
+    assert database1.get_customer_version('customer3') == (inserted[3]['customer_id'], 1)
+    assert set(database1.get_customers_by_usernames(['customer1', 'customer9', 'nobody'])) == {'customer1', 'customer9'}
+    ids = [customer['customer_id'] for customer in inserted]
+    assert set(database1.get_customers_by_ids(ids + [10 ** 6])) == set(ids)
+    assert [customer['customer_id'] for customer in database1.get_all_customers()] == sorted(ids)
+    assert len(database1.get_all_customer_rows()) == 12
+
+    with pytest.raises(sqlite3.IntegrityError):
+        database1.insert_customer(_customer(5))
+    assert sum(_shard_sizes(shards)) == 12
+
+def test_sharded_writes(shards):
+    """
+    Test if renames and deletions keep the directory in step, and only best-effort wallet batches span the shards.
+    """
+    inserted = [database1.insert_customer(_customer(number)) for number in range(8)]
+    first, second = inserted[0]['customer_id'], inserted[1]['customer_id']
+
+    assert database1.update_customer(first, {"username": "renamed"})['username'] == 'renamed'
+    assert database1.get_customer_by_username('customer0') == {}
+    assert database1.get_customer_by_username('renamed')['customer_id'] == first
+    assert 'error' in database1.update_customer(second, {"username": "renamed"})
+    assert database1.get_customer_by_username('customer1')['customer_id'] == second
+
+    ids = [customer['customer_id'] for customer in inserted]
+    credits = [{"customer_id": customer_id, "delta": 10} for customer_id in ids]
+    refused = database1.apply_wallet_deltas(credits)
+    assert 'failed' not in refused and len(refused['shards']) > 1
+    assert sorted(index for indexes in refused['shards'] for index in indexes) == list(range(len(ids)))
+    for indexes in refused['shards']:
+        assert len({shards.shard_of(ids[index]) for index in indexes}) == 1
+    assert database1.get_customer_by_id(first)['wallet_balance'] == 0
+    result = database1.apply_wallet_deltas(credits, atomic=False)
+    assert result['balances'] == {customer_id: 10 for customer_id in ids}
+
+    neighbour = next(customer_id for customer_id in ids[2:] if shards.shard_of(customer_id) == shards.shard_of(first))
+    rejected = database1.apply_wallet_deltas([{"customer_id": first, "delta": 5},
+                                              {"customer_id": neighbour, "delta": -50}])
+    assert rejected['failed'][0]['index'] == 1
+    assert database1.get_customer_by_id(first)['wallet_balance'] == 10
+    assert database1.apply_wallet_deltas([{"customer_id": first, "delta": 5},
+                                          {"customer_id": neighbour, "delta": -5}])['failed'] == []
+    assert database1.charge_customer_wallet(second, 5)['wallet_balance'] == 15
+
+    database1.delete_customer(first)
+    assert database1.get_customer_by_username('renamed') == {}
+    assert database1.insert_customer(dict(_customer(0), username='renamed'))['customer_id'] > max(ids)
+
+def test_reshard(tmp_path, monkeypatch):
+    """
+    Test if resharding moves every customer to its new shard, and IDs keep increasing across layouts.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database1, 'customer_cache', None)
+    monkeypatch.setattr(database1, 'customer_shards', ShardLayout(1))
+    database1.create_customers_table()
+    ids = [database1.insert_customer(_customer(number))['customer_id'] for number in range(20)]
+    database1.delete_customer(ids.pop())
+
+    result = reshard(4, ShardLayout(1))
+    assert result['customers'] == _shard_sizes(ShardLayout(4))
+    assert sum(result['customers']) == 19 and result['moved'] > 0
+    assert reshard(4, ShardLayout(4))['moved'] == 0
+
+    monkeypatch.setattr(database1, 'customer_shards', ShardLayout(4))
+    assert [customer['customer_id'] for customer in database1.get_all_customers()] == ids
+    assert database1.get_customer_by_username('customer7')['customer_id'] == ids[7]
+    new_id = database1.insert_customer(_customer(99))['customer_id']
+    assert new_id == 21
+
+    result = reshard(1, ShardLayout(4))
+    assert result['customers'] == [20]
+    assert _shard_sizes(ShardLayout(4))[1:] == [0, 0, 0]
+    monkeypatch.setattr(database1, 'customer_shards', ShardLayout(1))
+    assert database1.get_customer_by_username('customer99')['customer_id'] == new_id
+    assert database1.insert_customer(_customer(100))['customer_id'] == 22
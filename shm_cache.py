@@ -0,0 +1,313 @@
+"""
+Module that contains a cache shared by all the worker processes of the services on a machine.
+
+The cache is a hash table in a memory-mapped file, so every process mapping the file sees the same entries and a
+row read by one worker is a hit for all the others. The table has a fixed number of fixed-size slots; a key can
+live in any of PROBE_SLOTS consecutive slots from its hash, and a new entry takes an empty or expired slot there,
+or else evicts the value closest to expiring. Entries expire after their time to live, which bounds staleness for
+writes that bypass invalidation.
+
+Slots are versioned seqlock-style: a writer makes the slot's sequence number odd, writes the entry and makes it
+even again, and a reader copies the slot between two reads of the sequence number, retrying if a write overlapped.
+Readers therefore take no lock. Writers to a slot are serialised by a lock on the slot's byte range of the file
+(on platforms with ``fcntl``) and a lock per process.
+
+Deleting a key leaves a tombstone recording when it was deleted. A value read from the database before that time
+is refused by put, so a reader racing a write cannot cache the row as it was before the write. A tombstone
+expires after the time to live too, and is not evicted for a value before then: a value that finds only live
+tombstones in its slots is not cached.
+
+The cache is enabled by setting ``SHARED_CACHE_DIR`` to a directory, preferably in memory such as ``/dev/shm``.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FILE_HEADER = struct.Struct('<4sII')
+SLOT_HEADER = struct.Struct('<IQdHHI')
+MAGIC = b'SHC1'
+SEQ = struct.Struct('<I')
+EMPTY, VALUE, TOMBSTONE = 0, 1, 2
+
+DEFAULT_SLOTS = 4096
+DEFAULT_SLOT_SIZE = 1024
+DEFAULT_TTL = 30.0
+PROBE_SLOTS = 4
+READ_RETRIES = 8
+
+class SharedCache:
+    """
+    A hash table of byte strings in a memory-mapped file.
+    """
+
+    def __init__(self, path, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE, ttl=DEFAULT_TTL):
+        """
+        Opens the cache file, creating it if it does not exist. An existing file keeps its own number and size
+        of slots.
+
+        :param path: The path of the cache file.
+        :type path: str
+        :param slots: The number of slots.
+        :type slots: int
+        :param slot_size: The size of a slot in bytes, which bounds the size of a key and its value.
+        :type slot_size: int
+        :param ttl: The number of seconds entries stay valid.
+        :type ttl: float
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._file_lock([(0, FILE_HEADER.size)]):
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            header = os.read(self.fd, FILE_HEADER.size)
+            if len(header) == FILE_HEADER.size and FILE_HEADER.unpack(header)[0] == MAGIC:
+                _, slots, slot_size = FILE_HEADER.unpack(header)
+            else:
+                os.ftruncate(self.fd, FILE_HEADER.size + slots * slot_size)
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                os.write(self.fd, FILE_HEADER.pack(MAGIC, slots, slot_size))
+        self.slots = slots
+        self.slot_size = slot_size
+        self.map = mmap.mmap(self.fd, FILE_HEADER.size + slots * slot_size)
+
+    def close(self):
+        """
+        Unmaps and closes the cache file.
+        """
+        self.map.close()
+        os.close(self.fd)
+
+    def _file_lock(self, ranges):
+        """
+        Locks byte ranges of the cache file against other processes, and the cache against other threads.
+
+        The ranges are locked in the order of their offsets, so two processes locking overlapping ranges cannot
+        deadlock.
+
+        :param ranges: The (offset, length) of each range.
+        :type ranges: list
+        :return: A context manager holding the locks.
+        """
+        cache = self
+        ranges = sorted(ranges)
+
+        class Lock:
+            def __enter__(self):
+                cache.lock.acquire()
+                if fcntl is not None:
+                    for start, length in ranges:
+                        fcntl.lockf(cache.fd, fcntl.LOCK_EX, length, start)
+
+            def __exit__(self, exc_type, exc, traceback):
+                if fcntl is not None:
+                    for start, length in reversed(ranges):
+                        fcntl.lockf(cache.fd, fcntl.LOCK_UN, length, start)
+                cache.lock.release()
+
+        return Lock()
+
+    def _hash(self, key):
+        """
+        Hashes a key the same way in every process.
+
+        :param key: The key.
+        :type key: bytes
+        :return: The hash.
+        :rtype: int
+        """
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+    def _offsets(self, key_hash):
+        """
+        Lists the offsets of the slots a key can live in.
+
+        :param key_hash: The hash of the key.
+        :type key_hash: int
+        :return: The offsets.
+        :rtype: list
+        """
+        first = key_hash % self.slots
+        return [FILE_HEADER.size + ((first + i) % self.slots) * self.slot_size for i in range(PROBE_SLOTS)]
+
+    def _probe_ranges(self, key_hash):
+        """
+        Lists the byte ranges of the slots a key can live in: one range, or two when the slots wrap around from
+        the end of the table to its start.
+
+        :param key_hash: The hash of the key.
+        :type key_hash: int
+        :return: The (offset, length) of each range.
+        :rtype: list
+        """
+        first = key_hash % self.slots
+        count = min(PROBE_SLOTS, self.slots)
+        ranges = [(FILE_HEADER.size + first * self.slot_size, min(count, self.slots - first) * self.slot_size)]
+        if first + count > self.slots:
+            ranges.append((FILE_HEADER.size, (first + count - self.slots) * self.slot_size))
+        return ranges
+
+    def _read_slot(self, offset):
+        """
+        Reads a consistent copy of a slot.
+
+        :param offset: The offset of the slot.
+        :type offset: int
+        :return: The slot's flag, key hash, time stamp, key and value, or None if writes kept overlapping.
+        :rtype: tuple or None
+        """
+        for _ in range(READ_RETRIES):
+            seq = SEQ.unpack_from(self.map, offset)[0]
+            if seq & 1:
+                continue
+            _, key_hash, stamp, flag, key_length, value_length = SLOT_HEADER.unpack_from(self.map, offset)
+            start = offset + SLOT_HEADER.size
+            data = self.map[start:start + key_length + value_length]
+            if SEQ.unpack_from(self.map, offset)[0] == seq:
+                return flag, key_hash, stamp, data[:key_length], data[key_length:]
+        return None
+
+    def _write_slot(self, offset, key_hash, stamp, flag, key, value):
+        """
+        Writes a slot, making its sequence number odd for the duration of the write. The caller holds the lock.
+
+        :param offset: The offset of the slot.
+        :type offset: int
+        :param key_hash: The hash of the key.
+        :type key_hash: int
+        :param stamp: The time the entry expires, or the time a tombstone was made.
+        :type stamp: float
+        :param flag: VALUE or TOMBSTONE.
+        :type flag: int
+        :param key: The key.
+        :type key: bytes
+        :param value: The value.
+        :type value: bytes
+        """
+        seq = SEQ.unpack_from(self.map, offset)[0] | 1
+        SEQ.pack_into(self.map, offset, seq)
+        SLOT_HEADER.pack_into(self.map, offset, seq, key_hash, stamp, flag, len(key), len(value))
+        start = offset + SLOT_HEADER.size
+        self.map[start:start + len(key) + len(value)] = key + value
+        SEQ.pack_into(self.map, offset, (seq + 1) & 0xFFFFFFFF)
+
+    def get(self, key):
+        """
+        Looks up a key.
+
+        :param key: The key.
+        :type key: bytes
+        :return: The value, or None if the key is not cached or its entry expired.
+        :rtype: bytes or None
+        """
+        key_hash = self._hash(key)
+        now = time.time()
+        for offset in self._offsets(key_hash):
+            slot = self._read_slot(offset)
+            if slot is None:
+                continue
+            flag, slot_hash, stamp, slot_key, value = slot
+            if slot_hash == key_hash and slot_key == key:
+                return value if flag == VALUE and stamp > now else None
+        return None
+
+    def put(self, key, value, read_at=None):
+        """
+        Caches a value.
+
+        :param key: The key.
+        :type key: bytes
+        :param value: The value.
+        :type value: bytes
+        :param read_at: The time the value was read from the database. The value is not cached if the key was
+                        deleted since.
+        :type read_at: float or None
+        :return: True if the value was cached, False if it is too large or stale.
+        :rtype: bool
+        """
+        if SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+            return False
+        return self._store(key, value, VALUE, read_at)
+
+    def delete(self, key):
+        """
+        Removes a key, leaving a tombstone so that values read before now are not cached again.
+
+        :param key: The key.
+        :type key: bytes
+        """
+        self._store(key, b'', TOMBSTONE, None)
+
+    def _expires(self, flag, stamp):
+        """
+        Computes when a slot's entry expires.
+
+        :param flag: The slot's flag.
+        :type flag: int
+        :param stamp: The slot's time stamp: the time a value expires, or the time a tombstone was made.
+        :type stamp: float
+        :return: The time the entry expires.
+        :rtype: float
+        """
+        return stamp + self.ttl if flag == TOMBSTONE else stamp
+
+    def _store(self, key, value, flag, read_at):
+        """
+        Writes an entry or a tombstone in the best slot for the key.
+
+        :return: True if the entry was written.
+        :rtype: bool
+        """
+        key_hash = self._hash(key)
+        offsets = self._offsets(key_hash)
+        now = time.time()
+        with self._file_lock(self._probe_ranges(key_hash)):
+            target = None
+            expiring = []
+            for offset in offsets:
+                _, slot_hash, stamp, flag_found, key_length, _ = SLOT_HEADER.unpack_from(self.map, offset)
+                start = offset + SLOT_HEADER.size
+                if slot_hash == key_hash and self.map[start:start + key_length] == key:
+                    if flag == VALUE and flag_found == TOMBSTONE and read_at is not None and read_at <= stamp:
+                        return False
+                    target = offset
+                    break
+                expires = self._expires(flag_found, stamp)
+                if flag_found == EMPTY or expires <= now:
+                    target = target if target is not None else offset
+                else:
+                    # Live tombstones are only evicted for other tombstones, the values going first.
+                    expiring.append((flag_found == TOMBSTONE, expires, offset))
+            if target is None:
+                tombstone, _, target = min(expiring)
+                if tombstone and flag == VALUE:
+                    return False
+            self._write_slot(target, key_hash, now + self.ttl if flag == VALUE else now, flag, key, value)
+        return True
+
+
+def open_shared_cache(name):
+    """
+    Opens a shared cache in the directory given by the ``SHARED_CACHE_DIR`` environment variable.
+
+    The time to live of entries is read from ``SHARED_CACHE_TTL``.
+
+    :param name: The name of the cache, which every process sharing it uses.
+    :type name: str
+    :return: The cache, or None if ``SHARED_CACHE_DIR`` is not set.
+    :rtype: SharedCache or None
+    """
+    directory = os.environ.get('SHARED_CACHE_DIR')
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return SharedCache(os.path.join(directory, f"{name}.cache"), ttl=float(os.environ.get('SHARED_CACHE_TTL', DEFAULT_TTL)))
@@ -0,0 +1,143 @@
+import multiprocessing
+import time
+import pytest
+import database2
+from shm_cache import *
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    """
+    Fixture providing the path of a new cache file.
+
+    :return: The path.
+    :rtype: str
+    """
+    return str(tmp_path / 'test.cache')
+
+def put_in_other_process(path):
+    """
+    Caches a value from another process.
+    """
+    SharedCache(path).put(b'shared', b'from child')
+
+def test_put_and_get(cache_path):
+    """
+    Test if values are found by key, and missing or oversized values are not.
+    """
+    cache = SharedCache(cache_path, slots=16, slot_size=128)
+    assert cache.put(b'a', b'1')
+    assert cache.get(b'a') == b'1'
+    assert cache.get(b'b') is None
+    assert not cache.put(b'big', b'x' * 128)
+    assert cache.get(b'big') is None
+
+def test_shared_between_processes(cache_path):
+    """
+    Test if a value cached by another process is visible in this one.
+    """
+    cache = SharedCache(cache_path)
+    process = multiprocessing.get_context('spawn').Process(target=put_in_other_process, args=(cache_path,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert cache.get(b'shared') == b'from child'
+
+def test_delete_refuses_stale_values(cache_path):
+    """
+    Test if a value read before the key was deleted is not cached, but one read afterwards is.
+    """
+    cache = SharedCache(cache_path)
+    read_at = time.time()
+    cache.put(b'a', b'old')
+    cache.delete(b'a')
+    assert cache.get(b'a') is None
+    assert not cache.put(b'a', b'old', read_at)
+    assert cache.put(b'a', b'new', time.time())
+    assert cache.get(b'a') == b'new'
+
+def test_entries_expire(cache_path):
+    """
+    Test if entries are not returned after their time to live.
+    """
+    cache = SharedCache(cache_path, ttl=-1)
+    cache.put(b'a', b'1')
+    assert cache.get(b'a') is None
+
+def test_eviction_when_probe_slots_are_full(cache_path):
+    """
+    Test if a full table keeps accepting values by evicting older entries.
+    """
+    cache = SharedCache(cache_path, slots=PROBE_SLOTS, slot_size=64)
+    for i in range(PROBE_SLOTS + 1):
+        assert cache.put(b'key%d' % i, b'%d' % i)
+    assert cache.get(b'key%d' % PROBE_SLOTS) == b'%d' % PROBE_SLOTS
+    assert sum(cache.get(b'key%d' % i) is not None for i in range(PROBE_SLOTS + 1)) == PROBE_SLOTS
+
+def test_live_tombstones_not_evicted_for_values(cache_path):
+    """
+    Test if values evict other values rather than tombstones, and are not cached when only live tombstones remain.
+    """
+    cache = SharedCache(cache_path, slots=PROBE_SLOTS, slot_size=64)
+    read_at = time.time()
+    cache.delete(b'deleted')
+    for i in range(PROBE_SLOTS):
+        assert cache.put(b'key%d' % i, b'%d' % i)
+    assert cache.get(b'key%d' % (PROBE_SLOTS - 1)) is not None
+    assert not cache.put(b'deleted', b'stale', read_at)
+    for i in range(PROBE_SLOTS):
+        cache.delete(b'key%d' % i)
+    assert not cache.put(b'new', b'value')
+    assert not cache.put(b'deleted', b'stale', read_at)
+
+@pytest.mark.skipif(fcntl is None, reason="file locks need fcntl")
+def test_wrapped_probe_slots_are_locked(cache_path, monkeypatch):
+    """
+    Test if writing a key that hashes into the last slot locks the slots it wraps around to at the start of the
+    table.
+    """
+    cache = SharedCache(cache_path, slots=8, slot_size=64)
+    key = next(b'key%d' % i for i in range(1000) if cache._hash(b'key%d' % i) % 8 == 7)
+    locked = []
+    lockf = fcntl.lockf
+
+    def record(fd, command, length, start):
+        if command == fcntl.LOCK_EX:
+            locked.append((start, length))
+        return lockf(fd, command, length, start)
+
+    monkeypatch.setattr(fcntl, 'lockf', record)
+    assert cache.put(key, b'1')
+    offsets = cache._offsets(cache._hash(key))
+    assert offsets[1] == FILE_HEADER.size
+    for offset in offsets:
+        assert any(start <= offset and offset + 64 <= start + length for start, length in locked)
+    assert cache.get(key) == b'1'
+
+def test_read_during_write_is_a_miss(cache_path):
+    """
+    Test if a slot whose sequence number shows a write in progress is not read.
+    """
+    cache = SharedCache(cache_path, slots=1, slot_size=64)
+    cache.put(b'a', b'1')
+    offset = FILE_HEADER.size
+    SEQ.pack_into(cache.map, offset, SEQ.unpack_from(cache.map, offset)[0] | 1)
+    assert cache.get(b'a') is None
+
+def test_item_cache_invalidated_on_write(tmp_path, monkeypatch):
+    """
+    Test if items are served from the shared cache and dropped from it when their stock changes.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database2, 'item_cache', SharedCache(str(tmp_path / 'inventory.cache')))
+    database2.create_inventory_table()
+    item = database2.add_item({'name': 'Mug', 'category': 'accessories', 'price_per_item': 8.0,
+                               'description': 'A mug', 'count_in_stock': 4})
+    assert database2.get_item_by_id(item['item_id'])['count_in_stock'] == 4
+    assert database2.item_cache.get(b'item:%d' % item['item_id']) is not None
+    database2.deduce_item_from_stock(item['item_id'], 1)
+    assert database2.get_item_by_id(item['item_id'])['count_in_stock'] == 3
+    database2.update_item(str(item['item_id']), {'count_in_stock': 2})
+    assert database2.get_item_by_id(item['item_id'])['count_in_stock'] == 2
+    assert database2.get_item_by_id(str(item['item_id']))['count_in_stock'] == 2
+    assert database2.get_item_by_id('not-an-id') == {}
@@ -0,0 +1,184 @@
+"""
+Module that pushes inventory stock levels to subscribers as they change.
+
+A single background thread per process follows the inventory's change log (see the cdc module), so stock changes
+are picked up whichever process made them: the inventory service itself, or the sales service deducting stock
+through database2. Each change is fanned out to the subscriptions whose filter includes the item. A subscription
+buffers at most one pending event per item, so a burst of changes to an item is delivered as its latest level,
+and it holds a bounded number of items; a subscriber that falls further behind is told to resynchronise instead
+of growing its buffer.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from cdc import wait_for_changes
+
+SUBSCRIPTION_MAX_PENDING = 1000
+TAIL_WAIT_SECONDS = 5
+
+class StockSubscription:
+    """
+    The pending stock events of one subscriber.
+    """
+
+    def __init__(self, item_ids=None, max_pending=SUBSCRIPTION_MAX_PENDING):
+        """
+        :param item_ids: The items the subscriber is interested in, or None for every item.
+        :type item_ids: set or None
+        :param max_pending: The maximum number of items with a pending event.
+        :type max_pending: int
+        """
+        self.item_ids = item_ids
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.overflowed = False
+        self.condition = threading.Condition()
+
+    def wants(self, item_id):
+        """
+        Checks whether the subscriber is interested in an item.
+
+        :param item_id: The unique identifier for the item.
+        :type item_id: int
+        :return: True if events for the item should be delivered.
+        :rtype: bool
+        """
+        return self.item_ids is None or item_id in self.item_ids
+
+    def offer(self, event):
+        """
+        Queues an event, replacing any pending event for the same item.
+
+        :param event: The stock event, with at least an 'item_id'.
+        :type event: dict
+        """
+        with self.condition:
+            item_id = event['item_id']
+            if item_id in self.pending:
+                del self.pending[item_id]
+            elif len(self.pending) >= self.max_pending:
+                self.pending.clear()
+                self.overflowed = True
+            self.pending[item_id] = event
+            self.condition.notify()
+
+    def take(self, timeout=None):
+        """
+        Waits until events are pending and returns them.
+
+        :param timeout: The maximum number of seconds to wait.
+        :type timeout: float or None
+        :return: Whether events were dropped since the last call, and the pending events in the order their
+                 items last changed.
+        :rtype: tuple
+        """
+        with self.condition:
+            if not self.pending and not self.overflowed:
+                self.condition.wait(timeout)
+            events = list(self.pending.values())
+            overflowed = self.overflowed
+            self.pending.clear()
+            self.overflowed = False
+        return overflowed, events
+
+
+class StockBroadcaster:
+    """
+    Follows the inventory's change log and fans stock changes out to subscriptions.
+    """
+
+    def __init__(self, connect):
+        """
+        :param connect: The function opening a connection to the inventory database.
+        :type connect: callable
+        """
+        self.connect = connect
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.seq = None
+
+    def subscribe(self, item_ids=None, max_pending=SUBSCRIPTION_MAX_PENDING):
+        """
+        Registers a subscription, starting to follow the change log if this is the first one.
+
+        :param item_ids: The items the subscriber is interested in, or None for every item.
+        :type item_ids: set or None
+        :param max_pending: The maximum number of items with a pending event.
+        :type max_pending: int
+        :return: The subscription.
+        :rtype: StockSubscription
+        """
+        subscription = StockSubscription(item_ids, max_pending)
+        with self.lock:
+            self.subscriptions.add(subscription)
+            if self.thread is None or not self.thread.is_alive():
+                self.seq = self._last_seq()
+                self.thread = threading.Thread(target=self._follow, name='stock-broadcaster', daemon=True)
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes a subscription. The change log stops being followed once no subscription is left.
+
+        :param subscription: The subscription returned by subscribe.
+        :type subscription: StockSubscription
+        """
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, changes):
+        """
+        Delivers inventory changes to the interested subscriptions.
+
+        :param changes: Changes read from the change log.
+        :type changes: list
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for change in changes:
+            if change['table'] != 'inventory' or change['data'] is None:
+                continue
+            event = {
+                'item_id': change['key'],
+                'count_in_stock': change['data']['count_in_stock'],
+                'version': change['data']['version'],
+            }
+            for subscription in subscriptions:
+                if subscription.wants(event['item_id']):
+                    subscription.offer(event)
+
+    def _last_seq(self):
+        """
+        Finds the position the change log has reached, so that only later changes are pushed.
+
+        :return: The sequence number of the last recorded change, or 0.
+        :rtype: int
+        """
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _follow(self):
+        """
+        Publishes the change log as it grows, for as long as there are subscriptions.
+        """
+        while True:
+            with self.lock:
+                if not self.subscriptions:
+                    self.thread = None
+                    return
+            try:
+                changes = wait_for_changes(self.connect, self.seq, TAIL_WAIT_SECONDS)
+            except Exception as e:
+                print(f"Error following inventory changes: {e}")
+                time.sleep(TAIL_WAIT_SECONDS)
+                changes = []
+            if changes:
+                self.seq = changes[-1]['seq']
+                self.publish(changes)
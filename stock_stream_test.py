@@ -0,0 +1,57 @@
+import pytest
+from stock_stream import *
+from database2 import create_inventory_table, add_item, deduce_item_from_stock, connect_to_db
+
+@pytest.fixture
+def inventory_database(tmp_path, monkeypatch):
+    """
+    Fixture to set up a fresh inventory database in a temporary directory with two items.
+
+    :return: The two items.
+    :rtype: list
+    """
+    monkeypatch.chdir(tmp_path)
+    create_inventory_table()
+    return [add_item({'name': f'Item {n}', 'category': 'food', 'price_per_item': 1.0,
+                      'description': 'Food', 'count_in_stock': 10}) for n in range(2)]
+
+def test_subscription_coalesces_events():
+    """
+    Test if several events for an item are delivered as the latest one.
+    """
+    subscription = StockSubscription()
+    subscription.offer({'item_id': 1, 'count_in_stock': 5})
+    subscription.offer({'item_id': 2, 'count_in_stock': 9})
+    subscription.offer({'item_id': 1, 'count_in_stock': 4})
+    assert subscription.take(0) == (False, [{'item_id': 2, 'count_in_stock': 9}, {'item_id': 1, 'count_in_stock': 4}])
+    assert subscription.take(0) == (False, [])
+
+def test_subscription_overflow():
+    """
+    Test if a subscription holding too many items drops them and asks for a resync.
+    """
+    subscription = StockSubscription(max_pending=2)
+    for item_id in range(3):
+        subscription.offer({'item_id': item_id, 'count_in_stock': 1})
+    assert subscription.take(0) == (True, [{'item_id': 2, 'count_in_stock': 1}])
+
+def test_broadcaster_follows_stock_changes(inventory_database):
+    """
+    Test if stock changes are pushed to the subscriptions interested in the item only.
+    :param inventory_database: Fixture to set up the inventory database.
+    """
+    first, second = inventory_database
+    broadcaster = StockBroadcaster(connect_to_db)
+    everything = broadcaster.subscribe()
+    only_second = broadcaster.subscribe({second['item_id']})
+    deduce_item_from_stock(first['item_id'], 1)
+    deduce_item_from_stock(second['item_id'], 3)
+    events = []
+    while len(events) < 2:
+        overflowed, new_events = everything.take(5)
+        assert new_events
+        events.extend(new_events)
+    assert [(event['item_id'], event['count_in_stock']) for event in events] == [(first['item_id'], 9), (second['item_id'], 7)]
+    assert [event['item_id'] for event in only_second.take(5)[1]] == [second['item_id']]
+    broadcaster.unsubscribe(everything)
+    broadcaster.unsubscribe(only_second)